@@ -0,0 +1,99 @@
+"""
+Admission Control Benchmark - concert let-out surge with and without load shedding
+
+Simulated in real time, without a database: one venue zone sends SURGE
+requests/s while BACKGROUND requests/s arrive spread over 20 other zones, and
+a model matcher takes DRAIN rides/s off the backlog (fed to the controller as
+its sampled backlog, like the real sampler does). Run twice:
+
+- OFF: every request is admitted (how POST /api/ride/request used to behave)
+- ON: AdmissionController with its configured limits (ADMISSION_* env vars)
+
+Reports admitted / shed requests for the venue and for everyone else, the
+peak backlog, the expected wait of the last admitted ride (backlog / drain;
+the cleanup worker cancels rides still unserved after 10 minutes) and the
+cost of admit() itself.
+
+Usage:
+    python bench_admission_control.py [surge_per_second] [background_per_second] [drain_per_second] [seconds]
+"""
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'server'))
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.gettempdir(), "bench_admission_control.db"))
+
+from app.services.admission_control import AdmissionController, AdmissionRejected
+
+VENUE = (37.7786, -122.3893)
+TICK_SECONDS = 0.01
+
+
+async def surge(name: str, enabled: bool, surge_rate: int, background_rate: int, drain_rate: float, seconds: float):
+    controller = AdmissionController()
+    controller.ENABLED = enabled
+    controller.drain_per_second = drain_rate
+    rng = random.Random(42)
+    outcomes = Counter()
+    admit_seconds = 0.0
+    backlog = peak = 0.0
+    owed_surge = owed_background = 0.0
+
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        owed_surge += surge_rate * TICK_SECONDS
+        owed_background += background_rate * TICK_SECONDS
+        backlog = max(0.0, backlog - drain_rate * TICK_SECONDS)
+        controller.backlog = int(backlog)
+        controller._backlog_sampled_at = time.monotonic()
+
+        arrivals = [("venue", VENUE)] * int(owed_surge)
+        arrivals += [("other", (37.70 + rng.randrange(20) * 0.02, -122.45))] * int(owed_background)
+        owed_surge -= int(owed_surge)
+        owed_background -= int(owed_background)
+
+        for who, (latitude, longitude) in arrivals:
+            t0 = time.perf_counter()
+            try:
+                controller.admit(latitude, longitude)
+                outcomes[f"{who}_admitted"] += 1
+                backlog += 1
+            except AdmissionRejected as e:
+                outcomes[f"{who}_{e.status_code}"] += 1
+            admit_seconds += time.perf_counter() - t0
+        peak = max(peak, backlog)
+        await asyncio.sleep(TICK_SECONDS)
+
+    total = sum(outcomes.values())
+    print(f"\n⏱️ {name}: venue {outcomes['venue_admitted']:,} admitted / {outcomes['venue_429']:,} 429 / "
+          f"{outcomes['venue_503']:,} 503; others {outcomes['other_admitted']:,} admitted / "
+          f"{outcomes['other_429'] + outcomes['other_503']:,} shed")
+    print(f"   Backlog peak {peak:,.0f} rides, last admitted ride waits ~{backlog / drain_rate:,.0f}s; "
+          f"admit() {admit_seconds / max(total, 1) * 1_000_000:.2f} µs")
+
+
+async def run(surge_rate: int, background_rate: int, drain_rate: float, seconds: float):
+    logging.disable(logging.INFO)
+    print(f"⏱️ Venue {surge_rate}/s + {background_rate}/s elsewhere for {seconds:g}s, matcher drains {drain_rate:g}/s "
+          f"(backlog limit {AdmissionController.MAX_BACKLOG}, {AdmissionController.ZONE_RATE_PER_SECOND:g}/s per zone, "
+          f"burst {AdmissionController.ZONE_BURST:g})")
+    await surge("OFF", False, surge_rate, background_rate, drain_rate, seconds)
+    await surge("ON", True, surge_rate, background_rate, drain_rate, seconds)
+
+
+def main():
+    surge_rate = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    background_rate = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    drain_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 20
+    seconds = float(sys.argv[4]) if len(sys.argv) > 4 else 10
+    asyncio.run(run(surge_rate, background_rate, drain_rate, seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Connection Registry Benchmark - memory and fan-out latency of the notification channel
+
+Connects N fake users (some with several devices) to the ConnectionManager and
+measures registry memory per connection and notification fan-out latency.
+
+Usage:
+    python bench_connection_registry.py [users] [devices_per_multi_device_user]
+"""
+import asyncio
+import gc
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'server'))
+# The notification outbox imports the database module (nothing is written here)
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.gettempdir(), "bench_connection_registry.db"))
+
+from app.services.connection_manager import ConnectionManager
+
+
+class FakeWebSocket:
+    """Accepts everything instantly and counts frames"""
+
+    __slots__ = ("sent", "delivered")
+
+    def __init__(self, delivered: asyncio.Event = None):
+        self.sent = 0
+        self.delivered = delivered
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data):
+        self.sent += 1
+        if self.delivered:
+            self.delivered.set()
+
+    async def send_json(self, data):
+        await self.send_text(data)
+
+    async def close(self, code=1000):
+        pass
+
+
+async def run(users: int, devices: int):
+    logging.disable(logging.INFO)
+    manager = ConnectionManager()
+    multi_device_users = users // 10  # 10% of users connected from several devices
+
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+
+    connections = 0
+    for user_id in range(users):
+        for device in range(devices if user_id < multi_device_users else 1):
+            await manager.connect_user(user_id, FakeWebSocket(), f"device-{device}")
+            connections += 1
+    await asyncio.sleep(0)  # Let writer tasks reach their first wait
+
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"\n📊 REGISTRY: {users:,} users, {connections:,} connections")
+    print(f"   Memory: {(after - before) / 1024 / 1024:.1f} MiB total, {(after - before) / connections:.0f} bytes/connection")
+
+    # Single-user fan-out: time until every device of one user received the message
+    samples = []
+    for user_id in range(min(1000, multi_device_users)):
+        events = []
+        for connection in manager.user_connections[user_id].values():
+            connection.websocket.delivered = asyncio.Event()
+            events.append(connection.websocket.delivered)
+
+        start = time.perf_counter()
+        await manager.send_to_user(user_id, {"type": "ride_offer_received", "ride": {"id": user_id}})
+        await asyncio.gather(*(event.wait() for event in events))
+        samples.append((time.perf_counter() - start) * 1_000_000)
+
+    if samples:
+        samples.sort()
+        print(f"\n📤 FAN-OUT to {devices} devices ({len(samples)} samples)")
+        print(f"   p50: {statistics.median(samples):.1f} µs   p99: {samples[int(len(samples) * 0.99) - 1]:.1f} µs")
+
+    # Broadcast: one notification to every connected user
+    start = time.perf_counter()
+    for user_id in range(users):
+        await manager.send_to_user(user_id, {"type": "heartbeat_ack"})
+    queued = time.perf_counter() - start
+    while any(connection._queue for devices_ in manager.user_connections.values() for connection in devices_.values()):
+        await asyncio.sleep(0.01)
+    drained = time.perf_counter() - start
+
+    print(f"\n📡 BROADCAST to {users:,} users")
+    print(f"   Enqueue: {queued * 1000:.0f} ms ({queued / users * 1_000_000:.2f} µs/user)")
+    print(f"   Fully delivered: {drained * 1000:.0f} ms")
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    devices = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    asyncio.run(run(users, devices))
+
+
+if __name__ == "__main__":
+    main()
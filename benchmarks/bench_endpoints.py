@@ -0,0 +1,400 @@
+"""
+Endpoint Regression Benchmark - query counts, latency and allocations per endpoint
+
+Runs the app in-process (httpx ASGI transport, no server, no background
+workers) against a freshly seeded dataset and drives every router (auth,
+users, rides, ride_requests) plus the matching engine hot paths through full
+ride lifecycles:
+
+    request -> match -> accept -> start -> complete
+    request -> match -> decline -> cancel
+    create -> cancel
+
+For each step it records SQL statements per call (max), p50/p99 latency and
+the traced allocation peak per call (tracemalloc, measured in a separate pass
+so it does not skew latency), then compares them to the checked-in baseline
+bench_endpoints_baseline.json. Query counts must not grow at all; latency and
+allocations may grow by the ratios under "thresholds" (plus a small absolute
+slack for noise). Exits with status 1 on any regression, so it can gate CI.
+
+The database is a scratch SQLite file unless BENCH_DATABASE_URL points to an
+EMPTY, disposable database (baselines are kept per dialect). Seeded users share
+a low-cost bcrypt hash so logins are not all bcrypt; register/create_user still
+pay the real cost and run every BCRYPT_EVERY rounds only.
+
+Usage:
+    python bench_endpoints.py [rounds] [--update-baseline]
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+_scratch = tempfile.mkdtemp(prefix="bench_endpoints_")
+os.environ["DATABASE_URL"] = os.getenv("BENCH_DATABASE_URL", f"sqlite:///{_scratch}/bench.db")
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ["DATABASE_REPLICA_URLS"] = ""
+os.environ["GPS_TRAIL_DIR"] = os.path.join(_scratch, "gps_trails")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'server'))
+
+import bcrypt
+import httpx
+from sqlalchemy import event, func, insert, select
+
+from app.main import app
+from app.db.database import AsyncSessionLocal, SessionLocal, async_engine, engine
+from app.db.models import Ride, User
+from app.services.driver_liveness import driver_liveness
+from app.services.matching_engine import matching_engine
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "bench_endpoints_baseline.json")
+
+# Dataset (part of the baseline - changing it means --update-baseline)
+SEED = 42
+RIDERS = 1000
+DRIVERS = 200
+HISTORY_RIDES = 20000
+CITY_CENTER = (37.7749, -122.4194)
+PASSWORD = "bench-password"
+
+WARMUP_ROUNDS = 5
+ALLOC_ROUNDS = 20
+BCRYPT_EVERY = 10
+
+DEFAULT_THRESHOLDS = {
+    "queries": 0,       # Any extra statement is a regression
+    "p50_ms": 0.5,      # Allowed growth ratio
+    "p99_ms": 1.0,
+    "alloc_kb": 0.25,
+    "slack_ms": 1.0,    # Absolute slack on top of the ratios (timer and scheduler noise)
+    "slack_kb": 16
+}
+
+_statements = [0]
+
+
+def count_statement(*args):
+    _statements[0] += 1
+
+
+event.listen(engine, "before_cursor_execute", count_statement)
+event.listen(async_engine.sync_engine, "before_cursor_execute", count_statement)
+
+
+# ============================================
+# DATASET
+# ============================================
+
+def seed() -> dict:
+    """Riders and drivers around one city center plus finished ride history"""
+    rng = random.Random(SEED)
+    hashed_password = bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt(4)).decode('utf-8')
+    now = datetime.utcnow()
+
+    def near_center(spread: float) -> tuple:
+        return CITY_CENTER[0] + rng.uniform(-spread, spread), CITY_CENTER[1] + rng.uniform(-spread, spread)
+
+    db = SessionLocal()
+    try:
+        if db.scalar(select(func.count(User.id))):
+            raise SystemExit("❌ BENCH_DATABASE_URL must point to an empty database")
+
+        users = []
+        for i in range(RIDERS + DRIVERS):
+            is_driver = i >= RIDERS
+            latitude, longitude = near_center(0.03)
+            users.append({
+                "username": f"bench_{'driver' if is_driver else 'rider'}_{i}",
+                "email": f"bench_{i}@example.com",
+                "hashed_password": hashed_password,
+                "is_driver": is_driver,
+                "availability": is_driver,
+                "latitude": latitude if is_driver else None,
+                "longitude": longitude if is_driver else None,
+                "vehicle": "Sedan" if is_driver else None,
+                "created_at": now - timedelta(days=365)
+            })
+        db.execute(insert(User), users)
+        db.commit()
+
+        riders = db.scalars(select(User.id).filter(User.is_driver == False).order_by(User.id)).all()
+        drivers = db.scalars(select(User.id).filter(User.is_driver == True).order_by(User.id)).all()
+
+        rides = []
+        for _ in range(HISTORY_RIDES):
+            created_at = now - timedelta(minutes=rng.uniform(120, 90 * 24 * 60))
+            completed = rng.random() < 0.9
+            start_lat, start_lng = near_center(0.05)
+            end_lat, end_lng = near_center(0.05)
+            rides.append({
+                "rider_id": rng.choice(riders),
+                "driver_id": rng.choice(drivers),
+                "start_location": "Pickup",
+                "start_lat": start_lat,
+                "start_lng": start_lng,
+                "end_location": "Dropoff",
+                "end_lat": end_lat,
+                "end_lng": end_lng,
+                "status": "completed" if completed else "cancelled",
+                "offer_attempts": 1,
+                "created_at": created_at,
+                "completed_at": created_at + timedelta(minutes=20) if completed else None,
+                "cancelled_at": None if completed else created_at + timedelta(minutes=2),
+                "fare": round(rng.uniform(8, 60), 2) if completed else None
+            })
+        for start in range(0, len(rides), 5000):
+            db.execute(insert(Ride), rides[start:start + 5000])
+        db.commit()
+
+        history = db.scalars(select(Ride.id).order_by(Ride.id)).all()
+        return {"riders": riders, "drivers": drivers, "history": history}
+    finally:
+        db.close()
+
+
+def offered_driver(ride_id: int) -> int:
+    db = SessionLocal()
+    try:
+        return db.scalar(select(Ride.offered_to_driver_id).filter(Ride.id == ride_id))
+    finally:
+        db.close()
+
+
+# ============================================
+# MEASUREMENT
+# ============================================
+
+class Recorder:
+    """Per-step samples; allocations only while tracemalloc is tracing"""
+
+    def __init__(self):
+        self.samples = defaultdict(lambda: {"ms": [], "queries": [], "alloc_kb": []})
+
+    async def step(self, name: str, call):
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            allocated_before = tracemalloc.get_traced_memory()[0]
+        statements_before = _statements[0]
+        start = time.perf_counter()
+
+        result = await call()
+        if isinstance(result, httpx.Response):
+            await result.aread()
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        sample = self.samples[name]
+        sample["queries"].append(_statements[0] - statements_before)
+        if tracing:
+            sample["alloc_kb"].append((tracemalloc.get_traced_memory()[1] - allocated_before) / 1024)
+        else:
+            sample["ms"].append(elapsed_ms)
+
+        if isinstance(result, httpx.Response) and not result.is_success:
+            raise RuntimeError(f"{name}: HTTP {result.status_code} {result.text}")
+        if isinstance(result, httpx.Response):
+            return result.json() if result.headers.get("content-type") == "application/json" else result.text
+        return result
+
+    def results(self) -> dict:
+        results = {}
+        for name, sample in sorted(self.samples.items()):
+            latencies = sorted(sample["ms"])
+            results[name] = {
+                "calls": len(latencies),
+                "queries": max(sample["queries"]),
+                "p50_ms": round(statistics.median(latencies), 3),
+                "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 3),
+                "alloc_kb": round(statistics.median(sample["alloc_kb"]), 1) if sample["alloc_kb"] else None
+            }
+        return results
+
+
+async def match(recorder: Recorder, drivers: list):
+    for driver_id in drivers:
+        driver_liveness.touch(driver_id)  # No sockets in-process - keep every driver a candidate
+
+    async def process_next_ride():
+        async with AsyncSessionLocal() as db:
+            await matching_engine._process_next_ride(db)
+
+    await recorder.step("matching_engine.match", process_next_ride)
+
+
+async def run_round(client: httpx.AsyncClient, recorder: Recorder, data: dict, rng: random.Random, round_number: int):
+    """Every scenario once"""
+    riders, drivers, history = data["riders"], data["drivers"], data["history"]
+    rider_index = round_number % len(riders)
+    rider_id = riders[rider_index]
+    idle_driver_id = drivers[-1 - round_number % 10]
+
+    # auth / users
+    login = await recorder.step("auth.login", lambda: client.post(
+        "/api/auth/login", json={"email": f"bench_{rider_index}@example.com", "password": PASSWORD}
+    ))
+    rider_auth = {"Authorization": f"Bearer {login['access_token']}"}  # Rider calls below skip the user lookup
+    if round_number % BCRYPT_EVERY == 0:
+        username = f"bench_new_{round_number}_{rng.randrange(10 ** 9)}"
+        await recorder.step("auth.register", lambda: client.post(
+            "/api/auth/register",
+            json={"username": username, "email": f"{username}@example.com", "password": PASSWORD, "is_driver": False}
+        ))
+        await recorder.step("users.create", lambda: client.post(
+            "/api/users/",
+            json={"username": f"{username}_u", "email": f"{username}_u@example.com", "password": PASSWORD, "is_driver": False}
+        ))
+    await recorder.step("users.get", lambda: client.get(f"/api/users/{rng.choice(riders)}"))
+    await recorder.step("users.location", lambda: client.put(
+        f"/api/users/{idle_driver_id}/location",
+        json={"latitude": CITY_CENTER[0] + rng.uniform(-0.03, 0.03), "longitude": CITY_CENTER[1] + rng.uniform(-0.03, 0.03)}
+    ))
+    await recorder.step("users.availability", lambda: client.put(
+        f"/api/users/{idle_driver_id}/availability", json={"availability": True}
+    ))
+
+    # rides (reads)
+    history_ride_id = rng.choice(history)
+    await recorder.step("rides.get", lambda: client.get(f"/api/rides/{history_ride_id}"))
+    await recorder.step("rides.trail", lambda: client.get(f"/api/rides/{history_ride_id}/trail"))
+    await recorder.step("rides.list", lambda: client.get("/api/rides/", params={"limit": 50}))
+    await recorder.step("rides.list_rider", lambda: client.get(
+        "/api/rides/", params={"rider_id": rng.choice(riders), "status": "completed"}
+    ))
+    await recorder.step("rides.export_rider", lambda: client.get("/api/rides/export", params={"rider_id": rng.choice(riders)}))
+
+    # request -> match -> accept -> start -> complete
+    pickup = (CITY_CENTER[0] + rng.uniform(-0.02, 0.02), CITY_CENTER[1] + rng.uniform(-0.02, 0.02))
+    ride_request = {
+        "source_location": "Pickup", "dest_location": "Dropoff", "user_id": rider_id,
+        "pickup_lat": pickup[0], "pickup_lng": pickup[1],
+        "dest_lat": CITY_CENTER[0], "dest_lng": CITY_CENTER[1]
+    }
+    ride = await recorder.step("ride_requests.request", lambda: client.post("/api/ride/request", json=ride_request, headers=rider_auth))
+    await match(recorder, drivers)
+    driver_id = offered_driver(ride["id"])
+    await recorder.step("rides.accept", lambda: client.put(f"/api/rides/{ride['id']}/accept", json={"driver_id": driver_id}))
+    await recorder.step("rides.start", lambda: client.put(f"/api/rides/{ride['id']}/start"))
+    await recorder.step("rides.complete", lambda: client.put(f"/api/rides/{ride['id']}/complete", params={"fare": 18.5}))
+
+    # request -> match -> decline -> cancel
+    ride = await recorder.step("ride_requests.request", lambda: client.post("/api/ride/request", json=ride_request, headers=rider_auth))
+    await match(recorder, drivers)
+    driver_id = offered_driver(ride["id"])
+    await recorder.step("rides.decline", lambda: client.put(f"/api/rides/{ride['id']}/decline", json={"driver_id": driver_id}))
+    await recorder.step("rides.cancel", lambda: client.put(f"/api/rides/{ride['id']}/cancel"))
+
+    # create -> cancel (rides without coordinates must not sit at the head of the matcher's queue)
+    ride = await recorder.step("rides.create", lambda: client.post(
+        "/api/rides/", params={"rider_id": rider_id}, json={"start_location": "Pickup", "end_location": "Dropoff"},
+        headers=rider_auth
+    ))
+    await recorder.step("rides.cancel", lambda: client.put(f"/api/rides/{ride['id']}/cancel"))
+
+
+# ============================================
+# BASELINE
+# ============================================
+
+def compare(results: dict, baseline: dict, thresholds: dict) -> list:
+    """Print every step against its baseline; returns the regressions"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            print(f"🆕 {name}: {result['queries']} queries, p50 {result['p50_ms']:.2f} ms, "
+                  f"p99 {result['p99_ms']:.2f} ms, alloc {result['alloc_kb']} KB (no baseline)")
+            continue
+
+        failed = []
+        if result["queries"] > base["queries"] + thresholds["queries"]:
+            failed.append(f"queries {base['queries']} -> {result['queries']}")
+        for metric, slack in (("p50_ms", "slack_ms"), ("p99_ms", "slack_ms"), ("alloc_kb", "slack_kb")):
+            if result[metric] is None or base.get(metric) is None:
+                continue
+            if result[metric] > base[metric] * (1 + thresholds[metric]) + thresholds[slack]:
+                failed.append(f"{metric} {base[metric]} -> {result[metric]}")
+
+        print(f"{'❌' if failed else '✅'} {name}: {result['queries']} queries ({base['queries']}), "
+              f"p50 {result['p50_ms']:.2f} ms ({base['p50_ms']:.2f}), p99 {result['p99_ms']:.2f} ms ({base['p99_ms']:.2f}), "
+              f"alloc {result['alloc_kb']} KB ({base.get('alloc_kb')})")
+        regressions.extend(f"{name}: {failure}" for failure in failed)
+
+    for name in sorted(set(baseline) - set(results)):
+        print(f"⚠️ {name}: in the baseline but not measured")
+    return regressions
+
+
+async def run(rounds: int) -> dict:
+    data = seed()
+    rng = random.Random(SEED)
+    recorder = Recorder()
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for round_number in range(WARMUP_ROUNDS):
+            await run_round(client, Recorder(), data, rng, round_number)
+
+        start = time.perf_counter()
+        for round_number in range(rounds):
+            await run_round(client, recorder, data, rng, round_number)
+        print(f"\n⏱️ {rounds} rounds in {time.perf_counter() - start:.2f}s")
+
+        tracemalloc.start()
+        try:
+            for round_number in range(ALLOC_ROUNDS):
+                await run_round(client, recorder, data, rng, round_number)
+        finally:
+            tracemalloc.stop()
+
+    await async_engine.dispose()
+    return recorder.results()
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    rounds = int(args[0]) if args else 200
+    update = "--update-baseline" in sys.argv
+
+    logging.disable(logging.WARNING)  # The matcher logs every offer
+    matching_engine.set_websocket_manager(None)
+
+    dialect = engine.dialect.name
+    print(f"⏱️ Seeding {RIDERS} riders, {DRIVERS} drivers, {HISTORY_RIDES} finished rides ({dialect})")
+    results = asyncio.run(run(rounds))
+
+    baselines = {"thresholds": DEFAULT_THRESHOLDS}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baselines = json.load(f)
+
+    if update:
+        baselines[dialect] = {
+            "dataset": {"riders": RIDERS, "drivers": DRIVERS, "history_rides": HISTORY_RIDES, "rounds": rounds},
+            "steps": results
+        }
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\n💾 Baseline for {dialect} written to {BASELINE_PATH}")
+        return
+
+    regressions = compare(results, baselines.get(dialect, {}).get("steps", {}), {**DEFAULT_THRESHOLDS, **baselines.get("thresholds", {})})
+    if regressions:
+        print(f"\n❌ {len(regressions)} regression(s):")
+        for regression in regressions:
+            print(f"   {regression}")
+        sys.exit(1)
+    print("\n✅ No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Event-Loop Stall Benchmark - sync vs async database access from coroutines
+
+Runs the matching engine's hot queries (ride claim + driver candidate lookup)
+from N concurrent coroutines, once through the blocking SessionLocal (how the
+matcher and the accept/decline handlers used to work) and once through
+AsyncSessionLocal, while a probe coroutine measures how late the loop wakes it.
+Every millisecond of probe lateness is a millisecond in which no WebSocket
+frame was sent or received.
+
+Uses DATABASE_URL from the environment / .env (read-only queries).
+
+Usage:
+    python bench_event_loop_stall.py [concurrency] [iterations_per_worker]
+"""
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'server'))
+
+from sqlalchemy import select
+
+from app.db.database import SessionLocal, AsyncSessionLocal, async_engine
+from app.db.models import Ride, User
+
+PROBE_INTERVAL_SECONDS = 0.005
+
+
+def claim_query():
+    return select(Ride).filter(
+        Ride.status == "requested",
+        Ride.current_offer_driver_id == None
+    ).order_by(Ride.created_at.asc()).limit(1).with_for_update(skip_locked=True)
+
+
+def candidates_query():
+    return select(User).filter(User.is_driver == True, User.availability == True)
+
+
+async def sync_worker(iterations: int):
+    for _ in range(iterations):
+        db = SessionLocal()
+        try:
+            db.execute(claim_query()).scalars().first()
+            db.execute(candidates_query()).scalars().all()
+            db.rollback()
+        finally:
+            db.close()
+        await asyncio.sleep(0)
+
+
+async def async_worker(iterations: int):
+    for _ in range(iterations):
+        db = AsyncSessionLocal()
+        try:
+            (await db.execute(claim_query())).scalars().first()
+            (await db.execute(candidates_query())).scalars().all()
+            await db.rollback()
+        finally:
+            await db.close()
+
+
+async def probe(lateness: list, done: asyncio.Event):
+    while not done.is_set():
+        expected = time.perf_counter() + PROBE_INTERVAL_SECONDS
+        await asyncio.sleep(PROBE_INTERVAL_SECONDS)
+        lateness.append(max(0.0, time.perf_counter() - expected) * 1000)
+
+
+async def measure(name: str, worker, concurrency: int, iterations: int):
+    lateness = []
+    done = asyncio.Event()
+    probe_task = asyncio.create_task(probe(lateness, done))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(iterations) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await probe_task
+
+    lateness.sort()
+    stalled = sum(lateness)
+    print(f"\n⏱️ {name}: {concurrency * iterations * 2:,} queries in {elapsed:.2f}s ({concurrency * iterations * 2 / elapsed:,.0f} queries/s)")
+    print(f"   Probe lateness: p50 {statistics.median(lateness):.2f} ms, p99 {lateness[min(len(lateness) - 1, int(len(lateness) * 0.99))]:.2f} ms, max {lateness[-1]:.1f} ms")
+    print(f"   Loop stalled {stalled:.0f} ms of {elapsed * 1000:.0f} ms ({stalled / (elapsed * 1000) * 100:.0f}%)")
+
+
+async def run(concurrency: int, iterations: int):
+    logging.disable(logging.INFO)
+
+    # Warm both pools so connection setup is not measured
+    await measure("warm-up (sync)", sync_worker, concurrency, 1)
+    await measure("warm-up (async)", async_worker, concurrency, 1)
+
+    await measure("SYNC SessionLocal on the loop", sync_worker, concurrency, iterations)
+    await measure("ASYNC AsyncSessionLocal", async_worker, concurrency, iterations)
+    await async_engine.dispose()
+
+
+def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    asyncio.run(run(concurrency, iterations))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Location Ingest Benchmark - per-driver PUTs vs bulk JSON / NDJSON / binary batches
+
+Sends positions for N drivers through the users router in-process (httpx over
+ASGI, no network and no database - both endpoints only touch the location
+buffer) and reports positions/s for:
+
+- SINGLE: PUT /api/users/{id}/location, one request per position
+- JSON / NDJSON / BINARY: POST /api/users/locations with batches of B positions
+
+plus the decode + buffer time per position inside the bulk endpoint, which is
+what bounds a node once HTTP overhead is amortised over a batch.
+
+Usage:
+    python bench_location_ingest.py [positions] [batch_size] [drivers]
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'server'))
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.gettempdir(), "bench_location_ingest.db"))
+os.environ["LOCATION_GATEWAYS"] = "bench:bench-secret:*"  # One gateway allowed to report every driver
+
+import httpx
+from fastapi import FastAPI
+
+from app.api import users
+from app.services import location_codec
+from app.services.location_buffer import location_buffer
+from app.services.location_gateways import location_gateways
+
+SINGLE_POSITIONS = 2_000  # One request each - enough for a stable rate
+
+
+def gateway_headers(body: bytes, content_type: str) -> dict:
+    timestamp = str(int(time.time()))
+    signature = location_gateways.sign(location_gateways.gateways["bench"].key, timestamp, body)
+    return {"Content-Type": content_type, "X-Gateway-Id": "bench", "X-Gateway-Signature": f"t={timestamp},v1={signature}"}
+
+
+def make_positions(count: int, drivers: int, rng: random.Random) -> list:
+    first_ms = location_codec.now_ms() - count  # One position per ms, all in the past
+    return [
+        (rng.randint(1, drivers), 37.7 + rng.random() * 0.2, -122.5 + rng.random() * 0.2, first_ms + i)
+        for i in range(count)
+    ]
+
+
+def encode(batch: list, content_type: str) -> bytes:
+    if content_type == location_codec.CONTENT_BINARY:
+        return b"".join(
+            location_codec.POSITION_RECORD.pack(
+                driver_id, round(lat * location_codec.COORD_SCALE), round(lng * location_codec.COORD_SCALE), ts
+            )
+            for driver_id, lat, lng, ts in batch
+        )
+    items = [{"driver_id": driver_id, "latitude": lat, "longitude": lng, "timestamp": ts} for driver_id, lat, lng, ts in batch]
+    if content_type == location_codec.CONTENT_JSON:
+        return json.dumps(items).encode()
+    return "\n".join(json.dumps(item) for item in items).encode()
+
+
+async def single(client: httpx.AsyncClient, positions: list):
+    start = time.perf_counter()
+    for driver_id, lat, lng, _ in positions[:SINGLE_POSITIONS]:
+        response = await client.put(f"/api/users/{driver_id}/location", json={"latitude": lat, "longitude": lng})
+        assert response.status_code == 200
+    elapsed = time.perf_counter() - start
+    print(f"\n⏱️ SINGLE: {SINGLE_POSITIONS / elapsed:,.0f} positions/s ({elapsed / SINGLE_POSITIONS * 1000:.2f} ms per request)")
+
+
+async def bulk(client: httpx.AsyncClient, name: str, content_type: str, positions: list, batch_size: int):
+    bodies = [encode(positions[i:i + batch_size], content_type) for i in range(0, len(positions), batch_size)]
+    headers = [gateway_headers(body, content_type) for body in bodies]
+    location_buffer._timestamps.clear()  # Same timestamps every run: keep them from counting as stale
+
+    accepted = rejected = 0
+    start = time.perf_counter()
+    for body, body_headers in zip(bodies, headers):
+        response = await client.post("/api/users/locations", content=body, headers=body_headers)
+        result = response.json()
+        accepted += result["accepted"]
+        rejected += result["rejected"]
+    elapsed = time.perf_counter() - start
+
+    t0 = time.perf_counter()
+    for body in bodies:
+        rows, _ = location_codec.decode_position_batch(body, content_type, location_codec.now_ms())
+        location_buffer.update_many(rows)
+    decode = time.perf_counter() - t0
+
+    size = sum(len(body) for body in bodies)
+    print(f"\n⏱️ {name}: {len(positions) / elapsed:,.0f} positions/s over HTTP ({accepted:,} accepted, {rejected:,} rejected, "
+          f"{size / len(positions):.0f} bytes/position)")
+    print(f"   Decode + validate + buffer: {decode / len(positions) * 1_000_000:.2f} µs/position "
+          f"({len(positions) / decode:,.0f} positions/s)")
+
+
+async def run(count: int, batch_size: int, drivers: int):
+    logging.disable(logging.INFO)
+    app = FastAPI()
+    app.include_router(users.router, prefix="/api/users")
+    positions = make_positions(count, drivers, random.Random(42))
+    print(f"⏱️ {count:,} positions for {drivers:,} drivers, batches of {batch_size:,}")
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        await single(client, positions)
+        await bulk(client, "JSON", location_codec.CONTENT_JSON, positions, batch_size)
+        await bulk(client, "NDJSON", location_codec.CONTENT_NDJSON[0], positions, batch_size)
+        await bulk(client, "BINARY", location_codec.CONTENT_BINARY, positions, batch_size)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 5_000
+    drivers = int(sys.argv[3]) if len(sys.argv) > 3 else 50_000
+    asyncio.run(run(count, batch_size, drivers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Password Hasher Benchmark - login storm vs unrelated sync endpoints
+
+N concurrent "logins" (bcrypt.checkpw) run for a few seconds while a probe
+measures how long an unrelated sync endpoint waits for a threadpool slot
+(anyio.to_thread.run_sync of a no-op, which is how FastAPI runs sync handlers).
+Compared:
+
+- THREADPOOL: checkpw inline in a sync handler (how login used to work) -
+  every login holds one of the 40 shared threadpool slots while hashing
+- PROCESS_POOL: await password_hasher.verify() from an async handler - the
+  work runs in PASSWORD_HASH_WORKERS processes and no thread is held
+
+Reports logins/s, probe p50/p99 and (PROCESS_POOL) the hasher's queue time
+and admission rejections. Login throughput is bounded by cores either way;
+the difference is what everyone else sees meanwhile.
+
+Usage:
+    python bench_password_hasher.py [concurrency] [seconds] [bcrypt_rounds]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'server'))
+
+import anyio
+import bcrypt
+
+from app.services.password_hasher import PasswordHasherOverloaded, password_hasher
+
+
+async def storm(name: str, login, hashed: bytes, concurrency: int, seconds: float):
+    start = time.perf_counter()
+    deadline = start + seconds
+    logins = rejected = 0
+    probes = []
+
+    async def client():
+        nonlocal logins, rejected
+        while time.perf_counter() < deadline:
+            try:
+                assert await login(hashed)
+                logins += 1
+            except PasswordHasherOverloaded as e:
+                rejected += 1
+                await asyncio.sleep(e.retry_after)  # Clients honour Retry-After
+
+    async def probe():
+        while time.perf_counter() < deadline:
+            waited = time.perf_counter()
+            await anyio.to_thread.run_sync(lambda: None)
+            probes.append((time.perf_counter() - waited) * 1000)
+            await asyncio.sleep(0.005)
+
+    await asyncio.gather(probe(), *(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start  # Includes draining the logins in flight at the deadline
+
+    probes.sort()
+    print(f"\n⏱️ {name}: {logins / elapsed:,.1f} logins/s over {elapsed:.1f}s ({rejected} rejected)")
+    print(f"   Unrelated sync endpoint wait: p50 {statistics.median(probes):.2f} ms, "
+          f"p99 {probes[min(len(probes) - 1, int(len(probes) * 0.99))]:.2f} ms ({len(probes)} probes)")
+
+
+async def threadpool_login(hashed: bytes) -> bool:
+    return await anyio.to_thread.run_sync(bcrypt.checkpw, b"password", hashed)
+
+
+async def process_pool_login(hashed: bytes) -> bool:
+    return await password_hasher.verify("password", hashed.decode("utf-8"))
+
+
+async def run(concurrency: int, seconds: float, rounds: int):
+    hashed = bcrypt.hashpw(b"password", bcrypt.gensalt(rounds))
+    print(f"⏱️ {concurrency} concurrent logins for {seconds:g}s, bcrypt rounds {rounds}, "
+          f"{password_hasher.WORKERS} hasher workers, max {password_hasher.MAX_PENDING} pending")
+
+    await storm("THREADPOOL", threadpool_login, hashed, concurrency, seconds)
+
+    await password_hasher.start()
+    try:
+        await storm("PROCESS_POOL", process_pool_login, hashed, concurrency, seconds)
+        stats = password_hasher.get_stats()
+        print(f"   Hasher queue: p50 {stats['queue_ms']['p50']} ms, p99 {stats['queue_ms']['p99']} ms; "
+              f"run p50 {stats['run_ms']['p50']} ms")
+    finally:
+        await password_hasher.stop()
+
+
+def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 12
+    asyncio.run(run(concurrency, seconds, rounds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Ride Detail Benchmark - separate queries vs one joined query under concurrency
+
+Loads ride details (ride + rider + driver, the GET /api/rides/{ride_id}
+payload) from N concurrent threads, once the old way (three queries, users
+attached by hand) and once through db.queries.get_ride_detail() (one LEFT
+OUTER JOIN with only the UserResponse columns), and reports throughput,
+p50/p99 latency and SQL statements per request.
+
+Before timing anything it checks that the ride detail returned by GET, accept,
+cancel and complete costs exactly one SQL statement, serialization included,
+and exits with status 1 if any of them regressed.
+
+Uses DATABASE_URL from the environment / .env (read-only; needs some rides).
+
+Usage:
+    python bench_ride_detail.py [concurrency] [requests_per_thread]
+"""
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'server'))
+
+from sqlalchemy import event, select
+
+from app.core.serialization import serialize_ride
+from app.db.database import AsyncSessionLocal, SessionLocal, async_engine, engine
+from app.db.models import Ride, User
+from app.db.queries import get_ride_detail, get_ride_detail_async
+
+EXPECTED_STATEMENTS = 1  # Per ride detail response
+
+_statements = threading.local()
+
+
+@event.listens_for(engine, "before_cursor_execute")
+@event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+def count_statement(*args):
+    _statements.count = getattr(_statements, "count", 0) + 1
+
+
+def separate_queries(db, ride_id: int):
+    ride = db.query(Ride).filter(Ride.id == ride_id).first()
+    ride.rider = db.query(User).filter(User.id == ride.rider_id).first()
+    ride.driver = db.query(User).filter(User.id == ride.driver_id).first() if ride.driver_id else None
+    return ride
+
+
+def joined_query(db, ride_id: int):
+    return get_ride_detail(db, ride_id)
+
+
+def worker(load, ride_ids: list, offset: int, requests: int) -> tuple:
+    latencies = []
+    _statements.count = 0
+    for i in range(requests):
+        db = SessionLocal()
+        try:
+            start = time.perf_counter()
+            load(db, ride_ids[(offset + i) % len(ride_ids)])
+            latencies.append((time.perf_counter() - start) * 1000)
+        finally:
+            db.close()
+    return latencies, _statements.count
+
+
+def sync_detail_statements(ride_id: int, after_write: bool) -> int:
+    """
+    Statements for get_ride_detail + serialize_ride on a sync session
+
+    after_write reproduces cancel / complete: transition() left the ride in the
+    session and the commit expired it before the detail is loaded.
+    """
+    db = SessionLocal()
+    try:
+        if after_write:
+            db.execute(select(Ride).filter(Ride.id == ride_id)).scalars().first()
+            db.expire_all()  # What the endpoint's commit does (nothing is written here)
+        _statements.count = 0
+        serialize_ride(get_ride_detail(db, ride_id, archived=not after_write))
+        return _statements.count
+    finally:
+        db.rollback()
+        db.close()
+
+
+async def async_detail_statements(ride_id: int) -> int:
+    """Statements for get_ride_detail_async + serialize_ride after handle_driver_accept (no expiry on commit)"""
+    async with AsyncSessionLocal() as db:
+        (await db.execute(select(Ride).filter(Ride.id == ride_id))).scalars().first()
+        _statements.count = 0
+        serialize_ride(await get_ride_detail_async(db, ride_id))
+        count = _statements.count
+        await db.rollback()
+    return count
+
+
+def check_statement_counts(ride_id: int) -> bool:
+    """True if every endpoint's ride detail takes exactly EXPECTED_STATEMENTS statements"""
+    counts = {}
+    for name, statements in (
+        ("GET /api/rides/{id}", lambda: sync_detail_statements(ride_id, after_write=False)),
+        ("PUT /api/rides/{id}/accept", lambda: asyncio.run(async_detail_statements(ride_id))),
+        ("PUT /api/rides/{id}/cancel", lambda: sync_detail_statements(ride_id, after_write=True)),
+        ("PUT /api/rides/{id}/complete", lambda: sync_detail_statements(ride_id, after_write=True)),
+    ):
+        try:
+            counts[name] = statements()
+        except Exception as e:  # e.g. a lazy load on the async session
+            print(f"❌ {name}: ride detail failed ({type(e).__name__}: {e})")
+            counts[name] = None
+
+    print(f"\n⏱️ SQL statements per ride detail response (expected {EXPECTED_STATEMENTS}):")
+    ok = True
+    for name, count in counts.items():
+        passed = count == EXPECTED_STATEMENTS
+        ok = ok and passed
+        print(f"   {'✅' if passed else '❌'} {name}: {count if count is not None else 'error'}")
+    return ok
+
+
+def measure(name: str, load, ride_ids: list, concurrency: int, requests: int):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda n: worker(load, ride_ids, n * requests, requests), range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for worker_latencies, _ in results for latency in worker_latencies)
+    statements = sum(count for _, count in results)
+    total = len(latencies)
+    print(f"\n⏱️ {name}: {total:,} ride details in {elapsed:.2f}s ({total / elapsed:,.0f}/s)")
+    print(f"   Latency: p50 {statistics.median(latencies):.2f} ms, p99 {latencies[min(total - 1, int(total * 0.99))]:.2f} ms")
+    print(f"   SQL statements per ride detail: {statements / total:.2f}")
+
+
+def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    logging.disable(logging.INFO)
+
+    db = SessionLocal()
+    try:
+        ride_ids = [ride_id for ride_id, in db.query(Ride.id).filter(Ride.driver_id != None).limit(1000)]
+    finally:
+        db.close()
+    if not ride_ids:
+        print("❌ No rides with a driver in the database - create some first")
+        return
+
+    if not check_statement_counts(ride_ids[0]):
+        print("\n❌ Ride detail statement count regressed")
+        sys.exit(1)
+
+    measure("warm-up", joined_query, ride_ids, concurrency, 1)
+    measure("SEPARATE queries (ride, rider, driver)", separate_queries, ride_ids, concurrency, requests)
+    measure("JOINED query (get_ride_detail)", joined_query, ride_ids, concurrency, requests)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Ride Transition Benchmark - row lock waits under contention
+
+N threads race to accept the same rides (duplicate taps, retries, the expiry
+worker and the driver all hitting one ride). Each ride is attempted by every
+thread; exactly one attempt may win. Compared:
+
+- LOCKING: SELECT ... FOR UPDATE, check in Python, load the driver, mutate,
+  COMMIT (how transitions used to work) - the row lock is held across two
+  extra round trips and the Python checks
+- CONDITIONAL: one UPDATE ... WHERE id = ... AND status IN (...) RETURNING
+  (services/ride_state.py) - the lock is held only until the COMMIT
+
+Reports time spent blocked in the locking statement (p50/p99/total) and the
+number of winners, which must equal the number of rides in both cases.
+
+Needs PostgreSQL (SQLite has no row locks). Uses DATABASE_URL from the
+environment / .env; creates its own rider, driver and rides and deletes them.
+
+Usage:
+    python bench_ride_transitions.py [threads] [rides]
+"""
+import logging
+import os
+import statistics
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'server'))
+
+from sqlalchemy import delete, select, update
+
+from app.db.database import SessionLocal
+from app.db.models import Ride, User
+from app.services.ride_state import transition
+
+
+def locking_accept(db, ride_id: int, driver_id: int) -> tuple:
+    start = time.perf_counter()
+    ride = db.execute(select(Ride).filter(Ride.id == ride_id).with_for_update()).scalars().first()
+    waited = time.perf_counter() - start
+
+    if ride.status != "offering" or ride.offered_to_driver_id != driver_id:
+        db.rollback()
+        return False, waited
+
+    ride.status = "accepted"
+    ride.driver_id = driver_id
+    ride.offered_to_driver_id = None
+    ride.current_offer_driver_id = None
+    driver = db.get(User, driver_id)
+    driver.availability = False
+    db.commit()
+    return True, waited
+
+
+def conditional_accept(db, ride_id: int, driver_id: int) -> tuple:
+    start = time.perf_counter()
+    ride = transition(
+        db, ride_id, "accepted",
+        Ride.offered_to_driver_id == driver_id,
+        driver_id=driver_id,
+        offered_to_driver_id=None,
+        current_offer_driver_id=None
+    )
+    waited = time.perf_counter() - start
+
+    if not ride:
+        db.rollback()
+        return False, waited
+
+    db.execute(update(User).filter(User.id == driver_id).values(availability=False))
+    db.commit()
+    return True, waited
+
+
+def create_rides(rider_id: int, driver_id: int, count: int) -> list:
+    db = SessionLocal()
+    try:
+        rides = [
+            Ride(rider_id=rider_id, start_location="bench", end_location="bench", status="offering",
+                 offered_to_driver_id=driver_id, current_offer_driver_id=driver_id)
+            for _ in range(count)
+        ]
+        db.add_all(rides)
+        db.commit()
+        return [ride.id for ride in rides]
+    finally:
+        db.close()
+
+
+def worker(accept, ride_ids: list, driver_id: int) -> tuple:
+    waits, wins = [], 0
+    db = SessionLocal()
+    try:
+        for ride_id in ride_ids:
+            won, waited = accept(db, ride_id, driver_id)
+            waits.append(waited * 1000)
+            wins += won
+    finally:
+        db.close()
+    return waits, wins
+
+
+def measure(name: str, accept, rider_id: int, driver_id: int, threads: int, rides: int):
+    ride_ids = create_rides(rider_id, driver_id, rides)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(lambda _: worker(accept, ride_ids, driver_id), range(threads)))
+    elapsed = time.perf_counter() - start
+
+    waits = sorted(wait for worker_waits, _ in results for wait in worker_waits)
+    wins = sum(worker_wins for _, worker_wins in results)
+    print(f"\n⏱️ {name}: {len(waits):,} attempts on {rides:,} rides in {elapsed:.2f}s ({len(waits) / elapsed:,.0f} attempts/s)")
+    print(f"   Lock wait: p50 {statistics.median(waits):.2f} ms, p99 {waits[min(len(waits) - 1, int(len(waits) * 0.99))]:.2f} ms, total {sum(waits) / 1000:.2f} s")
+    print(f"   Winners: {wins} (expected {rides})")
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    rides = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    logging.disable(logging.INFO)
+
+    tag = uuid.uuid4().hex[:8]
+    db = SessionLocal()
+    rider = User(username=f"bench_rider_{tag}", email=f"bench_rider_{tag}@example.com", is_driver=False)
+    driver = User(username=f"bench_driver_{tag}", email=f"bench_driver_{tag}@example.com", is_driver=True)
+    db.add_all([rider, driver])
+    db.commit()
+    rider_id, driver_id = rider.id, driver.id
+    db.close()
+
+    try:
+        measure("LOCKING (SELECT FOR UPDATE + checks + commit)", locking_accept, rider_id, driver_id, threads, rides)
+        measure("CONDITIONAL (UPDATE ... WHERE status RETURNING)", conditional_accept, rider_id, driver_id, threads, rides)
+    finally:
+        db = SessionLocal()
+        db.execute(delete(Ride).filter(Ride.rider_id == rider_id))
+        db.execute(delete(User).filter(User.id.in_([rider_id, driver_id])))
+        db.commit()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
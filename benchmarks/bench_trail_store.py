@@ -0,0 +1,94 @@
+"""
+Trail Store Benchmark - GPS trail ingest throughput, on-disk size and read speed
+
+Feeds points for N concurrent rides at a target rate through TrailStore.append()
+(the call made on the relay path) while the flush worker writes segments, then
+streams one ride's trail back.
+
+Usage:
+    python bench_trail_store.py [points_per_second] [seconds] [rides]
+"""
+import asyncio
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'server'))
+
+from app.services.trail_store import TrailStore
+
+
+async def run(rate: int, seconds: int, rides: int):
+    logging.disable(logging.INFO)
+    directory = tempfile.mkdtemp(prefix="gps_trails_")
+    store = TrailStore(directory)
+    worker = asyncio.create_task(store.start())
+
+    rng = random.Random(42)
+    positions = {ride_id: [40.7 + rng.random() * 0.1, -74.0 + rng.random() * 0.1] for ride_id in range(1, rides + 1)}
+    ride_ids = list(positions)
+
+    append_samples = []  # Seconds spent in append() per 10ms tick
+    loop_lag = []
+    tick = 0.01
+    per_tick = rate * tick
+    owed = 0.0
+    start = time.perf_counter()
+    expected = start
+    total = 0
+
+    while time.perf_counter() - start < seconds:
+        owed += per_tick
+        batch = int(owed)
+        owed -= batch
+        now_ms = int(time.time() * 1000)
+
+        t0 = time.perf_counter()
+        for _ in range(batch):
+            ride_id = ride_ids[total % rides]
+            position = positions[ride_id]
+            position[0] += rng.uniform(-0.0001, 0.0001)
+            position[1] += rng.uniform(-0.0001, 0.0001)
+            store.append(ride_id, position[0], position[1], now_ms)
+            total += 1
+        append_samples.append(time.perf_counter() - t0)
+
+        expected += tick
+        await asyncio.sleep(max(0, expected - time.perf_counter()))
+        loop_lag.append(max(0.0, time.perf_counter() - expected) * 1000)
+
+    elapsed = time.perf_counter() - start
+    store.running = False
+    worker.cancel()
+    t0 = time.perf_counter()
+    store.flush()
+    final_flush = time.perf_counter() - t0
+
+    size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+    loop_lag.sort()
+
+    print(f"\n🛰️ INGEST: {total:,} points from {rides:,} rides in {elapsed:.1f}s ({total / elapsed:,.0f} points/s, target {rate:,})")
+    print(f"   append(): {sum(append_samples) / total * 1_000_000:.2f} µs/point")
+    print(f"   Event-loop lag: p50 {statistics.median(loop_lag):.2f} ms, p99 {loop_lag[int(len(loop_lag) * 0.99) - 1]:.2f} ms")
+    print(f"   Final flush: {final_flush * 1000:.0f} ms")
+    print(f"   On disk: {size / 1024 / 1024:.1f} MiB ({size / total:.1f} bytes/point, 24 bytes/point as raw int64 triples)")
+
+    t0 = time.perf_counter()
+    points = sum(1 for _ in store.iter_points(ride_ids[0]))
+    read = time.perf_counter() - t0
+    print(f"\n📖 READ ride #{ride_ids[0]}: {points:,} points in {read * 1000:.1f} ms")
+
+
+def main():
+    rate = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    seconds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    rides = int(sys.argv[3]) if len(sys.argv) > 3 else 10_000
+    asyncio.run(run(rate, seconds, rides))
+
+
+if __name__ == "__main__":
+    main()
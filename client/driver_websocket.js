@@ -37,12 +37,12 @@ function connectNotificationWebSocket() {
         console.log('✅ Connected to notification system');
         showToast('Connected to ride matching system', 'success');
         
-        // Send heartbeat every 30 seconds
+        // Send heartbeat every 10 seconds (server drops drivers silent for 25s)
         setInterval(() => {
             if (notificationWs.readyState === WebSocket.OPEN) {
                 notificationWs.send(JSON.stringify({ type: 'heartbeat' }));
             }
-        }, 30000);
+        }, 10000);
     };
     
     notificationWs.onmessage = function(event) {
@@ -0,0 +1,76 @@
+"""
+Synthetic City Generator - bulk users, drivers and ride history for load and benchmark runs
+
+Deterministic from --seed (see server/app/db/synthetic_city.py): the same
+arguments on an empty database give the same rows, so benchmark runs stay
+comparable. Loads with COPY on PostgreSQL. Passwords are "password<N>" with
+N = user id % --password-pool.
+
+Rides are all finished; the ride archiver moves those older than
+RIDE_ARCHIVE_AFTER_MINUTES to rides_archive once the server runs (or
+utils/clean_rides.py --archive).
+
+Usage:
+    python generate_city_data.py [--riders N] [--drivers N] [--rides N] [--days N] [--seed N] ...
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server'))
+
+from app.db.database import Base, engine
+from app.db.synthetic_city import SyntheticCity, load
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-load a deterministic synthetic city")
+    parser.add_argument("--riders", type=int, default=200_000)
+    parser.add_argument("--drivers", type=int, default=20_000)
+    parser.add_argument("--rides", type=int, default=1_000_000, help="finished rides in the history")
+    parser.add_argument("--days", type=int, default=90, help="length of the ride history")
+    parser.add_argument("--until", type=datetime.fromisoformat, metavar="YYYY-MM-DD",
+                        help="end of the ride history (default: today 00:00 UTC)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--center", type=float, nargs=2, default=(37.7749, -122.4194), metavar=("LAT", "LNG"))
+    parser.add_argument("--radius-km", type=float, default=15.0)
+    parser.add_argument("--online-fraction", type=float, default=0.3, help="drivers available right now")
+    parser.add_argument("--password-pool", type=int, default=8, help="distinct passwords (bcrypt hashes computed)")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--batch-size", type=int, default=50_000, help="rows per COPY / INSERT batch")
+    args = parser.parse_args()
+
+    city = SyntheticCity(
+        riders=args.riders,
+        drivers=args.drivers,
+        rides=args.rides,
+        days=args.days,
+        seed=args.seed,
+        center_lat=args.center[0],
+        center_lng=args.center[1],
+        radius_km=args.radius_km,
+        online_fraction=args.online_fraction,
+        password_pool=args.password_pool,
+        bcrypt_rounds=args.bcrypt_rounds,
+        until=args.until
+    )
+
+    Base.metadata.create_all(bind=engine)
+
+    print(f"🏙️ Generating city (seed {args.seed}): {args.riders:,} riders, {args.drivers:,} drivers, "
+          f"{args.rides:,} rides over {args.days} days until {city.until:%Y-%m-%d}")
+    start = time.perf_counter()
+    ranges = load(city, engine, batch_size=args.batch_size)
+    elapsed = time.perf_counter() - start
+
+    rows = args.riders + args.drivers + args.rides
+    print(f"✅ Loaded {rows:,} rows in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s)")
+    for name, (first, last) in ranges.items():
+        print(f"   {name}: ids {first}-{last}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,14 @@
 """
 Database Migration Script
-Adds new columns to Ride table for offer system
+Applies versioned schema migrations (server/app/db/migrations.py) to an existing database
 
 Run this BEFORE starting the server with new code
+
+Usage:
+    python migrate_database.py                 Apply pending migrations
+    python migrate_database.py status          List applied and pending migrations
+    python migrate_database.py check [rides]   EXPLAIN regression check of the hot-path
+                                               indexes on a scratch schema (default 1M rides)
 """
 
 import sys
@@ -11,71 +17,50 @@ import os
 # Add parent directory to path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from sqlalchemy import text
-from server.app.db.database import engine, SessionLocal
+from server.app.db.migrations import MIGRATIONS, applied_versions, check_query_plans, migrate
 
 
 def migrate_database():
-    """Add new columns to rides table"""
-    
+    """Apply all pending migrations"""
+
     print("🔄 Starting database migration...")
-    
-    db = SessionLocal()
-    
+
     try:
-        # Check if columns already exist
-        result = db.execute(text("""
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE table_name='rides' AND column_name='offered_to_driver_id'
-        """))
-        
-        if result.fetchone():
-            print("✅ Columns already exist - migration not needed")
-            return
-        
-        # Add new columns
-        print("📝 Adding new columns to rides table...")
-        
-        db.execute(text("""
-            ALTER TABLE rides 
-            ADD COLUMN IF NOT EXISTS offered_to_driver_id INTEGER,
-            ADD COLUMN IF NOT EXISTS offered_at TIMESTAMP,
-            ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP,
-            ADD COLUMN IF NOT EXISTS offer_attempts INTEGER DEFAULT 0,
-            ADD COLUMN IF NOT EXISTS declined_driver_ids TEXT,
-            ADD COLUMN IF NOT EXISTS cancelled_at TIMESTAMP;
-        """))
-        
-        # Add indexes for performance
-        print("📝 Adding indexes...")
-        
-        db.execute(text("""
-            CREATE INDEX IF NOT EXISTS idx_rides_status ON rides(status);
-        """))
-        
-        db.execute(text("""
-            CREATE INDEX IF NOT EXISTS idx_rides_created_at ON rides(created_at);
-        """))
-        
-        db.commit()
-        
-        print("✅ Migration completed successfully!")
-        print("\nNew columns added:")
-        print("  - offered_to_driver_id: Tracks current driver being offered")
-        print("  - offered_at: When offer was made")
-        print("  - expires_at: When offer expires")
-        print("  - offer_attempts: Number of drivers tried")
-        print("  - declined_driver_ids: Comma-separated list of decliners")
-        print("  - cancelled_at: When ride was cancelled")
-        
+        applied = migrate()
     except Exception as e:
         print(f"❌ Migration failed: {e}")
-        db.rollback()
         raise
-    finally:
-        db.close()
+
+    if not applied:
+        print("✅ Schema is up to date - migration not needed")
+        return
+
+    print(f"✅ Applied {len(applied)} migration(s):")
+    for migration in applied:
+        print(f"  - {migration.version}: {migration.name}")
+
+
+def show_status():
+    """Print which migrations have been applied"""
+    applied = set(applied_versions())
+    for migration in MIGRATIONS:
+        print(f"  {'✅' if migration.version in applied else '⏳'} {migration.version}: {migration.name}")
+
+
+def check_plans(rides: int):
+    """Fail (exit code 1) if a hot query no longer uses its index"""
+    if not check_query_plans(rides=rides):
+        print("❌ Query plan regression detected")
+        sys.exit(1)
+    print("✅ All hot-path queries use their indexes")
 
 
 if __name__ == "__main__":
-    migrate_database()
+    command = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+
+    if command == "status":
+        show_status()
+    elif command == "check":
+        check_plans(int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000)
+    else:
+        migrate_database()
@@ -1,14 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+from fastapi.responses import ORJSONResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-import bcrypt
+from typing import Optional
 
-from ..db.database import get_db
+from ..db.database import get_async_db, get_db, replica_router
 from ..db.models import User
+from ..services.location_gateways import GatewayCredential, location_gateways
+from ..services.password_hasher import password_hasher
+from ..services.session_tokens import SessionClaims, session_tokens
 from ..core.schemas import UserResponse
+from ..core.serialization import serialize_user, user_response
 from pydantic import BaseModel
 
 router = APIRouter()
 
+bearer_scheme = HTTPBearer(auto_error=False)
+
 class LoginRequest(BaseModel):
     email: str
     password: str
@@ -16,14 +26,92 @@ class LoginRequest(BaseModel):
 class LoginResponse(BaseModel):
     user: UserResponse
     message: str
+    access_token: str  # Send as "Authorization: Bearer <token>"
+    token_type: str = "bearer"
+    expires_in: int  # Seconds
+
+# -----------------------------
+# Session dependencies
+# -----------------------------
+async def optional_session(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme)
+) -> Optional[SessionClaims]:
+    """
+    Claims of the request's bearer token - verified in memory, no DB query
+    
+    None when the request carries no token (clients that still only send ids);
+    401 when it carries an invalid, expired or revoked one.
+    """
+    if credentials is None:
+        return None
+    claims = session_tokens.verify(credentials.credentials)
+    if claims is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired session token",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    return claims
+
+async def require_session(claims: Optional[SessionClaims] = Depends(optional_session)) -> SessionClaims:
+    """Like optional_session, but a token is mandatory"""
+    if claims is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    return claims
+
+def check_session_user(claims: Optional[SessionClaims], user_id: int, is_driver: Optional[bool] = None):
+    """403 unless the token belongs to user_id (and has that role); requests without a token are not checked"""
+    if claims is None:
+        return
+    if claims.user_id != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Session token belongs to another user"
+        )
+    if is_driver is not None and claims.is_driver != is_driver:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only drivers can do this" if is_driver else "Drivers cannot do this"
+        )
+
+# -----------------------------
+# Gateway dependencies
+# -----------------------------
+async def require_gateway(
+    x_gateway_id: Optional[str] = Header(None),
+    x_gateway_signature: Optional[str] = Header(None)
+) -> GatewayCredential:
+    """
+    Credential of a configured fleet gateway (see LocationGateways) - checked before the body is read
+    
+    401 unless the request names a known gateway and carries a fresh signature;
+    the endpoint must still check the signature against the body with
+    location_gateways.verify().
+    """
+    credential = location_gateways.credential(x_gateway_id, x_gateway_signature)
+    if credential is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Unknown gateway or missing, malformed or expired signature",
+            headers={"WWW-Authenticate": "X-Gateway-Signature"}
+        )
+    return credential
 
 @router.post("/login", response_model=LoginResponse)
-def login(login_data: LoginRequest, db: Session = Depends(get_db)):
+async def login(login_data: LoginRequest, db: AsyncSession = Depends(get_async_db)):
     """
     Authenticate a user and return their information
+    
+    bcrypt runs in the password hasher's process pool (503 + Retry-After when
+    it is saturated), so no request thread waits on it.
     """
     # Find user by email
-    user = db.query(User).filter(User.email == login_data.email).first()
+    user = (await db.execute(select(User).filter(User.email == login_data.email))).scalars().first()
+    await db.commit()  # Return the connection to the pool before bcrypt
     
     if not user:
         raise HTTPException(
@@ -32,26 +120,39 @@ def login(login_data: LoginRequest, db: Session = Depends(get_db)):
         )
     
     # Verify password
-    if not bcrypt.checkpw(login_data.password.encode('utf-8'), user.hashed_password.encode('utf-8')):
+    if not await password_hasher.verify(login_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid email or password"
         )
     
-    return {
-        "user": user,
-        "message": "Login successful"
-    }
+    token, _ = session_tokens.issue(user.id, user.is_driver)
+    
+    return ORJSONResponse({
+        "user": serialize_user(user),
+        "message": "Login successful",
+        "access_token": token,
+        "token_type": "bearer",
+        "expires_in": session_tokens.TTL_SECONDS
+    })
+
+@router.post("/logout")
+def logout(claims: SessionClaims = Depends(require_session), db: Session = Depends(get_db)):
+    """Revoke the session token the request was made with (in every worker)"""
+    session_tokens.revoke(claims, db)
+    db.commit()
+    
+    return {"success": True, "message": "Logged out"}
 
 @router.post("/register", response_model=UserResponse)
-def register(user_data: dict, db: Session = Depends(get_db)):
+async def register(user_data: dict, db: AsyncSession = Depends(get_async_db)):
     """
     Register a new user (rider or driver)
     """
     # Check if user already exists
-    existing_user = db.query(User).filter(
+    existing_user = (await db.execute(select(User.id).filter(
         (User.email == user_data.get("email")) | (User.username == user_data.get("username"))
-    ).first()
+    ))).first()
     
     if existing_user:
         raise HTTPException(
@@ -59,21 +160,23 @@ def register(user_data: dict, db: Session = Depends(get_db)):
             detail="Email or username already registered"
         )
     
-    # Hash password
-    hashed_password = bcrypt.hashpw(user_data.get("password").encode('utf-8'), bcrypt.gensalt())
+    # Hash password (connection back in the pool meanwhile)
+    await db.commit()
+    hashed_password = await password_hasher.hash(user_data.get("password"))
     
     # Create new user
     new_user = User(
         username=user_data.get("username"),
         email=user_data.get("email"),
-        hashed_password=hashed_password.decode('utf-8'),
+        hashed_password=hashed_password,
         is_driver=user_data.get("is_driver", False),
         vehicle=user_data.get("vehicle"),
         availability=user_data.get("is_driver", False)  # Drivers start as available
     )
     
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.flush()
+    await db.commit()
+    replica_router.mark_written(user_ids=[new_user.id])
     
-    return new_user
+    return user_response(new_user)
@@ -0,0 +1,58 @@
+from fastapi import APIRouter, Query
+
+from ..db.database import replica_router
+from ..services.admission_control import admission_controller
+from ..services.connection_manager import manager
+from ..services.matching_engine import matching_engine
+from ..services.password_hasher import password_hasher
+from ..services.profile_cache import profile_cache
+from ..services.query_profiler import query_profiler
+from ..services.ride_archiver import ride_archiver
+from ..services.session_tokens import session_tokens
+
+router = APIRouter()
+
+@router.get("/relay", response_model=dict)
+def relay_metrics():
+    """Ride location relay counters (frames received, forwarded and dropped)"""
+    return manager.get_relay_stats()
+
+@router.get("/matching", response_model=dict)
+def matching_metrics():
+    """Offer outcomes, including wasted offer timeouts over the last hour"""
+    return matching_engine.get_stats()
+
+@router.get("/database", response_model=dict)
+def database_metrics():
+    """Read routing counters (primary / replica / sticky / fallback) and replica lag"""
+    return replica_router.get_stats()
+
+@router.get("/archive", response_model=dict)
+def archive_metrics():
+    """Finished rides moved to rides_archive by the background archiver"""
+    return ride_archiver.get_stats()
+
+@router.get("/profiles", response_model=dict)
+def profile_cache_metrics():
+    """User profile cache hit rate, evictions and invalidations (local and from other workers)"""
+    return profile_cache.get_stats()
+
+@router.get("/passwords", response_model=dict)
+def password_hasher_metrics():
+    """bcrypt worker pool: operations, admission rejections and queue / run time percentiles"""
+    return password_hasher.get_stats()
+
+@router.get("/admission", response_model=dict)
+def admission_metrics():
+    """Ride requests admitted and shed (by reason), with the backlog, DB pool and loop-lag signals"""
+    return admission_controller.get_stats()
+
+@router.get("/sessions", response_model=dict)
+def session_token_metrics():
+    """Session tokens issued, verified and rejected (by reason), and cached revocations"""
+    return session_tokens.get_stats()
+
+@router.get("/queries", response_model=dict)
+def query_metrics(top: int = Query(5, ge=1, le=50)):
+    """SQL count, DB time and heaviest statements per route / worker, plus recent slow queries (QUERY_PROFILER_ENABLED)"""
+    return query_profiler.report(top)
@@ -1,11 +1,19 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
+from sqlalchemy import update
+from typing import Optional
 import logging
 
-from ..db.database import get_db
+from ..db.database import get_db, replica_router
 from ..db.models import Ride, User
+from ..db.queries import get_ride_detail
 from ..core.request_models import RideRequest
 from ..core.schemas import RideResponse
+from ..core.serialization import ride_response
+from ..services.admission_control import AdmissionRejected, admission_controller
+from ..services.profile_cache import profile_cache
+from ..services.session_tokens import SessionClaims
+from .auth import check_session_user, optional_session
 
 router = APIRouter()
 
@@ -14,7 +22,11 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 @router.post("/request", response_model=RideResponse)
-def request_ride(ride_request: RideRequest, db: Session = Depends(get_db)):
+def request_ride(
+    ride_request: RideRequest,
+    db: Session = Depends(get_db),
+    session: Optional[SessionClaims] = Depends(optional_session)
+):
     """
     Endpoint to handle ride requests.
     Now triggers automatic driver matching via background worker.
@@ -33,17 +45,29 @@ def request_ride(ride_request: RideRequest, db: Session = Depends(get_db)):
     
     Returns:
     - Ride details including ID and status
+    
+    With a session token (Authorization: Bearer) the user and role come from
+    the token, which must belong to user_id; no user lookup is made.
+    
+    Under load the admission controller sheds requests before any ride work:
+    429 when the pickup zone is over its rate, 503 when the matcher, the
+    database pool or the event loop is behind - both with Retry-After.
     """
     try:
         # 1. Validate user exists and is not a driver
-        user = db.query(User).filter(User.id == ride_request.user_id).first()
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"User with ID {ride_request.user_id} not found"
-            )
+        if session:
+            check_session_user(session, ride_request.user_id)
+            is_driver = session.is_driver
+        else:
+            user = profile_cache.get(db, ride_request.user_id)
+            if not user:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"User with ID {ride_request.user_id} not found"
+                )
+            is_driver = user.is_driver
         
-        if user.is_driver:
+        if is_driver:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Drivers cannot request rides"
@@ -81,9 +105,16 @@ def request_ride(ride_request: RideRequest, db: Session = Depends(get_db)):
                 detail="Invalid pickup longitude (must be between -180 and 180)"
             )
         
+        # Shed load before any write - only requests that would otherwise succeed
+        # take a token (AdmissionRejected -> 429 / 503)
+        admission_controller.admit(ride_request.pickup_lat, ride_request.pickup_lng)
+        
         # 4. Update rider's current location
-        user.latitude = ride_request.pickup_lat
-        user.longitude = ride_request.pickup_lng
+        db.execute(
+            update(User).filter(User.id == ride_request.user_id)
+            .values(latitude=ride_request.pickup_lat, longitude=ride_request.pickup_lng)
+        )
+        profile_cache.invalidate([ride_request.user_id], db)
         
         # 5. Create new ride record
         new_ride = Ride(
@@ -99,15 +130,18 @@ def request_ride(ride_request: RideRequest, db: Session = Depends(get_db)):
         
         # 6. Store in database
         db.add(new_ride)
+        db.flush()
+        ride_id = new_ride.id  # Read before commit expires the object
         db.commit()
-        db.refresh(new_ride)
+        replica_router.mark_written(user_ids=[ride_request.user_id], ride_ids=[ride_id])
+        new_ride = get_ride_detail(db, ride_id)  # With the rider, in one query
         
         logger.info(f"✅ Ride #{new_ride.id} created: {ride_request.source_location} → {ride_request.dest_location} (rider #{ride_request.user_id})")
         
-        return new_ride
+        return ride_response(new_ride)
         
-    except HTTPException:
-        # Re-raise HTTP exceptions as-is
+    except (HTTPException, AdmissionRejected):
+        # Re-raise HTTP exceptions and load shedding as-is
         raise
         
     except Exception as e:
@@ -1,14 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import tuple_, update
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta
+import base64
+import os
 from pydantic import BaseModel
 import logging
 
-from ..db.database import get_db
-from ..db.models import Ride, User
+from ..db.database import get_db, get_async_db, get_read_db, replica_router
+from ..db.models import FINISHED_RIDE_STATUSES, RIDE_STATUSES, Ride, RideArchive, User
+from ..db.queries import get_ride_detail, get_ride_detail_async
 from ..core.schemas import RideCreate, RideResponse
+from ..core.serialization import dumps, ride_response, serialize_ride
+from ..services.admission_control import admission_controller
 from ..services.matching_engine import matching_engine
+from ..services.session_tokens import SessionClaims
+from ..services.ride_state import current_status, transition
+from ..services.trail_store import trail_store
+from .auth import check_session_user, optional_session
 
 router = APIRouter()
 
@@ -27,16 +39,139 @@ class AcceptanceResponse(BaseModel):
     message: str
     ride: Optional[RideResponse] = None
 
+
+# ============================================
+# RIDE LISTING (keyset pagination on created_at, id - newest first)
+# ============================================
+
+RIDE_LIST_DEFAULT_LIMIT = 100
+RIDE_LIST_MAX_LIMIT = int(os.getenv("RIDE_LIST_MAX_LIMIT", "500"))
+RIDE_EXPORT_BATCH_SIZE = 1000
+
+# Scalar RideResponse fields that can be requested with ?fields=
+RIDE_LIST_FIELDS = [name for name in RideResponse.model_fields if name not in ("rider", "driver")]
+
+
+def _encode_cursor(created_at: datetime, ride_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()},{ride_id}".encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        created_at, ride_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(",")
+        return datetime.fromisoformat(created_at), int(ride_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def _parse_fields(fields: Optional[str]) -> List[str]:
+    if not fields:
+        return RIDE_LIST_FIELDS
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in RIDE_LIST_FIELDS]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(unknown)} (allowed: {', '.join(RIDE_LIST_FIELDS)})"
+        )
+    return names
+
+
+def _check_status(status_filter: Optional[str]):
+    if status_filter and status_filter not in RIDE_STATUSES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown status: {status_filter} (allowed: {', '.join(RIDE_STATUSES)})"
+        )
+
+
+def _ride_page(
+    db: Session,
+    fields: List[str],
+    limit: int,
+    after: Optional[tuple] = None,
+    status_filter: Optional[str] = None,
+    rider_id: Optional[int] = None,
+    driver_id: Optional[int] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None
+) -> tuple:
+    """
+    One page of rides as rows holding only the requested columns (plus id and created_at)
+
+    Returns (rows, cursor of the next page or None). Live and archived rides are
+    paged together: each table returns its own next limit + 1 rows from the
+    (created_at, id) index, and the merged result is cut to the page.
+    """
+    names = list(dict.fromkeys(["id", "created_at"] + fields))
+    
+    # Finished rides older than the archive delay live in rides_archive
+    models = [Ride, RideArchive] if status_filter is None or status_filter in FINISHED_RIDE_STATUSES else [Ride]
+    rows = []
+    for model in models:
+        query = db.query(*[getattr(model, name) for name in names])
+        
+        if status_filter:
+            query = query.filter(model.status == status_filter)
+        
+        if rider_id:
+            query = query.filter(model.rider_id == rider_id)
+        
+        if driver_id:
+            query = query.filter(model.driver_id == driver_id)
+        
+        if created_from:
+            query = query.filter(model.created_at >= created_from)
+        
+        if created_to:
+            query = query.filter(model.created_at < created_to)
+        
+        if after:
+            query = query.filter(tuple_(model.created_at, model.id) < after)
+        
+        rows.extend(query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1).all())
+    
+    rows.sort(key=lambda row: (row.created_at, row.id), reverse=True)
+    page = rows[:limit]
+    next_cursor = _encode_cursor(page[-1].created_at, page[-1].id) if len(rows) > limit else None
+    return page, next_cursor
+
+
+def _rejected(db: Session, ride_id: int, detail: str) -> HTTPException:
+    """Error for a transition that updated no row: the ride is missing or in the wrong state"""
+    current = current_status(db, ride_id)
+    if current is None:
+        return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Ride not found")
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail.format(status=current))
+
+
+def _free_driver(db: Session, driver_id: Optional[int]):
+    if driver_id:
+        db.execute(update(User).filter(User.id == driver_id).values(availability=True))
+
+
+def _row_to_dict(row, fields: List[str]) -> dict:
+    return {name: getattr(row, name) for name in fields}  # orjson writes datetimes as ISO 8601
+
 @router.post("/", response_model=RideResponse)
-def create_ride(ride: RideCreate, rider_id: int, db: Session = Depends(get_db)):
-    # Check if rider exists
-    rider = db.query(User).filter(User.id == rider_id, User.is_driver == False).first()
-    if not rider:
+def create_ride(
+    ride: RideCreate,
+    rider_id: int,
+    db: Session = Depends(get_db),
+    session: Optional[SessionClaims] = Depends(optional_session)
+):
+    # Check if rider exists (a session token already vouches for it)
+    if session:
+        check_session_user(session, rider_id, is_driver=False)
+    elif not db.query(User.id).filter(User.id == rider_id, User.is_driver == False).first():
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Rider not found"
         )
     
+    # No pickup coordinates, so only the overload checks apply (no zone bucket)
+    admission_controller.admit()
+    
     # Create new ride
     db_ride = Ride(
         rider_id=rider_id,
@@ -46,14 +181,76 @@ def create_ride(ride: RideCreate, rider_id: int, db: Session = Depends(get_db)):
     )
     
     db.add(db_ride)
+    db.flush()
+    ride_id = db_ride.id  # Read before commit expires the object
     db.commit()
-    db.refresh(db_ride)
+    replica_router.mark_written(ride_ids=[ride_id])
     
-    return db_ride
+    return ride_response(get_ride_detail(db, ride_id))
+
+@router.get("/export")
+def export_rides(
+    status: Optional[str] = None,
+    rider_id: Optional[int] = None,
+    driver_id: Optional[int] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    fields: Optional[str] = None
+):
+    """
+    Stream every matching ride as NDJSON, newest first (history export)
+
+    Walks the keyset pages internally, so memory use is constant however many
+    rides match. Same filters and field projection as GET /api/rides/.
+    """
+    names = _parse_fields(fields)
+    _check_status(status)
+    
+    def lines():
+        db = replica_router.read_session(user_ids=[user_id for user_id in (rider_id, driver_id) if user_id])
+        try:
+            after = None
+            while True:
+                rows, next_cursor = _ride_page(
+                    db, names, RIDE_EXPORT_BATCH_SIZE, after,
+                    status, rider_id, driver_id, created_from, created_to
+                )
+                for row in rows:
+                    yield dumps(_row_to_dict(row, names)) + "\n"
+                if not next_cursor:
+                    return
+                after = (rows[-1].created_at, rows[-1].id)
+                db.commit()  # No snapshot held open across the whole export
+        finally:
+            db.close()
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 @router.get("/{ride_id}", response_model=RideResponse)
-def get_ride(ride_id: int, db: Session = Depends(get_db)):
-    db_ride = db.query(Ride).filter(Ride.id == ride_id).first()
+def get_ride(ride_id: int, db: Session = Depends(get_read_db)):
+    # Rider and driver come joined in the same query (mutual visibility);
+    # finished rides move to the archive after a while
+    db_ride = get_ride_detail(db, ride_id, archived=True)
+    
+    if not db_ride:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Ride not found"
+        )
+    
+    return ride_response(db_ride)
+
+@router.get("/{ride_id}/trail")
+def get_ride_trail(ride_id: int, db: Session = Depends(get_db)):
+    """
+    Stream the driver's GPS trail for a ride as NDJSON, oldest point first
+
+    Each line: {"latitude": ..., "longitude": ..., "timestamp": <ms since epoch>}
+    """
+    db_ride = (
+        db.query(Ride.created_at, Ride.completed_at).filter(Ride.id == ride_id).first()
+        or db.query(RideArchive.created_at, RideArchive.completed_at).filter(RideArchive.id == ride_id).first()
+    )
     
     if not db_ride:
         raise HTTPException(
@@ -61,19 +258,21 @@ def get_ride(ride_id: int, db: Session = Depends(get_db)):
             detail="Ride not found"
         )
     
-    # Attach rider and driver information for mutual visibility
-    rider = db.query(User).filter(User.id == db_ride.rider_id).first()
-    driver = db.query(User).filter(User.id == db_ride.driver_id).first() if db_ride.driver_id else None
-    db_ride.rider = rider
-    db_ride.driver = driver
+    since = db_ride.created_at - timedelta(minutes=5) if db_ride.created_at else None
+    until = db_ride.completed_at + timedelta(minutes=5) if db_ride.completed_at else None
+    
+    def lines():
+        for latitude, longitude, timestamp in trail_store.iter_points(ride_id, since, until):
+            yield dumps({"latitude": latitude, "longitude": longitude, "timestamp": timestamp}) + "\n"
     
-    return db_ride
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
-@router.put("/{ride_id}/accept")
+@router.put("/{ride_id}/accept", response_model=AcceptanceResponse)
 async def accept_ride_offer(
     ride_id: int,
     driver_data: DriverActionRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    session: Optional[SessionClaims] = Depends(optional_session)
 ):
     """
     Driver accepts a ride offer (new system with timeout validation)
@@ -85,9 +284,12 @@ async def accept_ride_offer(
     - Ride cancelled
     - Concurrent acceptance attempts
     """
+    check_session_user(session, driver_data.driver_id, is_driver=True)
+    
     success, message = await matching_engine.handle_driver_accept(
         db, ride_id, driver_data.driver_id
     )
+    replica_router.mark_written(user_ids=[driver_data.driver_id])
     
     if not success:
         raise HTTPException(
@@ -95,27 +297,22 @@ async def accept_ride_offer(
             detail=message
         )
     
-    # Fetch updated ride
-    ride = db.query(Ride).filter(Ride.id == ride_id).first()
-    
-    # Attach rider and driver details
-    rider = db.query(User).filter(User.id == ride.rider_id).first()
-    driver = db.query(User).filter(User.id == ride.driver_id).first() if ride.driver_id else None
-    ride.rider = rider
-    ride.driver = driver
+    # Fetch updated ride with rider and driver details
+    ride = await get_ride_detail_async(db, ride_id)
     
-    return {
+    return ORJSONResponse({
         "success": True,
         "message": message,
-        "ride": ride
-    }
+        "ride": serialize_ride(ride) if ride else None
+    })
 
 
 @router.put("/{ride_id}/decline")
 async def decline_ride_offer(
     ride_id: int,
     driver_data: DriverActionRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    session: Optional[SessionClaims] = Depends(optional_session)
 ):
     """
     Driver declines a ride offer
@@ -125,9 +322,12 @@ async def decline_ride_offer(
     - Wrong driver
     - Ride already accepted/cancelled
     """
+    check_session_user(session, driver_data.driver_id, is_driver=True)
+    
     success, message = await matching_engine.handle_driver_decline(
         db, ride_id, driver_data.driver_id
     )
+    replica_router.mark_written(user_ids=[driver_data.driver_id])
     
     if not success:
         raise HTTPException(
@@ -141,7 +341,7 @@ async def decline_ride_offer(
     }
 
 
-@router.put("/{ride_id}/cancel")
+@router.put("/{ride_id}/cancel", response_model=AcceptanceResponse)
 def cancel_ride(
     ride_id: int,
     db: Session = Depends(get_db)
@@ -154,38 +354,23 @@ def cancel_ride(
     - Ride already completed
     - Ride currently in progress
     """
-    ride = db.query(Ride).filter(Ride.id == ride_id).first()
+    # Can only cancel if not yet in progress or completed (see RIDE_TRANSITIONS)
+    ride = transition(db, ride_id, "cancelled", cancelled_at=datetime.utcnow())
     
     if not ride:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Ride not found"
-        )
-    
-    # Can only cancel if not yet in progress or completed
-    if ride.status in ["completed", "in_progress"]:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Cannot cancel ride in {ride.status} state"
-        )
-    
-    ride.status = "cancelled"
-    ride.cancelled_at = datetime.utcnow()
+        raise _rejected(db, ride_id, "Cannot cancel ride in {status} state")
     
     # If driver was assigned, free them up
-    if ride.driver_id:
-        driver = db.query(User).filter(User.id == ride.driver_id).first()
-        if driver:
-            driver.availability = True
+    _free_driver(db, ride.driver_id)
     
     db.commit()
-    db.refresh(ride)
+    ride = get_ride_detail(db, ride_id)
     
-    return {
+    return ORJSONResponse({
         "success": True,
         "message": "Ride cancelled successfully",
-        "ride": ride
-    }
+        "ride": serialize_ride(ride) if ride else None
+    })
 
 @router.put("/{ride_id}/complete", response_model=RideResponse)
 def complete_ride(ride_id: int, fare: float = 25.0, db: Session = Depends(get_db)):
@@ -197,36 +382,19 @@ def complete_ride(ride_id: int, fare: float = 25.0, db: Session = Depends(get_db
     - Invalid status transition
     - Driver not found (shouldn't happen but defensive)
     """
-    # Check if ride exists and is in correct status
-    db_ride = db.query(Ride).filter(Ride.id == ride_id).first()
+    # Update ride if it exists and is in a completable status
+    db_ride = transition(db, ride_id, "completed", completed_at=datetime.utcnow(), fare=fare)
     if not db_ride:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Ride not found"
-        )
-    
-    if db_ride.status not in ["accepted", "in_progress"]:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Ride cannot be completed (current status: {db_ride.status})"
-        )
-    
-    # Update ride
-    db_ride.status = "completed"
-    db_ride.completed_at = datetime.utcnow()
-    db_ride.fare = fare
+        raise _rejected(db, ride_id, "Ride cannot be completed (current status: {status})")
     
     # Free up the driver
     if db_ride.driver_id:
-        driver = db.query(User).filter(User.id == db_ride.driver_id).first()
-        if driver:
-            driver.availability = True
-            logger.info(f"✅ Driver #{driver.id} is now available again")
+        _free_driver(db, db_ride.driver_id)
+        logger.info(f"✅ Driver #{db_ride.driver_id} is now available again")
     
     db.commit()
-    db.refresh(db_ride)
     
-    return db_ride
+    return ride_response(get_ride_detail(db, ride_id))
 
 
 @router.put("/{ride_id}/start")
@@ -238,25 +406,13 @@ def start_ride(ride_id: int, db: Session = Depends(get_db)):
     - Ride not accepted yet
     - Ride already completed/cancelled
     """
-    ride = db.query(Ride).filter(Ride.id == ride_id).first()
+    ride = transition(db, ride_id, "in_progress")
     
     if not ride:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Ride not found"
-        )
-    
-    if ride.status != "accepted":
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Ride must be accepted before starting (current: {ride.status})"
-        )
-    
-    ride.status = "in_progress"
-    db.commit()
-    db.refresh(ride)
+        raise _rejected(db, ride_id, "Ride must be accepted before starting (current: {status})")
     
-    return {
+    # Built from the RETURNING row before commit expires it
+    response = {
         "id": ride.id,
         "rider_id": ride.rider_id,
         "driver_id": ride.driver_id,
@@ -264,20 +420,40 @@ def start_ride(ride_id: int, db: Session = Depends(get_db)):
         "end_location": ride.end_location,
         "status": ride.status,
         "fare": ride.fare,
-        "created_at": ride.created_at.isoformat() if ride.created_at else None
+        "created_at": ride.created_at
     }
-
-@router.get("/", response_model=List[RideResponse])
-def list_rides(status: Optional[str] = None, rider_id: Optional[int] = None, driver_id: Optional[int] = None, db: Session = Depends(get_db)):
-    query = db.query(Ride)
+    db.commit()
     
-    if status:
-        query = query.filter(Ride.status == status)
+    return response
+
+@router.get("/")
+def list_rides(
+    status: Optional[str] = None,
+    rider_id: Optional[int] = None,
+    driver_id: Optional[int] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(RIDE_LIST_DEFAULT_LIMIT, ge=1, le=RIDE_LIST_MAX_LIMIT),
+    db: Session = Depends(get_read_db)
+):
+    """
+    List rides, newest first, one page at a time
     
-    if rider_id:
-        query = query.filter(Ride.rider_id == rider_id)
+    - created_from / created_to: created_at range (from inclusive, to exclusive)
+    - fields: comma-separated subset of the ride fields to return (default: all)
+    - cursor: value of the X-Next-Cursor header of the previous page; the header
+      is absent on the last page
     
-    if driver_id:
-        query = query.filter(Ride.driver_id == driver_id)
+    Rider and driver details are not embedded - use GET /api/rides/{ride_id}.
+    """
+    names = _parse_fields(fields)
+    _check_status(status)
+    rows, next_cursor = _ride_page(
+        db, names, limit, _decode_cursor(cursor) if cursor else None,
+        status, rider_id, driver_id, created_from, created_to
+    )
     
-    return query.all()
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return ORJSONResponse([_row_to_dict(row, names) for row in rows], headers=headers)
@@ -1,19 +1,40 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import os
+
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-import bcrypt
 
-from ..db.database import get_db
+from ..db.database import get_async_db, get_db, get_read_db, replica_router
 from ..db.models import User
-from ..core.schemas import UserCreate, UserResponse
+from ..core.schemas import UserCreate, UserResponse, LocationUpdate, LocationAck, LocationBatchAck
+from ..core.serialization import serialize_user, user_response
+from ..services import location_codec
+from ..services.location_buffer import location_buffer
+from ..services.location_gateways import Gateway, GatewayCredential, location_gateways
+from ..services.password_hasher import password_hasher
+from ..services.profile_cache import profile_cache
+from .auth import require_gateway
 
 router = APIRouter()
 
+MAX_LOCATION_BATCH_BYTES = int(os.getenv("LOCATION_BATCH_MAX_BYTES", str(8 * 1024 * 1024)))
+REJECTED_ROWS_REPORTED = 100
+
+def _batch_too_large() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Batch larger than {MAX_LOCATION_BATCH_BYTES} bytes"
+    )
+
 @router.post("/", response_model=UserResponse)
-def create_user(user: UserCreate, db: Session = Depends(get_db)):
+async def create_user(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
     # Check if username or email already exists
-    db_user = db.query(User).filter(
+    db_user = (await db.execute(select(User.id).filter(
         (User.username == user.username) | (User.email == user.email)
-    ).first()
+    ))).first()
     
     if db_user:
         raise HTTPException(
@@ -21,54 +42,136 @@ def create_user(user: UserCreate, db: Session = Depends(get_db)):
             detail="Username or email already registered"
         )
     
-    # Hash the password
-    hashed_password = bcrypt.hashpw(user.password.encode('utf-8'), bcrypt.gensalt())
+    # Hash the password (in the password hasher's process pool, connection back in the pool meanwhile)
+    await db.commit()
+    hashed_password = await password_hasher.hash(user.password)
     
     # Create new user
     db_user = User(
         username=user.username,
         email=user.email,
-        hashed_password=hashed_password.decode('utf-8'),
+        hashed_password=hashed_password,
         is_driver=user.is_driver
     )
     
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.flush()
+    await db.commit()
+    replica_router.mark_written(user_ids=[db_user.id])
     
-    return db_user
+    return user_response(db_user)
 
 @router.get("/{user_id}", response_model=UserResponse)
-def get_user(user_id: int, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.id == user_id).first()
+def get_user(user_id: int, db: Session = Depends(get_read_db)):
+    profile = profile_cache.get(db, user_id)
     
-    if not db_user:
+    if not profile:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
     
-    return db_user
+    # Positions not yet flushed to the database live in the location buffer
+    response = serialize_user(profile)
+    position = location_buffer.get(user_id)
+    if position:
+        response["latitude"], response["longitude"] = position
+    
+    return ORJSONResponse(response)
 
-@router.put("/{user_id}/location", response_model=UserResponse)
-def update_user_location(user_id: int, location_data: dict, db: Session = Depends(get_db)):
-    """Update a user's current location (latitude and longitude)"""
-    db_user = db.query(User).filter(User.id == user_id).first()
+@router.put("/{user_id}/location", response_model=LocationAck)
+def update_user_location(user_id: int, location_data: LocationUpdate):
+    """
+    Update a user's current location (latitude and longitude)
     
-    if not db_user:
+    The position is recorded in the in-memory location buffer, where the matcher
+    sees it immediately, and written to the database by the periodic batch flush.
+    """
+    if not (-90 <= location_data.latitude <= 90) or not (-180 <= location_data.longitude <= 180):
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid coordinates"
         )
     
-    # Update location
-    db_user.latitude = location_data.get("latitude")
-    db_user.longitude = location_data.get("longitude")
+    location_buffer.update(user_id, location_data.latitude, location_data.longitude)
     
-    db.commit()
-    db.refresh(db_user)
+    return {"success": True, "user_id": user_id}
+
+def _ingest_locations(body: bytes, content_type: str, gateway: Gateway) -> dict:
+    rows, rejected = location_codec.decode_position_batch(body, content_type, location_codec.now_ms())
+    valid = len(rows)
+    if gateway.fleet is not None:
+        rows = [row for row in rows if gateway.owns(row[0])]
+    accepted = location_buffer.update_many(rows, drivers_only=True)
+    return {
+        "success": True,
+        "received": valid + len(rejected),
+        "accepted": accepted,
+        "stale": len(rows) - accepted,
+        "rejected": len(rejected),
+        "rejected_rows": rejected[:REJECTED_ROWS_REPORTED],
+        "outside_fleet": valid - len(rows)
+    }
+
+@router.post("/locations", response_model=LocationBatchAck)
+async def ingest_locations(request: Request, credential: GatewayCredential = Depends(require_gateway)):
+    """
+    Bulk driver positions from fleet gateways relaying many vehicles
     
-    return db_user
+    Body by Content-Type:
+    - application/json: array of {"driver_id", "latitude", "longitude", "timestamp"}
+      objects or [driver_id, latitude, longitude, timestamp] arrays
+    - application/x-ndjson: one such object or array per line
+    - application/octet-stream: 20-byte records (see services/location_codec.py)
+    
+    timestamp (ms since the epoch) is optional in every format: missing or 0 means
+    the time of receipt.
+    Invalid rows are skipped and reported by index, the rest are applied: positions
+    older than the one already held for a driver count as stale, the others go to
+    the location buffer exactly like single updates.
+    
+    Only configured gateways may call this: the request names its gateway and
+    signs the body with the gateway's secret (X-Gateway-Id / X-Gateway-Signature,
+    see services/location_gateways.py), else 401. Rows for drivers outside the
+    gateway's fleet are skipped and counted as outside_fleet, and positions for
+    ids that are not drivers are never written (see LocationBuffer).
+    """
+    content_type = request.headers.get("content-type", location_codec.CONTENT_JSON).split(";")[0].strip().lower()
+    if content_type not in (location_codec.CONTENT_JSON, location_codec.CONTENT_BINARY, *location_codec.CONTENT_NDJSON):
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Send application/json, application/x-ndjson or application/octet-stream"
+        )
+    
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > MAX_LOCATION_BATCH_BYTES:
+        raise _batch_too_large()
+    
+    # Stop reading as soon as the limit is passed (chunked bodies have no Content-Length)
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > MAX_LOCATION_BATCH_BYTES:
+            raise _batch_too_large()
+        chunks.append(chunk)
+    body = b"".join(chunks)
+    
+    if not location_gateways.verify(credential, body):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Gateway signature does not match the body",
+            headers={"WWW-Authenticate": "X-Gateway-Signature"}
+        )
+    
+    # Decoding 100k positions takes tens of milliseconds - keep it off the event loop
+    try:
+        return await run_in_threadpool(_ingest_locations, body, content_type, credential.gateway)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid location batch: {e}"
+        )
 
 @router.put("/{user_id}/availability", response_model=UserResponse)
 def update_user_availability(user_id: int, availability_data: dict, db: Session = Depends(get_db)):
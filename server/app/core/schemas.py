@@ -21,6 +21,23 @@ class UserResponse(UserBase):
     class Config:
         orm_mode = True
 
+class LocationUpdate(BaseModel):
+    latitude: float
+    longitude: float
+
+class LocationAck(BaseModel):
+    success: bool
+    user_id: int
+
+class LocationBatchAck(BaseModel):
+    success: bool
+    received: int
+    accepted: int
+    stale: int  # Older than the position already held for the driver
+    rejected: int
+    rejected_rows: List[int]  # Indexes of the first rejected rows
+    outside_fleet: int  # Valid rows for drivers the gateway may not report, skipped
+
 # Ping-Pong schemas
 class PingRequest(BaseModel):
     data: str
@@ -0,0 +1,61 @@
+"""
+Response Serialization
+orjson encoding and precompiled serializers for the hot response models
+"""
+
+from typing import Any, Callable, Dict, Optional, Type
+
+import orjson
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+from .schemas import RideResponse, UserResponse
+
+Serializer = Callable[[Any], dict]
+
+
+def dumps(data: Any) -> str:
+    """JSON text for WebSocket frames and stored notifications (compact, datetimes as ISO 8601)"""
+    return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+
+loads = orjson.loads
+
+
+def compile_serializer(model: Type[BaseModel], nested: Optional[Dict[str, Serializer]] = None) -> Serializer:
+    """
+    Build obj -> dict for a response model, reading the model's fields as attributes
+
+    The function is generated once, as a single dict display, so a response costs
+    one attribute read per field - no validation and no per-field dispatch the
+    way response_model serialization does it. Only for trusted objects whose
+    attributes already have the declared types: ORM rows and our own models.
+    Fields listed in nested are passed through their serializer (None stays None).
+    """
+    nested = nested or {}
+    namespace = {}
+    items = []
+    for name in model.model_fields:
+        if name in nested:
+            namespace[f"_{name}"] = nested[name]
+            items.append(f"{name!r}: None if obj.{name} is None else _{name}(obj.{name})")
+        else:
+            items.append(f"{name!r}: obj.{name}")
+
+    source = f"def serialize_{model.__name__}(obj):\n    return {{{', '.join(items)}}}\n"
+    exec(compile(source, f"<serializer {model.__name__}>", "exec"), namespace)
+    return namespace[f"serialize_{model.__name__}"]
+
+
+serialize_user = compile_serializer(UserResponse)
+serialize_ride = compile_serializer(RideResponse, {"rider": serialize_user, "driver": serialize_user})
+
+
+def ride_response(ride) -> ORJSONResponse:
+    """RideResponse body for a ride loaded with its rider and driver (get_ride_detail)"""
+    return ORJSONResponse(serialize_ride(ride))
+
+
+def user_response(user) -> ORJSONResponse:
+    """UserResponse body for a User row or a cached UserResponse"""
+    return ORJSONResponse(serialize_user(user))
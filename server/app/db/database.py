@@ -1,7 +1,15 @@
-from sqlalchemy import create_engine, MetaData
+from fastapi import Request
+from sqlalchemy import create_engine, MetaData, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+import logging
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -10,20 +18,209 @@ load_dotenv()
 # Use the correct environment variable name
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-# Create SQLAlchemy engine
-engine = create_engine(DATABASE_URL)
+# Connection pool sizing (per engine, per worker process)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+
+# Optional read replicas (comma-separated URLs - the primary's own URL works too)
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "2"))
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv("REPLICA_LAG_CHECK_SECONDS", "5"))
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "10"))
+
+logger = logging.getLogger(__name__)
+
+
+def _async_url(url: str) -> str:
+    """Same database through an asyncio driver (asyncpg for Postgres)"""
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    return url
+
+
+def _pool_options(url: str) -> dict:
+    if url.startswith("sqlite"):
+        return {}  # SQLite picks its own pool class
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT_SECONDS,
+        "pool_pre_ping": True
+    }
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url(DATABASE_URL)
+
+# Create SQLAlchemy engine (scripts, sync endpoints and executor-thread flushes)
+engine = create_engine(DATABASE_URL, **_pool_options(DATABASE_URL))
 
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine for code running on the event loop (matching engine, async endpoints)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_pool_options(ASYNC_DATABASE_URL))
+
+# Objects stay readable after commit - lazy refreshes are not possible without a greenlet
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 # Base class for models
 Base = declarative_base()
 metadata = MetaData()
 
+# Seconds a replica is behind; 0 when caught up (an idle replica has an old replay
+# timestamp but nothing left to replay) or when the "replica" is itself a primary
+REPLICA_LAG_SQL = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+class ReplicaRouter:
+    """
+    Picks the database for read-only requests
+
+    Reads go round-robin to replicas whose lag (measured at most every
+    REPLICA_LAG_CHECK_SECONDS) is within REPLICA_MAX_LAG_SECONDS, and fall back
+    to the primary when none qualifies. Users and rides written through this
+    worker in the last READ_YOUR_WRITES_SECONDS are read from the primary, so a
+    rider never sees their own change disappear.
+    """
+
+    def __init__(self, urls: List[str]):
+        self.replicas = []  # (label, sessionmaker)
+        for url in urls:
+            replica_engine = create_engine(url, **_pool_options(url))
+            label = make_url(url).render_as_string(hide_password=True)
+            self.replicas.append((label, sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)))
+        self.stats = Counter()
+        self._lag: List[Tuple[float, float]] = [(float("inf"), 0.0)] * len(self.replicas)  # (lag, checked at)
+        self._next = 0
+        self._recent_writes: Dict[Tuple[str, int], float] = {}  # ("user" | "ride", id) -> sticky until
+        self._lock = threading.Lock()  # Sync handlers run in a thread pool
+
+    def mark_written(self, user_ids: Iterable[int] = (), ride_ids: Iterable[int] = ()):
+        """Read these users and rides from the primary for READ_YOUR_WRITES_SECONDS"""
+        if not self.replicas:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for key in [("user", user_id) for user_id in user_ids] + [("ride", ride_id) for ride_id in ride_ids]:
+                self._recent_writes[key] = now + READ_YOUR_WRITES_SECONDS
+            if len(self._recent_writes) > 10000:
+                self._recent_writes = {key: until for key, until in self._recent_writes.items() if until > now}
+
+    def _is_sticky(self, user_ids: Iterable[int], ride_ids: Iterable[int]) -> bool:
+        now = time.monotonic()
+        keys = [("user", user_id) for user_id in user_ids] + [("ride", ride_id) for ride_id in ride_ids]
+        return any(self._recent_writes.get(key, 0) > now for key in keys)
+
+    def _replica_lag(self, index: int) -> float:
+        lag, checked_at = self._lag[index]
+        if time.monotonic() - checked_at < REPLICA_LAG_CHECK_SECONDS:
+            return lag
+
+        label, replica_session = self.replicas[index]
+        self._lag[index] = (lag, time.monotonic())  # Other threads keep the old value meanwhile
+        db = replica_session()
+        try:
+            lag = float(db.execute(REPLICA_LAG_SQL).scalar()) if db.bind.dialect.name == "postgresql" else 0.0
+        except Exception as e:
+            logger.warning(f"⚠️ Replica {label} unavailable: {e}")
+            lag = float("inf")
+        finally:
+            db.close()
+
+        if REPLICA_MAX_LAG_SECONDS < lag < float("inf"):
+            logger.warning(f"⚠️ Replica {label} is {lag:.1f}s behind - reading from the primary")
+        self._lag[index] = (lag, time.monotonic())
+        return lag
+
+    def read_session(self, user_ids: Iterable[int] = (), ride_ids: Iterable[int] = ()) -> Session:
+        """Session for a read-only request about these users and rides"""
+        if not self.replicas:
+            self.stats["reads_primary"] += 1
+            return SessionLocal()
+        if self._is_sticky(user_ids, ride_ids):
+            self.stats["reads_sticky"] += 1
+            return SessionLocal()
+
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.replicas)
+        for offset in range(len(self.replicas)):
+            index = (start + offset) % len(self.replicas)
+            if self._replica_lag(index) <= REPLICA_MAX_LAG_SECONDS:
+                self.stats["reads_replica"] += 1
+                return self.replicas[index][1]()
+
+        self.stats["reads_fallback"] += 1
+        return SessionLocal()
+
+    def get_stats(self) -> dict:
+        """Routing counters and replica lag for the metrics endpoint"""
+        return {
+            "replicas": [
+                {"url": label, "lag_seconds": None if lag == float("inf") else lag, "healthy": lag <= REPLICA_MAX_LAG_SECONDS}
+                for (label, _), (lag, _) in zip(self.replicas, self._lag)
+            ],
+            "reads_primary": self.stats["reads_primary"],
+            "reads_replica": self.stats["reads_replica"],
+            "reads_sticky": self.stats["reads_sticky"],
+            "reads_fallback": self.stats["reads_fallback"]
+        }
+
+
+# Global replica router (routes everything to the primary when no replicas are configured)
+replica_router = ReplicaRouter(DATABASE_REPLICA_URLS)
+
+
+def _request_keys(request: Request) -> Tuple[List[int], List[int]]:
+    """(user ids, ride ids) named in the request's path and query parameters"""
+    user_ids, ride_ids = [], []
+    for params in (request.path_params, request.query_params):
+        for name in ("user_id", "rider_id", "driver_id", "ride_id"):
+            try:
+                value = int(params[name])
+            except (KeyError, ValueError, TypeError):
+                continue
+            (ride_ids if name == "ride_id" else user_ids).append(value)
+    return user_ids, ride_ids
+
+
+def _mark_request_written(request: Request):
+    if request.method not in ("GET", "HEAD", "OPTIONS"):
+        replica_router.mark_written(*_request_keys(request))
+
 # Dependency to get DB session
-def get_db():
+def get_db(request: Request):
+    _mark_request_written(request)
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+        _mark_request_written(request)  # Restart the window once the write is committed
+
+# Dependency to get a session for read-only handlers (replica when one is healthy)
+def get_read_db(request: Request):
+    db = replica_router.read_session(*_request_keys(request))
+    try:
+        yield db
+    finally:
+        db.close()
+
+# Dependency to get an async DB session (for async def handlers)
+async def get_async_db(request: Request):
+    _mark_request_written(request)
+    try:
+        async with AsyncSessionLocal() as db:
+            yield db
+    finally:
+        _mark_request_written(request)  # Restart the window once the write is committed, even if the handler raised
@@ -0,0 +1,309 @@
+"""
+Versioned Schema Migrations
+Numbered migrations for existing PostgreSQL databases, tracked in schema_migrations
+
+Fresh databases get the current schema from Base.metadata.create_all() on startup;
+migrations bring databases created by older code up to the same schema. Each
+migration runs at most once, in version order, under an advisory lock so several
+workers starting together do not race.
+
+Indexes added here come with a plan check (PLAN_CHECKS): check_query_plans()
+builds a scratch schema with 1M rides, applies the migrations and asserts via
+EXPLAIN that each hot query is served by its index.
+"""
+
+import json
+import os
+from contextlib import contextmanager
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from . import models  # noqa: F401 - registers the tables on Base.metadata
+from .database import Base, engine as default_engine
+from .models import RideStatus
+
+MIGRATION_LOCK_ID = 727_001  # pg_advisory_lock key
+
+# Old VARCHAR status -> RideStatus value; _unmapped_status_check() runs first,
+# so no non-NULL status can fall through the CASE to NULL
+_STATUS_NAMES = ", ".join(f"'{status.name.lower()}'" for status in RideStatus)
+_STATUS_TO_SMALLINT = "CASE status " + " ".join(
+    f"WHEN '{status.name.lower()}' THEN {status.value}" for status in RideStatus
+) + " END"
+
+
+def _unmapped_status_check(table: str) -> str:
+    """PL/pgSQL statement aborting the migration if the table has a status RideStatus does not know"""
+    return f"""IF EXISTS (SELECT 1 FROM {table} WHERE status NOT IN ({_STATUS_NAMES})) THEN
+                    RAISE EXCEPTION 'Unmapped {table}.status values: % - map them to a RideStatus before migrating',
+                        (SELECT string_agg(DISTINCT status, ', ') FROM {table} WHERE status NOT IN ({_STATUS_NAMES}));
+                END IF;"""
+
+
+class Migration:
+    """
+    One schema change
+
+    transactional=False runs the statements in autocommit mode, as needed by
+    CREATE INDEX CONCURRENTLY (no table lock on a live database).
+    """
+
+    def __init__(self, version: int, name: str, statements: List[str], transactional: bool = True):
+        self.version = version
+        self.name = name
+        self.statements = statements
+        self.transactional = transactional
+
+
+MIGRATIONS = [
+    Migration(1, "offer_columns", [
+        """
+        ALTER TABLE rides
+        ADD COLUMN IF NOT EXISTS offered_to_driver_id INTEGER,
+        ADD COLUMN IF NOT EXISTS offered_at TIMESTAMP,
+        ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP,
+        ADD COLUMN IF NOT EXISTS offer_attempts INTEGER DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS declined_driver_ids TEXT,
+        ADD COLUMN IF NOT EXISTS current_offer_driver_id INTEGER,
+        ADD COLUMN IF NOT EXISTS offer_expires_at TIMESTAMP,
+        ADD COLUMN IF NOT EXISTS cancellation_reason VARCHAR(100),
+        ADD COLUMN IF NOT EXISTS cancelled_at TIMESTAMP
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_rides_status ON rides(status)",
+        "CREATE INDEX IF NOT EXISTS idx_rides_created_at ON rides(created_at)",
+    ]),
+    Migration(2, "hot_path_indexes", [
+        # The rides partial indexes (matching queue, offer expiry) are built by
+        # migration 5 - their predicates depend on the type of rides.status
+        # Matcher candidate lookup: online drivers only (a small slice of users)
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_available_drivers
+        ON users (id)
+        WHERE is_driver AND availability
+        """,
+    ], transactional=False),
+    Migration(3, "ride_archive", [
+        # Payments may point at archived rides; rides_archive itself is created by create_all() above
+        "ALTER TABLE payments DROP CONSTRAINT IF EXISTS payments_ride_id_fkey",
+        "CREATE INDEX IF NOT EXISTS ix_payments_ride_id ON payments (ride_id)",
+    ]),
+    Migration(4, "ride_list_keyset_indexes", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_rides_created_at_id ON rides (created_at, id)",
+        # CONCURRENTLY is not supported on partitioned tables (the archive is not on the hot path)
+        "CREATE INDEX IF NOT EXISTS ix_rides_archive_created_at_id ON rides_archive (created_at, id)",
+    ], transactional=False),
+    Migration(5, "ride_status_smallint", [
+        # Rewrites both tables (ACCESS EXCLUSIVE lock) - run in a quiet period.
+        # Skipped for tables already created with SMALLINT by create_all().
+        f"""
+        DO $$
+        BEGIN
+            IF (SELECT data_type FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = 'rides' AND column_name = 'status') <> 'smallint' THEN
+                {_unmapped_status_check("rides")}
+                DROP INDEX IF EXISTS ix_rides_matching_queue;
+                DROP INDEX IF EXISTS ix_rides_offering_expires_at;
+                ALTER TABLE rides ALTER COLUMN status DROP DEFAULT;
+                ALTER TABLE rides ALTER COLUMN status TYPE SMALLINT USING ({_STATUS_TO_SMALLINT});
+            END IF;
+            IF (SELECT data_type FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = 'rides_archive' AND column_name = 'status') <> 'smallint' THEN
+                {_unmapped_status_check("rides_archive")}
+                ALTER TABLE rides_archive ALTER COLUMN status TYPE SMALLINT USING ({_STATUS_TO_SMALLINT});
+            END IF;
+        END $$
+        """,
+        # Matcher claim: oldest requested ride without an active offer
+        f"""
+        CREATE INDEX IF NOT EXISTS ix_rides_matching_queue
+        ON rides (created_at)
+        WHERE status = {RideStatus.REQUESTED:d} AND current_offer_driver_id IS NULL
+        """,
+        # Expiry sweep: offers waiting for an answer
+        f"""
+        CREATE INDEX IF NOT EXISTS ix_rides_offering_expires_at
+        ON rides (expires_at)
+        WHERE status = {RideStatus.OFFERING:d}
+        """,
+    ]),
+]
+
+# (index, query) - the query mirrors what MatchingEngine sends for that hot path
+PLAN_CHECKS = [
+    (
+        "ix_rides_matching_queue",
+        f"SELECT * FROM rides WHERE status = {RideStatus.REQUESTED:d} AND current_offer_driver_id IS NULL "
+        "ORDER BY created_at ASC LIMIT 1 FOR UPDATE SKIP LOCKED"
+    ),
+    (
+        "ix_users_available_drivers",
+        "SELECT * FROM users WHERE is_driver = true AND availability = true"
+    ),
+    (
+        "ix_rides_offering_expires_at",
+        f"SELECT * FROM rides WHERE status = {RideStatus.OFFERING:d} AND expires_at <= now()"
+    ),
+    (
+        "ix_rides_created_at_id",
+        "SELECT id, created_at, status FROM rides WHERE (created_at, id) < (now() - interval '30 days', 0) "
+        "ORDER BY created_at DESC, id DESC LIMIT 101"
+    ),
+]
+
+
+@contextmanager
+def _connect(engine: Engine, schema: Optional[str] = None, autocommit: bool = False):
+    connection = engine.connect()
+    if autocommit:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+    try:
+        if schema:
+            connection.execute(text(f'SET search_path TO "{schema}"'))
+            if not autocommit:
+                connection.commit()  # Keep the setting even if the caller rolls back
+        yield connection
+    finally:
+        connection.close()
+
+
+def _ensure_version_table(connection: Connection):
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+    """))
+
+
+def applied_versions(engine: Engine = default_engine, schema: Optional[str] = None) -> List[int]:
+    with _connect(engine, schema, autocommit=True) as connection:
+        _ensure_version_table(connection)
+        return [row[0] for row in connection.execute(text("SELECT version FROM schema_migrations ORDER BY version"))]
+
+
+def pending_migrations(engine: Engine = default_engine, schema: Optional[str] = None) -> List[Migration]:
+    applied = set(applied_versions(engine, schema))
+    return [migration for migration in MIGRATIONS if migration.version not in applied]
+
+
+def migrate(engine: Engine = default_engine, schema: Optional[str] = None, log=print) -> List[Migration]:
+    """Apply pending migrations in order; returns the ones applied"""
+    if engine.dialect.name != "postgresql":
+        raise RuntimeError(f"Migrations target PostgreSQL (got {engine.dialect.name}) - other databases use create_all()")
+
+    applied = []
+    with _connect(engine, schema, autocommit=True) as lock_connection:
+        lock_connection.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        try:
+            # New tables first (create_all skips existing ones) - later migrations may index them
+            with engine.begin() as connection:
+                Base.metadata.create_all(connection.execution_options(schema_translate_map={None: schema}))
+
+            for migration in pending_migrations(engine, schema):  # Re-read under the lock
+                log(f"📝 Applying migration {migration.version}: {migration.name}")
+                with _connect(engine, schema, autocommit=not migration.transactional) as connection:
+                    transaction = connection.begin() if migration.transactional else None
+                    for statement in migration.statements:
+                        connection.execute(text(statement))
+                    connection.execute(
+                        text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"),
+                        {"version": migration.version, "name": migration.name}
+                    )
+                    if transaction:
+                        transaction.commit()
+                applied.append(migration)
+        finally:
+            lock_connection.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+    return applied
+
+
+# ============================================
+# EXPLAIN REGRESSION CHECK
+# ============================================
+
+def _seed(connection: Connection, rides: int, users: int):
+    """Synthetic history shaped like production: mostly finished rides, few online drivers"""
+    connection.execute(text("""
+        INSERT INTO users (username, email, hashed_password, is_driver, availability, created_at, latitude, longitude)
+        SELECT 'plan_user_' || g, 'plan_user_' || g || '@example.com', 'x',
+               g % 5 = 0,                              -- 20% drivers
+               g % 5 <> 0 OR g % 100 = 0,              -- riders default to true; 5% of drivers online
+               now(), 40.7 + random() / 10, -74.0 + random() / 10
+        FROM generate_series(1, :users) g
+    """), {"users": users})
+    connection.execute(text("""
+        INSERT INTO rides (rider_id, status, created_at, expires_at, offered_to_driver_id,
+                           current_offer_driver_id, offer_attempts, start_lat, start_lng, end_lat, end_lng)
+        SELECT (g % :users) + 1,
+               CASE WHEN g % 5000 = 0 THEN :requested
+                    WHEN g % 5000 = 1 THEN :offering
+                    WHEN g % 10 = 0 THEN :cancelled
+                    ELSE :completed END,
+               now() - make_interval(secs => (:rides - g) * 30),
+               CASE WHEN g % 5000 = 1 THEN now() + make_interval(secs => (g % 40) - 20) END,
+               CASE WHEN g % 5000 = 1 THEN (g % (:users / 5)) * 5 + 5 END,
+               CASE WHEN g % 5000 = 1 THEN (g % (:users / 5)) * 5 + 5 END,
+               1, 40.7, -74.0, 40.8, -73.9
+        FROM generate_series(1, :rides) g
+    """), {
+        "rides": rides, "users": users,
+        "requested": RideStatus.REQUESTED.value, "offering": RideStatus.OFFERING.value,
+        "cancelled": RideStatus.CANCELLED.value, "completed": RideStatus.COMPLETED.value
+    })
+    connection.execute(text("ANALYZE users"))
+    connection.execute(text("ANALYZE rides"))
+
+
+def _plan_indexes(plan: dict) -> List[str]:
+    names = [plan["Index Name"]] if "Index Name" in plan else []
+    for child in plan.get("Plans", []):
+        names.extend(_plan_indexes(child))
+    return names
+
+
+def check_query_plans(engine: Engine = default_engine, rides: int = 1_000_000, users: int = 50_000, log=print) -> bool:
+    """
+    EXPLAIN each hot query against a scratch copy of the schema holding `rides` rides
+
+    The hot-path indexes are dropped after create_all() so the migrations have to
+    build them. Returns True if every query used its index. The scratch schema is
+    always dropped afterwards; the real tables are never touched.
+    """
+    schema = f"plan_check_{os.getpid()}"
+    ok = True
+
+    with _connect(engine, autocommit=True) as connection:
+        connection.execute(text(f'CREATE SCHEMA "{schema}"'))
+    try:
+        with engine.begin() as connection:
+            Base.metadata.create_all(connection.execution_options(schema_translate_map={None: schema}))
+            for index, _ in PLAN_CHECKS:
+                connection.execute(text(f'DROP INDEX IF EXISTS "{schema}"."{index}"'))
+
+        log(f"🌱 Seeding {rides:,} rides and {users:,} users into scratch schema {schema}...")
+        with _connect(engine, schema) as connection:
+            _seed(connection, rides, users)
+            connection.commit()
+
+        migrate(engine, schema, log=log)
+
+        with _connect(engine, schema) as connection:
+            for index, query in PLAN_CHECKS:
+                plan = connection.execute(text(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}")).scalar()
+                plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]
+                used = _plan_indexes(plan["Plan"])
+                passed = index in used
+                ok = ok and passed
+                log(
+                    f"{'✅' if passed else '❌'} {index}: {plan['Plan']['Node Type']} "
+                    f"using {', '.join(used) or 'no index'} ({plan['Execution Time']:.2f} ms)"
+                )
+            connection.rollback()  # Release the FOR UPDATE locks taken by ANALYZE
+    finally:
+        with _connect(engine, autocommit=True) as connection:
+            connection.execute(text(f'DROP SCHEMA "{schema}" CASCADE'))
+
+    return ok
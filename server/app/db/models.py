@@ -1,6 +1,8 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, BigInteger, SmallInteger, String, Text, Float, Boolean, DateTime, ForeignKey, Index, text
+from sqlalchemy.orm import relationship, foreign
+from sqlalchemy.types import TypeDecorator
 from datetime import datetime
+import enum
 
 from ..db.database import Base
 
@@ -21,6 +23,52 @@ class User(Base):
     # Relationships
     rides_as_rider = relationship("Ride", foreign_keys="Ride.rider_id", back_populates="rider")
     rides_as_driver = relationship("Ride", foreign_keys="Ride.driver_id", back_populates="driver")
+    
+    # Hot-path indexes (also created on existing databases by migration 2, see db/migrations.py)
+    __table_args__ = (
+        # Matcher candidate lookup: is_driver AND availability
+        Index(
+            "ix_users_available_drivers", "id",
+            postgresql_where=text("is_driver AND availability"),
+            sqlite_where=text("is_driver AND availability")
+        ),
+    )
+
+
+class RideStatus(enum.IntEnum):
+    """
+    Ride states as stored in rides.status (SMALLINT)
+
+    Code and API use the lower-case names ("requested", ...); RideStatusType
+    converts. Allowed transitions are listed in services/ride_state.py.
+    """
+    REQUESTED = 1
+    OFFERING = 2
+    ACCEPTED = 3
+    IN_PROGRESS = 4
+    COMPLETED = 5
+    CANCELLED = 6
+    DECLINED = 7  # Legacy values, kept so old rows stay readable
+    EXPIRED = 8
+
+
+RIDE_STATUSES = tuple(status.name.lower() for status in RideStatus)
+
+
+class RideStatusType(TypeDecorator):
+    """Status name in Python, RideStatus value in the database"""
+    impl = SmallInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            return RideStatus[value.upper()].value
+        return int(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else RideStatus(value).name.lower()
 
 
 class Ride(Base):
@@ -36,9 +84,8 @@ class Ride(Base):
     end_lat = Column(Float, nullable=True)
     end_lng = Column(Float, nullable=True)
     
-    # Enhanced status system for offer flow
-    # Possible values: requested, offering, accepted, declined, expired, in_progress, completed, cancelled
-    status = Column(String, default="requested", index=True)
+    # Enhanced status system for offer flow (see RideStatus)
+    status = Column(RideStatusType, default="requested", index=True)
     
     # Offer tracking fields
     offered_to_driver_id = Column(Integer, ForeignKey("users.id"), nullable=True)  # Current driver being offered
@@ -60,16 +107,108 @@ class Ride(Base):
     # Relationships
     rider = relationship("User", foreign_keys=[rider_id], back_populates="rides_as_rider")
     driver = relationship("User", foreign_keys=[driver_id], back_populates="rides_as_driver")
+    
+    # Hot-path indexes (also created on existing databases by migration 5, see db/migrations.py)
+    __table_args__ = (
+        # Matcher claim: status='requested' AND current_offer_driver_id IS NULL ORDER BY created_at
+        Index(
+            "ix_rides_matching_queue", "created_at",
+            postgresql_where=text(f"status = {RideStatus.REQUESTED:d} AND current_offer_driver_id IS NULL"),
+            sqlite_where=text(f"status = {RideStatus.REQUESTED:d} AND current_offer_driver_id IS NULL")
+        ),
+        # Expiry sweep: status='offering' AND expires_at <= now
+        Index(
+            "ix_rides_offering_expires_at", "expires_at",
+            postgresql_where=text(f"status = {RideStatus.OFFERING:d}"),
+            sqlite_where=text(f"status = {RideStatus.OFFERING:d}")
+        ),
+        # Ride listing keyset: ORDER BY created_at DESC, id DESC (migration 4)
+        Index("ix_rides_created_at_id", "created_at", "id"),
+    )
 
 
 class Payment(Base):
     __tablename__ = "payments"
     
     id = Column(Integer, primary_key=True, index=True)
-    ride_id = Column(Integer, ForeignKey("rides.id"))
+    ride_id = Column(Integer, index=True)  # No foreign key: the ride may have moved to rides_archive
     amount = Column(Float)
     status = Column(String, default="pending")  # pending, completed, failed
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relationships
-    ride = relationship("Ride")
+    ride = relationship("Ride", primaryjoin=lambda: foreign(Payment.ride_id) == Ride.id, viewonly=True)
+
+
+FINISHED_RIDE_STATUSES = ("completed", "cancelled")
+
+
+class RideArchive(Base):
+    """
+    Finished rides moved out of the hot rides table by the ride archiver
+
+    Same columns as Ride. On PostgreSQL the table is partitioned by month of
+    created_at (partitions are created by the archiver as needed), so old
+    history can be detached or dropped per month.
+    """
+    __tablename__ = "rides_archive"
+    
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    rider_id = Column(Integer, index=True)
+    driver_id = Column(Integer, index=True, nullable=True)
+    start_location = Column(String)
+    start_lat = Column(Float, nullable=True)
+    start_lng = Column(Float, nullable=True)
+    end_location = Column(String)
+    end_lat = Column(Float, nullable=True)
+    end_lng = Column(Float, nullable=True)
+    status = Column(RideStatusType)
+    offered_to_driver_id = Column(Integer, nullable=True)
+    offered_at = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=True)
+    offer_attempts = Column(Integer, default=0)
+    declined_driver_ids = Column(String, nullable=True)
+    current_offer_driver_id = Column(Integer, nullable=True)
+    offer_expires_at = Column(DateTime, nullable=True)
+    cancellation_reason = Column(String(100), nullable=True)
+    created_at = Column(DateTime, primary_key=True)  # Partition key - must be part of the primary key
+    completed_at = Column(DateTime, nullable=True)
+    cancelled_at = Column(DateTime, nullable=True)
+    fare = Column(Float, nullable=True)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Relationships (no foreign keys on the archive, so read-only like Payment.ride)
+    rider = relationship("User", primaryjoin=lambda: foreign(RideArchive.rider_id) == User.id, viewonly=True)
+    driver = relationship("User", primaryjoin=lambda: foreign(RideArchive.driver_id) == User.id, viewonly=True)
+    
+    __table_args__ = (
+        # Ride listing keyset: ORDER BY created_at DESC, id DESC (migration 4)
+        Index("ix_rides_archive_created_at_id", "created_at", "id"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+
+class NotificationLog(Base):
+    """Persisted notification outbox, replayed to clients that reconnect after missing messages"""
+    __tablename__ = "notification_log"
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)  # No foreign key: inserted in batches on the hot path
+    seq = Column(BigInteger, nullable=False)
+    payload = Column(Text, nullable=False)  # Serialized message, sent as-is on replay
+    expires_at = Column(DateTime, nullable=True)  # Not replayed after this (e.g. ride offers)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    
+    __table_args__ = (
+        Index("ix_notification_log_user_seq", "user_id", "seq"),
+    )
+
+
+class RevokedSession(Base):
+    """Session tokens revoked before they expire (logout); kept until their expiry"""
+    __tablename__ = "revoked_sessions"
+    
+    token_id = Column(String(16), primary_key=True)  # Hex token id carried by the token
+    user_id = Column(Integer, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)  # Token expiry - the row is useless after it
+    revoked_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,51 @@
+"""
+Shared Read Queries
+Ride detail (ride + rider + driver) in a single round trip, for every endpoint returning RideResponse
+"""
+
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+
+from ..core.schemas import UserResponse
+from .models import Ride, RideArchive, User
+
+# Only the columns UserResponse exposes (never hashed_password)
+USER_RESPONSE_COLUMNS = [getattr(User, name) for name in UserResponse.model_fields]
+
+
+def ride_detail_options(model=Ride) -> list:
+    """Loader options joining the rider and driver into the ride query (Ride or RideArchive)"""
+    return [
+        joinedload(model.rider).load_only(*USER_RESPONSE_COLUMNS),
+        joinedload(model.driver).load_only(*USER_RESPONSE_COLUMNS)
+    ]
+
+
+def ride_detail_query(ride_id: int, model=Ride):
+    """
+    SELECT one ride LEFT OUTER JOINed to its rider and driver
+
+    Works with both Session.execute() and AsyncSession.execute(). Existing
+    objects in the session are overwritten (populate_existing), so it doubles
+    as the refresh after a commit.
+    """
+    return (
+        select(model)
+        .options(*ride_detail_options(model))
+        .filter(model.id == ride_id)
+        .execution_options(populate_existing=True)
+    )
+
+
+def get_ride_detail(db, ride_id: int, archived: bool = False):
+    """Ride with rider and driver loaded, or None (sync Session); archived=True also looks in rides_archive"""
+    for model in (Ride, RideArchive) if archived else (Ride,):
+        ride = db.execute(ride_detail_query(ride_id, model)).scalars().first()
+        if ride:
+            return ride
+    return None
+
+
+async def get_ride_detail_async(db, ride_id: int):
+    """Live ride with rider and driver loaded, or None (AsyncSession)"""
+    return (await db.execute(ride_detail_query(ride_id))).scalars().first()
@@ -0,0 +1,372 @@
+"""
+Synthetic City
+Deterministic bulk dataset (users, drivers, ride history) for load tests and benchmarks
+
+Everything is derived from one seed, so two runs with the same arguments produce
+the same rows (ids included, on an empty database). Rows are generated lazily and
+bulk-loaded with COPY on PostgreSQL (batched executemany elsewhere).
+"""
+
+import csv
+import io
+import math
+import random
+from datetime import datetime, timedelta
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import bcrypt
+from sqlalchemy import func, insert, select
+from sqlalchemy.engine import Engine
+
+from .database import engine as default_engine
+from .models import Ride, RideStatus, User
+
+KM_PER_DEGREE = 111.32
+
+# Demand hotspots: (name, kind, km north of center, km east of center, spread km, weight)
+HOTSPOTS = [
+    ("Downtown", "business", 0.0, 0.0, 1.5, 0.30),
+    ("Financial District", "business", 1.5, 2.0, 0.8, 0.15),
+    ("University", "residential", -3.0, 4.0, 1.2, 0.10),
+    ("Northside", "residential", 6.0, -2.0, 2.5, 0.15),
+    ("Southside", "residential", -6.0, -1.0, 3.0, 0.15),
+    ("Nightlife District", "nightlife", -1.0, 1.0, 0.7, 0.08),
+    ("Airport", "airport", -12.0, 8.0, 0.6, 0.07),
+]
+
+# Hours in which a kind of hotspot sees extra pickups / dropoffs, and by how much
+KIND_PEAKS = {
+    "residential": {"pickup": ((6, 7, 8, 9), 3.0), "dropoff": ((16, 17, 18, 19, 20), 3.0)},
+    "business": {"pickup": ((16, 17, 18, 19), 3.0), "dropoff": ((7, 8, 9), 3.0)},
+    "nightlife": {"pickup": ((22, 23, 0, 1, 2, 3), 4.0), "dropoff": ((19, 20, 21, 22), 3.0)},
+    "airport": {"pickup": (tuple(range(14, 23)), 1.5), "dropoff": ((5, 6, 7, 8, 9), 2.0)},
+}
+
+# Citywide rides per hour of day (relative) and per weekday (Monday first)
+HOURLY_DEMAND = [
+    0.6, 0.4, 0.3, 0.2, 0.2, 0.4, 1.0, 2.2, 2.8, 1.8, 1.2, 1.2,
+    1.4, 1.3, 1.2, 1.4, 1.9, 2.6, 2.7, 2.0, 1.6, 1.5, 1.3, 0.9
+]
+WEEKDAY_DEMAND = [1.0, 1.0, 1.05, 1.1, 1.3, 1.35, 0.9]
+
+USER_COLUMNS = [
+    "id", "username", "email", "hashed_password", "is_driver", "availability",
+    "created_at", "latitude", "longitude", "vehicle", "rating"
+]
+RIDE_COLUMNS = [
+    "id", "rider_id", "driver_id", "start_location", "start_lat", "start_lng",
+    "end_location", "end_lat", "end_lng", "status", "offered_to_driver_id",
+    "offered_at", "offer_attempts", "cancellation_reason", "created_at",
+    "completed_at", "cancelled_at", "fare"
+]
+VEHICLES = ["Toyota Prius", "Honda Civic", "Tesla Model 3", "Hyundai Ioniq", "Ford Escape", "Kia Niro"]
+
+
+def _bcrypt_salt(rng: random.Random, rounds: int) -> bytes:
+    """bcrypt salt drawn from rng instead of os.urandom (deterministic hashes)"""
+    alphabet = "./ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+    body = "".join(rng.choice(alphabet) for _ in range(21)) + rng.choice(".Oeu")  # Last char: 2 significant bits
+    return f"$2b${rounds:02d}${body}".encode("ascii")
+
+
+class SyntheticCity:
+    """
+    A city around (center_lat, center_lng) with demand hotspots
+
+    Drivers are placed by a density model: mostly around the hotspots in
+    proportion to their demand, the rest spread uniformly over radius_km.
+    Ride history covers the `days` days before `until`: rides per hour follow
+    HOURLY_DEMAND x WEEKDAY_DEMAND, pickups and dropoffs favour the hotspots
+    whose kind peaks at that hour (residential -> business in the morning, the
+    reverse in the evening, nightlife late at night, airport runs). A
+    ride's driver comes from the pickup hotspot's drivers, a few heavy riders
+    take a large share of rides, and fares follow distance and rush-hour speed.
+
+    Users get the password "password<N>" with N = id % password_pool; only
+    password_pool bcrypt hashes are computed, with salts from the seed.
+    """
+
+    def __init__(
+        self,
+        riders: int = 200_000,
+        drivers: int = 20_000,
+        rides: int = 1_000_000,
+        days: int = 90,
+        seed: int = 42,
+        center_lat: float = 37.7749,
+        center_lng: float = -122.4194,
+        radius_km: float = 15.0,
+        online_fraction: float = 0.3,
+        cancelled_fraction: float = 0.08,
+        password_pool: int = 8,
+        bcrypt_rounds: int = 12,
+        until: Optional[datetime] = None
+    ):
+        self.riders = riders
+        self.drivers = drivers
+        self.rides = rides
+        self.days = days
+        self.seed = seed
+        self.center_lat = center_lat
+        self.center_lng = center_lng
+        self.radius_km = radius_km
+        self.online_fraction = online_fraction
+        self.cancelled_fraction = cancelled_fraction
+        self.password_pool = password_pool
+        self.bcrypt_rounds = bcrypt_rounds
+        # Fixed default (today 00:00 UTC) so reruns on the same day match row for row
+        self.until = until or datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+
+        self._km_per_degree_lng = KM_PER_DEGREE * math.cos(math.radians(center_lat))
+        self._pickup_weights = [self._cumulative_weights(hour, "pickup") for hour in range(24)]
+        self._dropoff_weights = [self._cumulative_weights(hour, "dropoff") for hour in range(24)]
+        self._driver_positions = None
+
+    # ============================================
+    # DENSITY MODEL
+    # ============================================
+
+    def _cumulative_weights(self, hour: int, role: str) -> List[float]:
+        cumulative, total = [], 0.0
+        for _, kind, _, _, _, weight in HOTSPOTS:
+            hours, boost = KIND_PEAKS[kind][role]
+            total += weight * (boost if hour in hours else 1.0)
+            cumulative.append(total)
+        return cumulative
+
+    def driver_positions(self) -> List[Tuple[float, float, int]]:
+        """(latitude, longitude, nearest hotspot) per driver: 90% around hotspots by demand, 10% anywhere"""
+        if self._driver_positions is None:
+            rng = random.Random(f"{self.seed}:drivers")
+            hotspots = range(len(HOTSPOTS))
+            demand = [weight for _, _, _, _, _, weight in HOTSPOTS]
+            positions = []
+            for _ in range(self.drivers):
+                if rng.random() < 0.9:
+                    hotspot = rng.choices(hotspots, weights=demand)[0]
+                    latitude, longitude = self._point_near(rng, hotspot)
+                else:
+                    latitude, longitude = self._point_anywhere(rng)
+                    hotspot = min(hotspots, key=lambda i: self._distance_km(latitude, longitude, *self._hotspot_center(i)))
+                positions.append((latitude, longitude, hotspot))
+            self._driver_positions = positions
+        return self._driver_positions
+
+    def _hotspot_center(self, hotspot: int) -> Tuple[float, float]:
+        _, _, north_km, east_km, _, _ = HOTSPOTS[hotspot]
+        return self.center_lat + north_km / KM_PER_DEGREE, self.center_lng + east_km / self._km_per_degree_lng
+
+    def _point_near(self, rng: random.Random, hotspot: int) -> Tuple[float, float]:
+        _, _, north_km, east_km, spread_km, _ = HOTSPOTS[hotspot]
+        north_km = rng.gauss(north_km, spread_km)
+        east_km = rng.gauss(east_km, spread_km)
+        return (
+            round(self.center_lat + north_km / KM_PER_DEGREE, 6),
+            round(self.center_lng + east_km / self._km_per_degree_lng, 6)
+        )
+
+    def _point_anywhere(self, rng: random.Random) -> Tuple[float, float]:
+        distance = self.radius_km * math.sqrt(rng.random())
+        bearing = rng.uniform(0, 2 * math.pi)
+        return (
+            round(self.center_lat + distance * math.cos(bearing) / KM_PER_DEGREE, 6),
+            round(self.center_lng + distance * math.sin(bearing) / self._km_per_degree_lng, 6)
+        )
+
+    @staticmethod
+    def _distance_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+        phi1, phi2 = math.radians(lat1), math.radians(lat2)
+        a = math.sin((phi2 - phi1) / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2
+        return 6371 * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+    # ============================================
+    # ROWS
+    # ============================================
+
+    def password_hashes(self) -> List[str]:
+        """One hash per pool password ("password0" ...), deterministic from the seed"""
+        rng = random.Random(f"{self.seed}:passwords")
+        return [
+            bcrypt.hashpw(f"password{n}".encode("utf-8"), _bcrypt_salt(rng, self.bcrypt_rounds)).decode("utf-8")
+            for n in range(self.password_pool)
+        ]
+
+    def users(self, first_id: int = 1) -> Iterator[tuple]:
+        """Riders (ids first_id ...) then drivers, as USER_COLUMNS tuples"""
+        rng = random.Random(f"{self.seed}:users")
+        hashes = self.password_hashes()
+        positions = self.driver_positions()
+        signup_start = self.until - timedelta(days=self.days + 365)
+
+        for n in range(self.riders + self.drivers):
+            user_id = first_id + n
+            is_driver = n >= self.riders
+            created_at = signup_start + timedelta(seconds=rng.uniform(0, 365 * 86400))
+            latitude = longitude = vehicle = rating = None
+            availability = True  # Model default for riders
+            if is_driver:
+                latitude, longitude, _ = positions[n - self.riders]
+                availability = rng.random() < self.online_fraction
+                vehicle = rng.choice(VEHICLES)
+                rating = round(min(5.0, max(3.0, rng.gauss(4.75, 0.2))), 2)
+
+            role = "driver" if is_driver else "rider"
+            yield (
+                user_id, f"{role}{user_id}", f"{role}{user_id}@example.com", hashes[user_id % self.password_pool],
+                is_driver, availability, created_at, latitude, longitude, vehicle, rating
+            )
+
+    def _rides_per_hour(self) -> List[int]:
+        """Exact ride count per hour slot of the history (largest remainder)"""
+        start = self.until - timedelta(days=self.days)
+        weights = [
+            WEEKDAY_DEMAND[(start + timedelta(hours=slot)).weekday()] * HOURLY_DEMAND[slot % 24]
+            for slot in range(self.days * 24)
+        ]
+        total = sum(weights)
+        exact = [self.rides * weight / total for weight in weights]
+        counts = [int(value) for value in exact]
+        by_remainder = sorted(range(len(exact)), key=lambda slot: exact[slot] - counts[slot], reverse=True)
+        for slot in by_remainder[:self.rides - sum(counts)]:
+            counts[slot] += 1
+        return counts
+
+    def ride_history(self, first_ride_id: int, first_rider_id: int, first_driver_id: int) -> Iterator[tuple]:
+        """Finished rides in created_at (and id) order, as RIDE_COLUMNS tuples"""
+        rng = random.Random(f"{self.seed}:rides")
+        driver_pools: List[List[int]] = [[] for _ in HOTSPOTS]
+        for n, (_, _, hotspot) in enumerate(self.driver_positions()):
+            driver_pools[hotspot].append(first_driver_id + n)
+        all_drivers = range(first_driver_id, first_driver_id + self.drivers)
+        hotspots = range(len(HOTSPOTS))
+        start = self.until - timedelta(days=self.days)
+        ride_id = first_ride_id
+
+        for slot, count in enumerate(self._rides_per_hour()):
+            hour = slot % 24
+            slot_start = start + timedelta(hours=slot)
+            rush_hour = HOURLY_DEMAND[hour] >= 2.0
+            offsets = sorted(rng.uniform(0, 3600) for _ in range(count))
+
+            for offset in offsets:
+                pickup = rng.choices(hotspots, cum_weights=self._pickup_weights[hour])[0]
+                dropoff = rng.choices(hotspots, cum_weights=self._dropoff_weights[hour])[0]
+                start_lat, start_lng = self._point_near(rng, pickup)
+                end_lat, end_lng = self._point_near(rng, dropoff)
+
+                rider_id = first_rider_id + int(self.riders * rng.random() ** 3)  # Heavy riders take most rides
+                pool = driver_pools[pickup] or all_drivers
+                driver_id = pool[int(rng.random() * len(pool))]
+
+                created_at = slot_start + timedelta(seconds=offset)
+                offered_at = created_at + timedelta(seconds=rng.uniform(1, 20))
+                offer_attempts = 1 + int(rng.random() ** 4 * 3)
+                cancelled = rng.random() < self.cancelled_fraction
+
+                if cancelled:
+                    assigned = rng.random() < 0.5
+                    yield (
+                        ride_id, rider_id, driver_id if assigned else None, HOTSPOTS[pickup][0], start_lat, start_lng,
+                        HOTSPOTS[dropoff][0], end_lat, end_lng, RideStatus.CANCELLED.value,
+                        driver_id if assigned else None, offered_at if assigned else None, offer_attempts,
+                        "rider_cancelled" if assigned else "no_drivers_available", created_at,
+                        None, created_at + timedelta(seconds=rng.uniform(30, 600)), None
+                    )
+                else:
+                    distance_km = self._distance_km(start_lat, start_lng, end_lat, end_lng) * 1.3  # Road detour
+                    speed_kmh = 18 if rush_hour else 30
+                    minutes = distance_km / speed_kmh * 60 + rng.uniform(3, 10)  # Plus pickup
+                    yield (
+                        ride_id, rider_id, driver_id, HOTSPOTS[pickup][0], start_lat, start_lng,
+                        HOTSPOTS[dropoff][0], end_lat, end_lng, RideStatus.COMPLETED.value,
+                        driver_id, offered_at, offer_attempts, None, created_at,
+                        created_at + timedelta(minutes=minutes), None,
+                        round(2.5 + 1.2 * distance_km + 0.3 * minutes, 2)
+                    )
+                ride_id += 1
+
+
+# ============================================
+# BULK LOAD
+# ============================================
+
+def _copy(dbapi_connection, table: str, columns: List[str], rows: Iterator[tuple], batch_size: int) -> int:
+    """COPY rows into table in CSV batches (unquoted empty field = NULL)"""
+    cursor = dbapi_connection.cursor()
+    statement = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    loaded = 0
+    while True:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        batch = 0
+        for row in rows:
+            writer.writerow(row)
+            batch += 1
+            if batch == batch_size:
+                break
+        if not batch:
+            return loaded
+        buffer.seek(0)
+        cursor.copy_expert(statement, buffer)
+        loaded += batch
+
+
+def _insert(connection, table, columns: List[str], rows: Iterator[tuple], batch_size: int) -> int:
+    loaded = 0
+    while True:
+        batch = []
+        for row in rows:
+            batch.append(dict(zip(columns, row)))
+            if len(batch) == batch_size:
+                break
+        if not batch:
+            return loaded
+        connection.execute(insert(table), batch)
+        loaded += len(batch)
+
+
+def load(city: SyntheticCity, engine: Engine = default_engine, batch_size: int = 50_000, log: Callable = print) -> dict:
+    """
+    Bulk-load the city after the existing rows; returns the id ranges used
+
+    Ids are assigned here (max id + 1 onward) so rides can reference users
+    without reading them back; sequences are moved past them on PostgreSQL.
+    """
+    with engine.connect() as connection:
+        first_user_id = (connection.scalar(select(func.max(User.id))) or 0) + 1
+        first_ride_id = (connection.scalar(select(func.max(Ride.id))) or 0) + 1
+    first_driver_id = first_user_id + city.riders
+    users = city.users(first_user_id)
+    rides = city.ride_history(first_ride_id, first_user_id, first_driver_id)
+
+    if engine.dialect.name == "postgresql":
+        raw = engine.raw_connection()
+        try:
+            log(f"🌱 COPY {city.riders + city.drivers:,} users...")
+            _copy(raw, "users", USER_COLUMNS, users, batch_size)
+            log(f"🌱 COPY {city.rides:,} rides...")
+            _copy(raw, "rides", RIDE_COLUMNS, rides, batch_size)
+            cursor = raw.cursor()
+            for table in ("users", "rides"):
+                cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))")
+            raw.commit()
+            for table in ("users", "rides"):
+                cursor.execute(f"ANALYZE {table}")
+            raw.commit()
+        except Exception:
+            raw.rollback()
+            raise
+        finally:
+            raw.close()
+    else:
+        with engine.begin() as connection:
+            log(f"🌱 Inserting {city.riders + city.drivers:,} users...")
+            _insert(connection, User.__table__, USER_COLUMNS, users, batch_size)
+            log(f"🌱 Inserting {city.rides:,} rides...")
+            _insert(connection, Ride.__table__, RIDE_COLUMNS, rides, batch_size)
+
+    return {
+        "riders": (first_user_id, first_driver_id - 1),
+        "drivers": (first_driver_id, first_driver_id + city.drivers - 1),
+        "rides": (first_ride_id, first_ride_id + city.rides - 1)
+    }
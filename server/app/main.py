@@ -1,14 +1,23 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse
 from sqlalchemy.orm import Session
-from typing import Dict
+from typing import Optional
 import logging
 
 import os
 
-from .db.database import engine, get_db
+from .db.database import engine, async_engine, get_db
 from .db.models import Base, Ride
-from .api import ping, users, rides, ride_requests, auth
+from .api import ping, users, rides, ride_requests, auth, metrics
+from .core.serialization import loads
+from .services.connection_manager import manager
+from .services import location_codec
+from .services.driver_liveness import driver_liveness
+from .services.matching_engine import matching_engine
+from .services.admission_control import AdmissionRejected, admission_controller
+from .services.password_hasher import PasswordHasherOverloaded, password_hasher
+from .services.query_profiler import QueryProfilerMiddleware, query_profiler
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -21,7 +30,8 @@ Base.metadata.create_all(bind=engine)
 app = FastAPI(
     title="Mini Uber API",
     description="A simplified Uber-like API built with FastAPI",
-    version="0.1.0"
+    version="0.1.0",
+    default_response_class=ORJSONResponse  # Handlers returning plain data still get orjson encoding
 )
 
 # Configure CORS
@@ -31,80 +41,53 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # Pagination cursor of GET /api/rides/
 )
 
+# Opt-in SQL profiling per route (QUERY_PROFILER_ENABLED=true, report at /api/metrics/queries)
+if query_profiler.ENABLED:
+    query_profiler.install()
+    app.add_middleware(QueryProfilerMiddleware)
+
+# Password hasher at its admission limit: shed the login instead of queueing it
+@app.exception_handler(PasswordHasherOverloaded)
+async def password_hasher_overloaded_handler(request: Request, exc: PasswordHasherOverloaded):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Too many password operations in progress, please retry"},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+# Ride request shed by admission control: 429 (zone over its rate) or 503 (overload)
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": "Too many ride requests right now, please retry", "reason": exc.reason},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 # Include routers
 app.include_router(ping.router, prefix="/api", tags=["system"])
+app.include_router(metrics.router, prefix="/api/metrics", tags=["system"])
 app.include_router(auth.router, prefix="/api/auth", tags=["authentication"])
 app.include_router(users.router, prefix="/api/users", tags=["users"])
 app.include_router(rides.router, prefix="/api/rides", tags=["rides"])
 app.include_router(ride_requests.router, prefix="/api/ride", tags=["ride-requests"])
 
 
-# -----------------------------
-# WebSocket manager for ride sessions and notifications
-# -----------------------------
-class ConnectionManager:
-    def __init__(self):
-        # Ride-specific connections (old system)
-        self.active_connections: Dict[int, Dict[str, WebSocket]] = {}
-        
-        # User-specific connections for push notifications (new system)
-        self.user_connections: Dict[int, WebSocket] = {}
-
-    async def connect(self, ride_id: int, user_type: str, websocket: WebSocket):
-        """Connect for ride location sharing (old system)"""
-        await websocket.accept()
-        if ride_id not in self.active_connections:
-            self.active_connections[ride_id] = {}
-        self.active_connections[ride_id][user_type] = websocket
-
-    def disconnect(self, ride_id: int, user_type: str):
-        """Disconnect ride location sharing"""
-        if ride_id in self.active_connections:
-            self.active_connections[ride_id].pop(user_type, None)
-            if not self.active_connections[ride_id]:
-                self.active_connections.pop(ride_id)
-
-    async def send_location(self, ride_id: int, user_type: str, data: dict):
-        """Send location update to other party in ride"""
-        other_type = "driver" if user_type == "rider" else "rider"
-        if ride_id in self.active_connections and other_type in self.active_connections[ride_id]:
-            await self.active_connections[ride_id][other_type].send_json(data)
-    
-    # New methods for user-specific notifications
-    async def connect_user(self, user_id: int, websocket: WebSocket):
-        """Connect a user for receiving notifications"""
-        await websocket.accept()
-        self.user_connections[user_id] = websocket
-        logger.info(f"✅ User #{user_id} connected to notification system")
-    
-    def disconnect_user(self, user_id: int):
-        """Disconnect user from notifications"""
-        self.user_connections.pop(user_id, None)
-        logger.info(f"❌ User #{user_id} disconnected from notification system")
-    
-    async def send_to_user(self, user_id: int, data: dict):
-        """Send notification to specific user"""
-        if user_id in self.user_connections:
-            try:
-                await self.user_connections[user_id].send_json(data)
-                logger.info(f"📤 Sent notification to user #{user_id}: {data.get('type')}")
-            except Exception as e:
-                logger.error(f"❌ Failed to send to user #{user_id}: {e}")
-                self.disconnect_user(user_id)
-
-
-manager = ConnectionManager()
-
-
 # -----------------------------
 # Startup and shutdown events
 # -----------------------------
 @app.on_event("startup")
 async def startup_event():
     """Initialize background services"""
-    from .services.matching_engine import matching_engine
+    from .services.location_buffer import location_buffer
+    from .services.notification_outbox import notification_outbox
+    from .services.trail_store import trail_store
+    from .services.ride_archiver import ride_archiver
+    from .services.profile_cache import profile_cache
+    from .services.session_tokens import session_tokens
     
     # Connect matching engine to WebSocket manager
     matching_engine.set_websocket_manager(manager)
@@ -113,14 +96,52 @@ async def startup_event():
     import asyncio
     asyncio.create_task(matching_engine.start())
     
+    # Start batched write-back of driver locations
+    asyncio.create_task(location_buffer.start())
+    
+    # Start notification outbox maintenance (and persisted log, if enabled)
+    asyncio.create_task(notification_outbox.start())
+    
+    # Start background writes of per-ride GPS trails
+    asyncio.create_task(trail_store.start())
+    
+    # Start moving finished rides to the archive
+    asyncio.create_task(ride_archiver.start())
+    
+    # Listen for profile invalidations from other workers
+    asyncio.create_task(profile_cache.start())
+    
+    # Load revoked session tokens and listen for new revocations
+    asyncio.create_task(session_tokens.start())
+    
+    # Sample matcher backlog and event-loop lag for ride request admission
+    asyncio.create_task(admission_controller.start())
+    
+    # Spawn the bcrypt worker processes before the first login
+    await password_hasher.start()
+    
     logger.info("🚀 Application started - Matching engine running")
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Clean shutdown"""
-    from .services.matching_engine import matching_engine
+    from .services.location_buffer import location_buffer
+    from .services.notification_outbox import notification_outbox
+    from .services.trail_store import trail_store
+    from .services.ride_archiver import ride_archiver
+    from .services.profile_cache import profile_cache
+    from .services.session_tokens import session_tokens
     await matching_engine.stop()
+    await location_buffer.stop()
+    await notification_outbox.stop()
+    await trail_store.stop()
+    await ride_archiver.stop()
+    await profile_cache.stop()
+    await session_tokens.stop()
+    await admission_controller.stop()
+    await password_hasher.stop()
+    await async_engine.dispose()
     logger.info("🛑 Application stopped")
 
 
@@ -128,32 +149,74 @@ async def shutdown_event():
 # WebSocket endpoints
 # -----------------------------
 @app.websocket("/ws/ride/{ride_id}/{user_type}")
-async def ride_location_ws(websocket: WebSocket, ride_id: int, user_type: str):
-    """WebSocket for real-time location sharing during ride"""
-    await manager.connect(ride_id, user_type, websocket)
+async def ride_location_ws(websocket: WebSocket, ride_id: int, user_type: str, encoding: str = location_codec.ENCODING_JSON):
+    """
+    WebSocket for real-time location sharing during ride
+
+    Clients connecting with ?encoding=binary exchange 12-byte location frames
+    (see services/location_codec.py); everyone else keeps using JSON text.
+    Each message is decoded once (to recognise location updates for the trail
+    and the relay shaper) and forwarded as received unless the two parties use
+    different encodings.
+    """
+    if encoding not in location_codec.ENCODINGS:
+        encoding = location_codec.ENCODING_JSON
+
+    connection = await manager.connect(ride_id, user_type, websocket, encoding)
     try:
         while True:
-            data = await websocket.receive_json()
-            await manager.send_location(ride_id, user_type, data)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+
+            if message.get("bytes") is not None:
+                if not location_codec.is_valid_frame(message["bytes"]):
+                    continue
+                await manager.send_location(ride_id, user_type, message["bytes"])
+            elif message.get("text") is not None:
+                await manager.send_location(ride_id, user_type, message["text"])
     except WebSocketDisconnect:
-        manager.disconnect(ride_id, user_type)
+        pass
+    finally:
+        manager.disconnect(ride_id, user_type, connection)
 
 
 @app.websocket("/ws/notifications/{user_id}")
-async def user_notifications_ws(websocket: WebSocket, user_id: int):
-    """WebSocket for push notifications (ride offers, assignments, etc.)"""
-    await manager.connect_user(user_id, websocket)
+async def user_notifications_ws(
+    websocket: WebSocket,
+    user_id: int,
+    device_id: Optional[str] = None,
+    last_seq: Optional[int] = None
+):
+    """
+    WebSocket for push notifications (ride offers, assignments, etc.)
+    
+    Each device should pass a stable ?device_id= so a reconnect replaces its own
+    previous socket; notifications are fanned out to all of the user's devices.
+    Every notification carries a "seq"; reconnect with ?last_seq= to receive
+    only the ones missed while disconnected.
+    """
+    connection = await manager.connect_user(user_id, websocket, device_id, last_seq)
+    driver_liveness.touch(user_id)
     try:
         while True:
             # Keep connection alive, client can also send heartbeats
-            data = await websocket.receive_json()
+            data = loads(await websocket.receive_text())
+            
+            # Any client message proves the app is alive (feeds the matcher's candidate set)
+            driver_liveness.touch(user_id)
             
             # Handle any client messages if needed
             if data.get("type") == "heartbeat":
-                await websocket.send_json({"type": "heartbeat_ack"})
+                connection.put({"type": "heartbeat_ack"})
                 
     except WebSocketDisconnect:
-        manager.disconnect_user(user_id)
+        pass
+    finally:
+        manager.disconnect_user(user_id, connection)
+        if not manager.is_connected(user_id):
+            driver_liveness.remove(user_id)
+            await matching_engine.handle_driver_disconnected(user_id)
 
 
 # -----------------------------
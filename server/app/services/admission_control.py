@@ -0,0 +1,239 @@
+"""
+Admission Control
+Sheds ride requests the system cannot serve in time, per pickup zone and on overload signals
+"""
+
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select
+
+from ..db.database import DB_MAX_OVERFLOW, DB_POOL_SIZE, AsyncSessionLocal, engine
+from ..db.models import Ride
+from .matching_engine import matching_engine
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+Zone = Tuple[int, int]  # Grid cell of the pickup point
+
+
+class AdmissionRejected(Exception):
+    """Ride request shed by the admission controller (429 for a zone over its rate, 503 for overload)"""
+
+    def __init__(self, reason: str, status_code: int, retry_after: int):
+        super().__init__(f"Ride request rejected ({reason}), retry in {retry_after}s")
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Gate in front of ride creation (POST /api/ride/request, POST /api/rides/)
+
+    Checked in this order, once the request has passed its own validation
+    (so a rejected duplicate or malformed request never takes a token) and
+    before it writes anything:
+
+    1. Overload (503) - the whole system is behind, whoever is asking:
+       - matcher backlog: rides in 'requested' >= MAX_BACKLOG (sampled every
+         SAMPLE_INTERVAL_SECONDS; the stale-ride cleanup would cancel the
+         excess unserved anyway)
+       - DB pool: connections checked out >= POOL_SATURATION of the pool
+       - event-loop lag: the loop woke up more than MAX_LOOP_LAG_MS late
+         within the last second
+    2. Zone rate (429) - a token bucket per pickup grid cell of ZONE_SIZE_DEGREES
+       (~1 km), refilled at ZONE_RATE_PER_SECOND up to ZONE_BURST, so one
+       crowded venue cannot take every slot. Requests without pickup
+       coordinates (POST /api/rides/) have no zone and only face step 1.
+
+    Rejections carry a Retry-After: time until the zone has a token, or an
+    estimate of how long the backlog / overload takes to clear. Everything is
+    per worker process, like the matcher's own state.
+    """
+
+    ENABLED = os.getenv("ADMISSION_CONTROL_ENABLED", "true").lower() == "true"
+    MAX_BACKLOG = int(os.getenv("ADMISSION_MAX_BACKLOG", "500"))
+    POOL_SATURATION = float(os.getenv("ADMISSION_POOL_SATURATION", "0.9"))
+    MAX_LOOP_LAG_MS = float(os.getenv("ADMISSION_MAX_LOOP_LAG_MS", "250"))
+    ZONE_SIZE_DEGREES = float(os.getenv("ADMISSION_ZONE_SIZE_DEGREES", "0.01"))
+    ZONE_RATE_PER_SECOND = float(os.getenv("ADMISSION_ZONE_RATE_PER_SECOND", "2"))
+    ZONE_BURST = float(os.getenv("ADMISSION_ZONE_BURST", "30"))
+    SAMPLE_INTERVAL_SECONDS = 1.0
+    LAG_TICK_SECONDS = 0.1
+    MAX_RETRY_AFTER_SECONDS = 60
+    BACKLOG_STALE_SECONDS = 10  # Older backlog samples are ignored rather than trusted
+
+    def __init__(self):
+        self.running = False
+        self.stats = Counter()
+        self.backlog: Optional[int] = None  # Rides in 'requested' at the last sample
+        self.drain_per_second = 0.0  # Rides leaving 'requested' for good per second, this worker (moving average)
+        self._backlog_sampled_at = 0.0
+        self._loop_lag_ms = deque(maxlen=int(1 / self.LAG_TICK_SECONDS))  # Last second of wake-up delays
+        self._buckets: Dict[Zone, List[float]] = {}  # zone -> [tokens, monotonic time of last refill]
+        self._lock = threading.Lock()  # admit() runs in the sync endpoint threadpool
+
+    def zone_of(self, latitude: Optional[float], longitude: Optional[float]) -> Optional[Zone]:
+        if latitude is None or longitude is None or not (-90 <= latitude <= 90) or not (-180 <= longitude <= 180):
+            return None
+        return math.floor(latitude / self.ZONE_SIZE_DEGREES), math.floor(longitude / self.ZONE_SIZE_DEGREES)
+
+    # ============================================
+    # ADMISSION
+    # ============================================
+
+    def admit(self, latitude: Optional[float] = None, longitude: Optional[float] = None):
+        """Take a slot for a new ride at this pickup point, or raise AdmissionRejected"""
+        if not self.ENABLED:
+            return
+
+        overload = self._overload()
+        if overload:
+            reason, retry_after = overload
+            self.stats[reason] += 1
+            raise AdmissionRejected(reason, 503, retry_after)
+
+        zone = self.zone_of(latitude, longitude)
+        if zone is None:
+            self.stats["admitted"] += 1
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(zone)
+            if bucket is None:
+                bucket = self._buckets[zone] = [self.ZONE_BURST, now]
+            tokens = min(self.ZONE_BURST, bucket[0] + (now - bucket[1]) * self.ZONE_RATE_PER_SECOND)
+            bucket[1] = now
+            if tokens < 1:
+                bucket[0] = tokens
+                self.stats["zone_rate"] += 1
+                raise AdmissionRejected("zone_rate", 429, self._clamp((1 - tokens) / self.ZONE_RATE_PER_SECOND))
+            bucket[0] = tokens - 1
+
+        self.stats["admitted"] += 1
+
+    def _overload(self) -> Optional[Tuple[str, int]]:
+        """(reason, retry_after) if the system as a whole cannot take more rides now"""
+        backlog = self.backlog
+        fresh = time.monotonic() - self._backlog_sampled_at < self.BACKLOG_STALE_SECONDS
+        if fresh and backlog is not None and backlog >= self.MAX_BACKLOG:
+            excess = backlog - self.MAX_BACKLOG + 1
+            drain = self.drain_per_second
+            return "backlog", (self._clamp(excess / drain) if drain > 0 else self.MAX_RETRY_AFTER_SECONDS)
+
+        checked_out = self._pool_checked_out()
+        if checked_out is not None and checked_out >= (DB_POOL_SIZE + DB_MAX_OVERFLOW) * self.POOL_SATURATION:
+            return "db_pool", 1
+
+        loop_lag_ms = max(self._loop_lag_ms, default=0.0)
+        if loop_lag_ms > self.MAX_LOOP_LAG_MS:
+            return "loop_lag", self._clamp(loop_lag_ms / 1000)
+
+        return None
+
+    @staticmethod
+    def _pool_checked_out() -> Optional[int]:
+        """Connections in use on the sync engine (None for pools that do not count them, e.g. SQLite's)"""
+        checkedout = getattr(engine.pool, "checkedout", None)
+        if checkedout is None or engine.dialect.name == "sqlite":
+            return None
+        return checkedout()
+
+    def _clamp(self, seconds: float) -> int:
+        return min(self.MAX_RETRY_AFTER_SECONDS, max(1, math.ceil(seconds)))
+
+    # ============================================
+    # SIGNAL SAMPLER
+    # ============================================
+
+    async def start(self):
+        """Measure event-loop lag every tick and sample the matcher backlog every interval until stopped"""
+        if not self.ENABLED:
+            return
+
+        self.running = True
+        logger.info(f"🚦 Admission control started (backlog {self.MAX_BACKLOG}, "
+                    f"{self.ZONE_RATE_PER_SECOND:g}/s per zone, burst {self.ZONE_BURST:g})")
+        loop = asyncio.get_running_loop()
+        next_sample = loop.time()
+        # Accepted, or cancelled unserved: re-offers after a decline or timeout put the
+        # ride back in 'requested', so offers_created would overstate the drain
+        dequeued = matching_engine.stats["rides_dequeued"]
+
+        while self.running:
+            expected = loop.time() + self.LAG_TICK_SECONDS
+            await asyncio.sleep(self.LAG_TICK_SECONDS)
+            self._loop_lag_ms.append(max(0.0, loop.time() - expected) * 1000)
+
+            if loop.time() < next_sample:
+                continue
+            next_sample = loop.time() + self.SAMPLE_INTERVAL_SECONDS
+
+            try:
+                await self._sample_backlog()
+            except Exception as e:
+                logger.error(f"❌ Error sampling ride backlog: {e}")
+
+            total = matching_engine.stats["rides_dequeued"]
+            self.drain_per_second = 0.8 * self.drain_per_second + 0.2 * (total - dequeued) / self.SAMPLE_INTERVAL_SECONDS
+            dequeued = total
+            self._evict_idle_buckets()
+
+    async def stop(self):
+        self.running = False
+
+    async def _sample_backlog(self):
+        db = AsyncSessionLocal()
+        try:
+            self.backlog = (await db.execute(
+                select(func.count()).select_from(Ride).filter(Ride.status == "requested")
+            )).scalar()
+            self._backlog_sampled_at = time.monotonic()
+        finally:
+            await db.close()
+
+    def _evict_idle_buckets(self):
+        """Forget zones whose bucket has refilled - they behave exactly like a new one"""
+        now = time.monotonic()
+        with self._lock:
+            idle = [
+                zone for zone, (tokens, refilled_at) in self._buckets.items()
+                if tokens + (now - refilled_at) * self.ZONE_RATE_PER_SECOND >= self.ZONE_BURST
+            ]
+            for zone in idle:
+                del self._buckets[zone]
+
+    # ============================================
+    # METRICS
+    # ============================================
+
+    def get_stats(self) -> dict:
+        """Admission counters by outcome and the current overload signals"""
+        return {
+            "enabled": self.ENABLED,
+            "admitted": self.stats["admitted"],
+            "rejected": {
+                reason: self.stats[reason] for reason in ("zone_rate", "backlog", "db_pool", "loop_lag")
+            },
+            "backlog": self.backlog,
+            "max_backlog": self.MAX_BACKLOG,
+            "drain_per_second": round(self.drain_per_second, 2),
+            "db_pool_checked_out": self._pool_checked_out(),
+            "db_pool_capacity": DB_POOL_SIZE + DB_MAX_OVERFLOW,
+            "loop_lag_ms": round(max(self._loop_lag_ms, default=0.0), 1),
+            "active_zones": len(self._buckets)
+        }
+
+
+# Global admission controller instance
+admission_controller = AdmissionController()
@@ -0,0 +1,381 @@
+"""
+WebSocket Connection Manager
+Tracks ride location and notification sockets, each with its own outbound queue
+"""
+
+import asyncio
+import logging
+import uuid
+from collections import Counter, deque
+from typing import Any, Callable, Dict, Optional, Union
+
+from fastapi import WebSocket
+
+from ..core.serialization import dumps
+from . import location_codec
+from .relay_shaping import LocationShaper
+from .notification_outbox import notification_outbox
+from .trail_store import trail_store
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class OutboundQueue:
+    """
+    Bounded outbound queue for a single WebSocket, drained by its own writer task
+
+    Producers only append to the queue, so a slow or half-dead client can never
+    stall the caller (matching loop, expiry worker, location relay).
+
+    Overflow policy:
+    - Droppable frames (location updates) are discarded oldest-first when the queue is full,
+      or replace the newest pending droppable frame when coalescing (latest wins)
+    - Non-droppable messages (offers, assignments, ...) are never dropped; if there is no
+      room for one, the consumer is considered slow and the socket is closed
+    - A single send that takes longer than SEND_TIMEOUT_SECONDS also closes the socket
+    """
+
+    __slots__ = ("websocket", "label", "device_id", "encoding", "stats", "_queue", "_wakeup", "_closed", "_on_close", "_task")
+
+    MAX_QUEUE_SIZE = 64  # Pending messages per socket
+    SEND_TIMEOUT_SECONDS = 5  # Max time a single network write may take
+    CLOSE_TIMEOUT_SECONDS = 1  # Max time spent sending the close frame
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        label: str,
+        on_close: Optional[Callable[["OutboundQueue"], None]] = None,
+        encoding: str = location_codec.ENCODING_JSON,
+        stats: Optional[Counter] = None,
+        device_id: Optional[str] = None
+    ):
+        self.websocket = websocket
+        self.label = label
+        self.device_id = device_id  # Notification sockets only
+        self.encoding = encoding  # Wire format negotiated by the client (ride channel only)
+        self.stats = stats if stats is not None else Counter()  # dropped_overflow / coalesced
+        self._queue: deque = deque()  # (payload, droppable)
+        self._wakeup = asyncio.Event()
+        self._closed = False
+        self._on_close = on_close
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def start(self):
+        """Start the writer task"""
+        self._task = asyncio.create_task(self._writer())
+
+    def put(self, data: Any, droppable: bool = False, coalesce: bool = False) -> bool:
+        """
+        Enqueue a message without waiting for the network
+
+        Returns False if the message was not queued (socket closed, frame dropped,
+        or slow consumer disconnected)
+        """
+        if self._closed:
+            return False
+
+        if droppable and coalesce and self._replace_pending(data):
+            return True
+
+        if len(self._queue) >= self.MAX_QUEUE_SIZE and not self._drop_stale():
+            if droppable:
+                # Queue is full of messages we must not lose - drop the new frame instead
+                self.stats["dropped_overflow"] += 1
+                return False
+
+            logger.warning(f"🐌 Slow consumer on {self.label} ({len(self._queue)} pending) - disconnecting")
+            self.close()
+            return False
+
+        self._queue.append((data, droppable))
+        self._wakeup.set()
+        return True
+
+    def close(self):
+        """Stop the writer and close the socket (idempotent, never blocks)"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.clear()
+        self._wakeup.set()
+
+        if self._on_close:
+            self._on_close(self)
+
+        # Writer was never started (or already finished) - close the socket ourselves
+        if self._task is None or self._task.done():
+            asyncio.create_task(self._close_socket())
+
+    def _drop_stale(self) -> bool:
+        """Discard the oldest droppable frame to make room; False if there is none"""
+        for index, (_, droppable) in enumerate(self._queue):
+            if droppable:
+                del self._queue[index]
+                self.stats["dropped_overflow"] += 1
+                return True
+        return False
+
+    def _replace_pending(self, data: Any) -> bool:
+        """Overwrite the newest frame the consumer has not received yet; False if there is none"""
+        for index in range(len(self._queue) - 1, -1, -1):
+            if self._queue[index][1]:
+                self._queue[index] = (data, True)
+                self.stats["coalesced"] += 1
+                return True
+        return False
+
+    async def _writer(self):
+        """Drain the queue one message at a time"""
+        try:
+            while not self._closed:
+                if not self._queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+
+                data, _ = self._queue.popleft()
+                await asyncio.wait_for(self._send(data), self.SEND_TIMEOUT_SECONDS)
+
+        except asyncio.TimeoutError:
+            logger.warning(f"🐌 Send to {self.label} exceeded {self.SEND_TIMEOUT_SECONDS}s - disconnecting slow consumer")
+        except Exception as e:
+            logger.error(f"❌ Writer for {self.label} failed: {e}")
+        finally:
+            self.close()
+            await self._close_socket()
+
+    async def _send(self, data: Any):
+        if isinstance(data, (bytes, bytearray)):
+            await self.websocket.send_bytes(data)
+        elif isinstance(data, str):
+            await self.websocket.send_text(data)
+        else:
+            await self.websocket.send_text(dumps(data))
+
+    async def _close_socket(self):
+        try:
+            await asyncio.wait_for(self.websocket.close(code=1013), self.CLOSE_TIMEOUT_SECONDS)
+        except Exception:
+            pass  # Socket already gone
+
+
+class ConnectionManager:
+    """
+    WebSocket manager for ride sessions and notifications
+
+    Every accepted socket gets an OutboundQueue; all send methods only enqueue.
+    """
+
+    def __init__(self):
+        # Ride-specific connections (old system)
+        self.active_connections: Dict[int, Dict[str, OutboundQueue]] = {}
+        self.ride_epochs: Dict[int, int] = {}  # ride_id -> channel epoch (ms) for binary frame timestamps
+        self.relay_shapers: Dict[int, Dict[str, LocationShaper]] = {}  # ride_id -> sender type -> shaper
+        self.relay_stats: Counter = Counter()  # Totals across all ride channels
+
+        # User-specific connections for push notifications (new system)
+        # A user may be connected from several devices at once (phone + dashboard tablet)
+        self.user_connections: Dict[int, Dict[str, OutboundQueue]] = {}  # user_id -> device_id -> queue
+        self.notification_stats: Counter = Counter()
+        self.outbox = notification_outbox  # Sequence numbers + replay for reconnecting clients
+
+    async def connect(
+        self,
+        ride_id: int,
+        user_type: str,
+        websocket: WebSocket,
+        encoding: str = location_codec.ENCODING_JSON
+    ) -> OutboundQueue:
+        """Connect for ride location sharing (old system)"""
+        await websocket.accept()
+        connection = OutboundQueue(
+            websocket,
+            f"ride #{ride_id} ({user_type})",
+            on_close=lambda queue: self._remove_ride_connection(ride_id, user_type, queue),
+            encoding=encoding,
+            stats=self.relay_stats
+        )
+
+        previous = self.active_connections.setdefault(ride_id, {}).get(user_type)
+        self.active_connections[ride_id][user_type] = connection
+        if previous:
+            previous.close()
+
+        self.relay_shapers.setdefault(ride_id, {})[user_type] = LocationShaper(self.relay_stats)
+        epoch_ms = self.ride_epochs.setdefault(ride_id, location_codec.now_ms())
+        if encoding == location_codec.ENCODING_BINARY:
+            connection.put(location_codec.session_message(epoch_ms))
+
+        connection.start()
+        return connection
+
+    def disconnect(self, ride_id: int, user_type: str, connection: Optional[OutboundQueue] = None):
+        """Disconnect ride location sharing"""
+        current = self.active_connections.get(ride_id, {}).get(user_type)
+        if current and (connection is None or current is connection):
+            current.close()
+
+    def _remove_ride_connection(self, ride_id: int, user_type: str, connection: OutboundQueue):
+        connections = self.active_connections.get(ride_id)
+        if connections and connections.get(user_type) is connection:
+            connections.pop(user_type)
+            if not connections:
+                self.active_connections.pop(ride_id)
+                self.ride_epochs.pop(ride_id, None)
+                self.relay_shapers.pop(ride_id, None)
+
+    async def send_location(self, ride_id: int, user_type: str, data: Union[bytes, str]):
+        """
+        Send location update to other party in ride
+
+        data is either a binary frame or the raw text received from the sender,
+        decoded exactly once here. Location updates are appended to the ride's
+        GPS trail when sent by the driver (in memory only - the trail store
+        writes in the background), pass the sender's LocationShaper, and are
+        forwarded untouched when the receiver uses the same encoding and
+        transcoded otherwise; only they may be coalesced or dropped on overflow.
+        Any other message is relayed as is and never dropped.
+        """
+        epoch_ms = self.ride_epochs.get(ride_id, 0)
+        location = location_codec.parse_location(data, epoch_ms)
+        if location and user_type == "driver":
+            trail_store.append(ride_id, *location)
+
+        other_type = "driver" if user_type == "rider" else "rider"
+        connection = self.active_connections.get(ride_id, {}).get(other_type)
+        if not connection:
+            return
+
+        if location is None:
+            connection.put(data)
+            return
+
+        latitude, longitude, ts_ms = location
+        shaper = self.relay_shapers.get(ride_id, {}).get(user_type)
+        if shaper and not shaper.admit(latitude, longitude):
+            return
+
+        if isinstance(data, bytes):
+            if connection.encoding != location_codec.ENCODING_BINARY:
+                data = location_codec.location_to_json(latitude, longitude, ts_ms)
+        elif connection.encoding == location_codec.ENCODING_BINARY:
+            data = location_codec.encode_location(latitude, longitude, ts_ms - epoch_ms)
+
+        connection.put(data, droppable=True, coalesce=LocationShaper.COALESCE)
+
+    def get_relay_stats(self) -> dict:
+        """Relay counters for the metrics endpoint"""
+        return {
+            "active_rides": len(self.active_connections),
+            "received": self.relay_stats["received"],
+            "forwarded": self.relay_stats["forwarded"],
+            "dropped_interval": self.relay_stats["dropped_interval"],
+            "dropped_stationary": self.relay_stats["dropped_stationary"],
+            "coalesced": self.relay_stats["coalesced"],
+            "dropped_overflow": self.relay_stats["dropped_overflow"]
+        }
+
+    # New methods for user-specific notifications
+    async def connect_user(
+        self,
+        user_id: int,
+        websocket: WebSocket,
+        device_id: Optional[str] = None,
+        last_seq: Optional[int] = None
+    ) -> OutboundQueue:
+        """
+        Connect one of a user's devices for receiving notifications
+
+        Reconnecting with the same device_id replaces (and closes) that device's
+        previous socket; other devices stay connected. A client that passes the
+        last seq it received first gets every notification it missed since then
+        (or a single 'resync' message if they are no longer available).
+        """
+        await websocket.accept()
+
+        persisted = None
+        if last_seq is not None and self.outbox.needs_persisted(user_id, last_seq):
+            persisted = await self.outbox.load_persisted(user_id, last_seq)
+
+        device_id = device_id or uuid.uuid4().hex[:12]
+        connection = OutboundQueue(
+            websocket,
+            f"user #{user_id} ({device_id})",
+            on_close=lambda queue: self._remove_user_connection(user_id, queue),
+            stats=self.notification_stats,
+            device_id=device_id
+        )
+
+        devices = self.user_connections.setdefault(user_id, {})
+        previous = devices.get(device_id)
+        devices[device_id] = connection
+        if previous:
+            previous.close()
+
+        # Replay before any live message can be queued (no await in between)
+        if last_seq is not None:
+            for payload in self.outbox.replay(user_id, last_seq, persisted):
+                connection.put(payload)
+
+        connection.start()
+        logger.info(f"✅ User #{user_id} connected to notification system (device {device_id}, {len(devices)} total)")
+        return connection
+
+    def disconnect_user(self, user_id: int, connection: Optional[OutboundQueue] = None):
+        """Disconnect one device (or every device when no connection is given) from notifications"""
+        devices = self.user_connections.get(user_id, {})
+        for current in list(devices.values()):
+            if connection is None or current is connection:
+                current.close()
+
+    def _remove_user_connection(self, user_id: int, connection: OutboundQueue):
+        devices = self.user_connections.get(user_id)
+        if devices and devices.get(connection.device_id) is connection:
+            devices.pop(connection.device_id)
+            if not devices:
+                self.user_connections.pop(user_id)
+            logger.info(f"❌ User #{user_id} disconnected from notification system (device {connection.device_id})")
+
+    def is_connected(self, user_id: int) -> bool:
+        """True if at least one of the user's devices is connected"""
+        return user_id in self.user_connections
+
+    async def send_to_user(self, user_id: int, data: dict, replay_ttl: Optional[float] = None) -> int:
+        """
+        Queue a notification for every connected device of a user
+
+        The message gets a sequence number and is kept in the outbox even if the
+        user is offline, so a reconnecting client can catch up (replay_ttl limits
+        how long it is worth replaying). It is serialized once and handed to each
+        device's writer task, so the fan-out is concurrent and returns immediately.
+        Devices that cannot take it are disconnected by their queue.
+
+        Returns the number of devices the message was queued for
+        """
+        payload = self.outbox.record(user_id, data, replay_ttl)
+
+        devices = self.user_connections.get(user_id)
+        if not devices:
+            return 0
+
+        delivered = 0
+        for connection in list(devices.values()):
+            if connection.put(payload):
+                delivered += 1
+
+        if delivered:
+            logger.info(f"📤 Queued notification for user #{user_id} on {delivered} device(s): {data.get('type')}")
+        else:
+            logger.error(f"❌ Failed to queue notification for user #{user_id}: {data.get('type')}")
+        return delivered
+
+
+# Global connection manager instance
+manager = ConnectionManager()
@@ -0,0 +1,55 @@
+"""
+Driver Liveness Tracker
+Heartbeat-driven presence for the notification channel, kept in memory only
+"""
+
+import os
+import time
+from typing import Dict, Optional, Set
+
+
+class LivenessTracker:
+    """
+    Last-seen timestamps fed by /ws/notifications/{user_id}
+
+    A user is live while at least one of their sockets is connected and a
+    heartbeat (or any other message) arrived within HEARTBEAT_TIMEOUT_SECONDS.
+    Users drop out as soon as their last socket disconnects and rejoin when
+    they reconnect. Nothing is written to the database.
+    """
+
+    ENABLED = os.getenv("REQUIRE_DRIVER_HEARTBEAT", "true").lower() == "true"
+    HEARTBEAT_TIMEOUT_SECONDS = float(os.getenv("DRIVER_HEARTBEAT_TIMEOUT_SECONDS", "25"))
+
+    def __init__(self):
+        self._last_seen: Dict[int, float] = {}  # user_id -> monotonic time of last heartbeat
+
+    def touch(self, user_id: int):
+        """Record a heartbeat (or connect) from the user"""
+        self._last_seen[user_id] = time.monotonic()
+
+    def remove(self, user_id: int):
+        """User's last socket disconnected"""
+        self._last_seen.pop(user_id, None)
+
+    def is_live(self, user_id: int) -> bool:
+        if not self.ENABLED:
+            return True
+        last_seen = self._last_seen.get(user_id)
+        return last_seen is not None and time.monotonic() - last_seen <= self.HEARTBEAT_TIMEOUT_SECONDS
+
+    def live_ids(self) -> Optional[Set[int]]:
+        """Users live right now; None when heartbeats are not required (everyone counts as live)"""
+        if not self.ENABLED:
+            return None
+        cutoff = time.monotonic() - self.HEARTBEAT_TIMEOUT_SECONDS
+        return {user_id for user_id, last_seen in self._last_seen.items() if last_seen >= cutoff}
+
+    @property
+    def live_count(self) -> int:
+        cutoff = time.monotonic() - self.HEARTBEAT_TIMEOUT_SECONDS
+        return sum(1 for last_seen in self._last_seen.values() if last_seen >= cutoff)
+
+
+# Global liveness tracker instance
+driver_liveness = LivenessTracker()
@@ -0,0 +1,184 @@
+"""
+Location Write-Behind Buffer
+Coalesces GPS pings in memory and flushes them to users.latitude/longitude in batches
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+from ..db.database import SessionLocal
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+Position = Tuple[float, float]
+
+
+class LocationBuffer:
+    """
+    Latest-position table shared by the location endpoint and the matcher
+
+    Every update is visible immediately through get(); only the most recent
+    position per user is written back to Postgres, once per flush interval,
+    with one multi-row UPDATE ... FROM (VALUES ...) statement per batch.
+
+    Each position keeps the time it was taken so relayed batches that arrive
+    out of order (update_many) cannot replace a newer position with an older one.
+
+    Positions relayed by fleet gateways (update_many(drivers_only=True)) carry
+    ids the gateway vouches for, not an authenticated user: they are only
+    written to rows of drivers, and like unknown ids, anything else is dropped
+    from memory at the next flush.
+    """
+
+    FLUSH_INTERVAL_SECONDS = float(os.getenv("LOCATION_FLUSH_INTERVAL_SECONDS", "2"))
+    MAX_BATCH_SIZE = 1000  # Rows per UPDATE statement
+
+    def __init__(self):
+        self.running = False
+        self._positions: Dict[int, Position] = {}  # user_id -> latest (lat, lng)
+        self._dirty: Dict[int, Position] = {}  # Positions not yet written to the database
+        self._timestamps: Dict[int, int] = {}  # user_id -> when the latest position was taken (ms)
+        self._drivers_only: Set[int] = set()  # Dirty ids whose latest position came from a gateway batch
+        self._lock = threading.Lock()  # Updates arrive from the sync endpoint threadpool
+
+    def update(self, user_id: int, latitude: float, longitude: float):
+        """Record a user's latest position (no database access)"""
+        position = (latitude, longitude)
+        with self._lock:
+            self._positions[user_id] = position
+            self._dirty[user_id] = position
+            self._timestamps[user_id] = int(time.time() * 1000)
+            self._drivers_only.discard(user_id)
+
+    def update_many(self, rows: Iterable[Tuple[int, float, float, int]], drivers_only: bool = False) -> int:
+        """
+        Record (user_id, latitude, longitude, timestamp_ms) rows under one lock
+
+        Rows older than the position already held for the user are skipped;
+        returns the number applied. With drivers_only the flush only writes
+        them to driver rows.
+        """
+        applied = 0
+        with self._lock:
+            positions, dirty, timestamps = self._positions, self._dirty, self._timestamps
+            mark = self._drivers_only.add if drivers_only else self._drivers_only.discard
+            for user_id, latitude, longitude, timestamp in rows:
+                if timestamps.get(user_id, 0) > timestamp:
+                    continue
+                position = (latitude, longitude)
+                positions[user_id] = position
+                dirty[user_id] = position
+                timestamps[user_id] = timestamp
+                mark(user_id)
+                applied += 1
+        return applied
+
+    def get(self, user_id: int) -> Optional[Position]:
+        """Latest known position, or None if the user has not pinged since startup"""
+        return self._positions.get(user_id)
+
+    @property
+    def pending(self) -> int:
+        return len(self._dirty)
+
+    # ============================================
+    # FLUSH WORKER
+    # ============================================
+
+    async def start(self):
+        """Periodically flush pending positions until stopped"""
+        self.running = True
+        logger.info("📍 Location flush worker started")
+        loop = asyncio.get_event_loop()
+
+        while self.running:
+            await asyncio.sleep(self.FLUSH_INTERVAL_SECONDS)
+            try:
+                # Database work runs off the event loop
+                await loop.run_in_executor(None, self.flush)
+            except Exception as e:
+                logger.error(f"❌ Error flushing locations: {e}", exc_info=True)
+
+    async def stop(self):
+        """Stop the worker and write out anything still pending"""
+        self.running = False
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(None, self.flush)
+        except Exception as e:
+            logger.error(f"❌ Final location flush failed: {e}", exc_info=True)
+        logger.info("🛑 Location flush worker stopped")
+
+    def flush(self) -> int:
+        """Write all pending positions; returns the number of rows updated"""
+        with self._lock:
+            pending, self._dirty = self._dirty, {}
+            drivers_only, self._drivers_only = self._drivers_only, set()
+
+        if not pending:
+            return 0
+
+        items = [(user_id, position) for user_id, position in pending.items() if user_id not in drivers_only]
+        driver_items = [(user_id, position) for user_id, position in pending.items() if user_id in drivers_only]
+        updated_ids = set()
+        db = SessionLocal()
+        try:
+            for batch_items, only_drivers in ((items, False), (driver_items, True)):
+                for start in range(0, len(batch_items), self.MAX_BATCH_SIZE):
+                    updated_ids.update(self._update_batch(db, batch_items[start:start + self.MAX_BATCH_SIZE], only_drivers))
+            db.commit()
+        except Exception:
+            db.rollback()
+            # Put positions back unless a newer ping arrived meanwhile
+            with self._lock:
+                for user_id, position in pending.items():
+                    if user_id not in self._dirty:
+                        self._dirty[user_id] = position
+                        if user_id in drivers_only:
+                            self._drivers_only.add(user_id)
+            raise
+        finally:
+            db.close()
+
+        # Forget ids that matched no row (or no driver row) so unknown users cannot grow the table
+        unknown_ids = pending.keys() - updated_ids
+        if unknown_ids:
+            with self._lock:
+                for user_id in unknown_ids:
+                    if user_id not in self._dirty:
+                        self._positions.pop(user_id, None)
+                        self._timestamps.pop(user_id, None)
+
+        logger.debug(f"📍 Flushed {len(updated_ids)} locations ({len(unknown_ids)} unknown users or non-drivers)")
+        return len(updated_ids)
+
+    def _update_batch(self, db, batch: List[Tuple[int, Position]], drivers_only: bool = False) -> List[int]:
+        rows = []
+        params = {}
+        for i, (user_id, (latitude, longitude)) in enumerate(batch):
+            rows.append(f"(:id{i}, :lat{i}, :lng{i})")
+            params[f"id{i}"] = user_id
+            params[f"lat{i}"] = latitude
+            params[f"lng{i}"] = longitude
+
+        result = db.execute(text(f"""
+            UPDATE users
+            SET latitude = CAST(v.lat AS DOUBLE PRECISION),
+                longitude = CAST(v.lng AS DOUBLE PRECISION)
+            FROM (VALUES {", ".join(rows)}) AS v(id, lat, lng)
+            WHERE users.id = CAST(v.id AS INTEGER){" AND users.is_driver" if drivers_only else ""}
+            RETURNING users.id
+        """), params)
+        return [row[0] for row in result]
+
+
+# Global location buffer instance
+location_buffer = LocationBuffer()
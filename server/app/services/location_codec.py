@@ -0,0 +1,219 @@
+"""
+Location Frame Codec
+Compact binary encoding for the ride location WebSocket stream and bulk position ingest
+
+Binary frame layout (12 bytes, little-endian):
+    int32   latitude  * 1e7
+    int32   longitude * 1e7
+    uint32  milliseconds since the ride channel epoch
+
+The channel epoch is announced to binary clients when they connect, so frames
+from one party can be forwarded to the other without being decoded.
+
+Bulk ingest record layout (20 bytes, little-endian), POST /api/users/locations:
+    uint32  driver id
+    int32   latitude  * 1e7
+    int32   longitude * 1e7
+    int64   milliseconds since the Unix epoch (0 = time of receipt)
+"""
+
+import math
+import struct
+import time
+from typing import List, Optional, Tuple, Union
+
+from ..core.serialization import dumps, loads
+
+ENCODING_JSON = "json"
+ENCODING_BINARY = "binary"
+ENCODINGS = (ENCODING_JSON, ENCODING_BINARY)
+
+COORD_SCALE = 10_000_000  # 1e-7 degrees (~1 cm)
+FRAME = struct.Struct("<iiI")
+FRAME_SIZE = FRAME.size
+MAX_OFFSET_MS = 0xFFFFFFFF  # ~49 days past the channel epoch
+
+POSITION_RECORD = struct.Struct("<Iiiq")
+POSITION_RECORD_SIZE = POSITION_RECORD.size
+CONTENT_JSON = "application/json"
+CONTENT_NDJSON = ("application/x-ndjson", "application/ndjson")
+CONTENT_BINARY = "application/octet-stream"
+MAX_USER_ID = 2 ** 31 - 1  # users.id is a 32-bit INTEGER
+MAX_CLOCK_SKEW_MS = 60_000  # Timestamps further ahead than this are rejected
+
+Location = Tuple[float, float, int]  # latitude, longitude, timestamp ms
+PositionRow = Tuple[int, float, float, int]  # driver id, latitude, longitude, timestamp ms
+
+
+def now_ms() -> int:
+    """Current wall-clock time in milliseconds"""
+    return int(time.time() * 1000)
+
+
+def encode_location(latitude: float, longitude: float, offset_ms: int) -> bytes:
+    """Pack a position into a binary frame"""
+    return FRAME.pack(
+        round(latitude * COORD_SCALE),
+        round(longitude * COORD_SCALE),
+        min(max(offset_ms, 0), MAX_OFFSET_MS)
+    )
+
+
+def decode_location(frame: bytes) -> Tuple[float, float, int]:
+    """Unpack a binary frame into (latitude, longitude, offset_ms)"""
+    lat_e7, lng_e7, offset_ms = FRAME.unpack(frame)
+    return lat_e7 / COORD_SCALE, lng_e7 / COORD_SCALE, offset_ms
+
+
+def is_valid_position(latitude: float, longitude: float) -> bool:
+    """Finite and within ±90 / ±180 degrees - anything else cannot be packed into a frame"""
+    return (
+        math.isfinite(latitude) and math.isfinite(longitude)
+        and -90 <= latitude <= 90 and -180 <= longitude <= 180
+    )
+
+
+def is_valid_frame(frame: bytes) -> bool:
+    """Check frame size and coordinate ranges without building floats"""
+    if len(frame) != FRAME_SIZE:
+        return False
+    lat_e7, lng_e7, _ = FRAME.unpack(frame)
+    return -90 * COORD_SCALE <= lat_e7 <= 90 * COORD_SCALE and -180 * COORD_SCALE <= lng_e7 <= 180 * COORD_SCALE
+
+
+def parse_location(data: Union[bytes, str], epoch_ms: int) -> Optional[Location]:
+    """
+    Decode a ride channel message once, for the trail, the shaper and the transcoder
+
+    Returns (latitude, longitude, timestamp_ms) for a location update and None for
+    anything else: unparsable text, other message types, or coordinates that are
+    not finite or out of range. Binary frames are range-checked by the socket
+    handler (is_valid_frame) before they get here.
+    """
+    if isinstance(data, bytes):
+        latitude, longitude, offset_ms = decode_location(data)
+        return latitude, longitude, epoch_ms + offset_ms
+
+    try:
+        message = loads(data)
+        latitude = float(message["latitude"])
+        longitude = float(message["longitude"])
+    except (ValueError, TypeError, KeyError):
+        return None
+    if not is_valid_position(latitude, longitude):
+        return None
+
+    timestamp = message.get("timestamp")
+    if not isinstance(timestamp, (int, float)) or not math.isfinite(timestamp):
+        timestamp = now_ms()
+    return latitude, longitude, int(timestamp)
+
+
+def location_to_json(latitude: float, longitude: float, ts_ms: int) -> str:
+    """JSON text of a location update (a binary frame transcoded for a JSON client)"""
+    return dumps({
+        "latitude": latitude,
+        "longitude": longitude,
+        "timestamp": ts_ms
+    })
+
+
+def session_message(epoch_ms: int) -> dict:
+    """Handshake sent to binary clients describing the frame layout"""
+    return {
+        "type": "location_session",
+        "encoding": ENCODING_BINARY,
+        "epoch_ms": epoch_ms,
+        "frame": FRAME.format,
+        "coord_scale": COORD_SCALE
+    }
+
+
+# ============================================
+# BULK POSITIONS
+# ============================================
+
+_BLANK_LINE = object()
+_INVALID_LINE = object()
+
+
+def _position_row(item, received_ms: int) -> Optional[PositionRow]:
+    """
+    Validate one JSON position: an object or a [driver_id, latitude, longitude, timestamp] array
+
+    A missing or 0 timestamp means the time of receipt, as in binary records.
+    """
+    if isinstance(item, dict):
+        driver_id, latitude, longitude = item.get("driver_id"), item.get("latitude"), item.get("longitude")
+        timestamp = item.get("timestamp")
+    elif isinstance(item, list) and 3 <= len(item) <= 4:
+        driver_id, latitude, longitude = item[0], item[1], item[2]
+        timestamp = item[3] if len(item) == 4 else None
+    else:
+        return None
+
+    # type() rather than isinstance(): bool is an int
+    if type(driver_id) is not int or not 0 < driver_id <= MAX_USER_ID:
+        return None
+    if type(latitude) not in (int, float) or type(longitude) not in (int, float):
+        return None
+    if not (-90 <= latitude <= 90) or not (-180 <= longitude <= 180):  # Also rejects NaN
+        return None
+    if timestamp is None:
+        timestamp = 0
+    elif type(timestamp) not in (int, float) or not 0 <= timestamp <= received_ms + MAX_CLOCK_SKEW_MS:
+        return None
+    return driver_id, float(latitude), float(longitude), int(timestamp) or received_ms  # Same rule as binary records
+
+
+def decode_position_batch(body: bytes, content_type: str, received_ms: int) -> Tuple[List[PositionRow], List[int]]:
+    """
+    Parse and validate a bulk position upload in one pass
+
+    Returns the valid rows and the indexes of the rejected ones (array position,
+    NDJSON line or binary record number). Raises ValueError if the body as a
+    whole cannot be read in the given content type.
+    """
+    rows: List[PositionRow] = []
+    rejected: List[int] = []
+
+    if content_type == CONTENT_BINARY:
+        if len(body) % POSITION_RECORD_SIZE:
+            raise ValueError(f"Body is not a whole number of {POSITION_RECORD_SIZE}-byte records")
+        lat_limit, lng_limit = 90 * COORD_SCALE, 180 * COORD_SCALE
+        latest_ms = received_ms + MAX_CLOCK_SKEW_MS
+        for index, (driver_id, lat_e7, lng_e7, timestamp) in enumerate(POSITION_RECORD.iter_unpack(body)):
+            if (
+                0 < driver_id <= MAX_USER_ID
+                and -lat_limit <= lat_e7 <= lat_limit
+                and -lng_limit <= lng_e7 <= lng_limit
+                and 0 <= timestamp <= latest_ms
+            ):
+                rows.append((driver_id, lat_e7 / COORD_SCALE, lng_e7 / COORD_SCALE, timestamp or received_ms))
+            else:
+                rejected.append(index)
+        return rows, rejected
+
+    if content_type in CONTENT_NDJSON:
+        items = []
+        for line in body.splitlines():
+            try:
+                items.append(loads(line) if line.strip() else _BLANK_LINE)
+            except ValueError:
+                items.append(_INVALID_LINE)
+    elif content_type == CONTENT_JSON:
+        items = loads(body)  # ValueError if not JSON
+        if not isinstance(items, list):
+            raise ValueError("Expected a JSON array of positions")
+    else:
+        raise ValueError(f"Unsupported content type {content_type!r}")
+
+    for index, item in enumerate(items):
+        if item is _BLANK_LINE:
+            continue
+        row = _position_row(item, received_ms)
+        if row is None:
+            rejected.append(index)
+        else:
+            rows.append(row)
+    return rows, rejected
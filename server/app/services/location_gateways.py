@@ -0,0 +1,121 @@
+"""
+Location Gateways
+Fleet gateways allowed to bulk-upload driver positions, each limited to its own drivers
+"""
+
+import hashlib
+import hmac
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SIGNATURE_VERSION = "v1"
+
+
+class Gateway:
+    """A configured gateway: its signing secret and the driver ids it may report"""
+    __slots__ = ("gateway_id", "key", "fleet")
+
+    def __init__(self, gateway_id: str, key: bytes, fleet: Optional[List[Tuple[int, int]]]):
+        self.gateway_id = gateway_id
+        self.key = key
+        self.fleet = fleet  # Inclusive driver id ranges; None = any driver
+
+    def owns(self, driver_id: int) -> bool:
+        if self.fleet is None:
+            return True
+        return any(first <= driver_id <= last for first, last in self.fleet)
+
+
+class GatewayCredential:
+    """A request's claimed gateway and signature, checked against the body by verify()"""
+    __slots__ = ("gateway", "timestamp", "signature")
+
+    def __init__(self, gateway: Gateway, timestamp: str, signature: str):
+        self.gateway = gateway
+        self.timestamp = timestamp
+        self.signature = signature
+
+
+def _parse_fleet(spec: str) -> Optional[List[Tuple[int, int]]]:
+    """'*' or driver id ranges joined with '+', e.g. '1-5000+7001-7100' or '42'"""
+    if spec == "*":
+        return None
+    fleet = []
+    for part in spec.split("+"):
+        first, _, last = part.partition("-")
+        fleet.append((int(first), int(last or first)))
+    return fleet
+
+
+class LocationGateways:
+    """
+    Gateways configured in LOCATION_GATEWAYS, authenticated by an HMAC of each batch
+
+    LOCATION_GATEWAYS is a comma-separated list of <gateway id>:<secret>:<fleet>,
+    the fleet being "*" or driver id ranges joined with "+" (1-5000+7001-7100).
+    Every request names its gateway and signs the raw body with that secret:
+
+        X-Gateway-Id: <gateway id>
+        X-Gateway-Signature: t=<unix seconds>,v1=<hex HMAC-SHA256 of "<t>." + body>
+
+    Signatures older (or newer) than MAX_SKEW_SECONDS are refused, so a captured
+    batch cannot be replayed later. Without LOCATION_GATEWAYS every request is
+    refused.
+    """
+
+    MAX_SKEW_SECONDS = int(os.getenv("LOCATION_GATEWAY_MAX_SKEW_SECONDS", "300"))
+
+    def __init__(self, config: Optional[str] = None):
+        self.gateways: Dict[str, Gateway] = {}
+        config = os.getenv("LOCATION_GATEWAYS", "") if config is None else config
+        for spec in config.split(","):
+            if not spec.strip():
+                continue
+            try:
+                gateway_id, rest = spec.strip().split(":", 1)
+                secret, fleet = rest.rsplit(":", 1)
+                gateway = Gateway(gateway_id, secret.encode("utf-8"), _parse_fleet(fleet.strip()))
+            except ValueError:
+                # Never log the spec itself: it holds the secret
+                logger.error("❌ Ignoring malformed LOCATION_GATEWAYS entry (expected <id>:<secret>:<fleet>)")
+                continue
+            self.gateways[gateway_id] = gateway
+        if not self.gateways:
+            logger.warning("⚠️ LOCATION_GATEWAYS not set - bulk location ingest refuses every request")
+
+    def credential(self, gateway_id: Optional[str], signature_header: Optional[str]) -> Optional[GatewayCredential]:
+        """
+        The request's credential if it names a known gateway with a fresh, well-formed signature
+
+        Checked before the body is read; verify() then checks the signature itself.
+        """
+        gateway = self.gateways.get(gateway_id or "")
+        if gateway is None or not signature_header:
+            return None
+        fields = dict(part.strip().partition("=")[::2] for part in signature_header.split(","))
+        timestamp, signature = fields.get("t", ""), fields.get(SIGNATURE_VERSION, "")
+        if not (timestamp.isascii() and timestamp.isdigit()) or not signature:
+            return None
+        if abs(time.time() - int(timestamp)) > self.MAX_SKEW_SECONDS:
+            return None
+        return GatewayCredential(gateway, timestamp, signature)
+
+    @staticmethod
+    def sign(key: bytes, timestamp: str, body: bytes) -> str:
+        return hmac.new(key, timestamp.encode("ascii") + b"." + body, hashlib.sha256).hexdigest()
+
+    def verify(self, credential: GatewayCredential, body: bytes) -> bool:
+        """True if the credential's signature covers exactly this body"""
+        expected = self.sign(credential.gateway.key, credential.timestamp, body)
+        # Bytes: compare_digest refuses non-ASCII str, and header values can be anything
+        return hmac.compare_digest(expected.encode("ascii"), credential.signature.lower().encode("utf-8"))
+
+
+# Global location gateway instance
+location_gateways = LocationGateways()
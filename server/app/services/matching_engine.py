@@ -5,13 +5,20 @@ Handles automatic driver matching with offer/accept/decline flow
 
 import asyncio
 import logging
+import time
+from collections import Counter, deque
 from datetime import datetime, timedelta
-from typing import Optional, List, Tuple
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, func
+from typing import Optional, List, Set, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, or_, func, select, update
 
 from ..db.models import User, Ride
-from ..db.database import SessionLocal
+from ..db.database import AsyncSessionLocal
+from .location_buffer import location_buffer
+from .driver_liveness import driver_liveness
+from .profile_cache import profile_cache
+from .query_profiler import query_profiler
+from .ride_state import transition_async, transition_statement
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -21,6 +28,9 @@ logger = logging.getLogger(__name__)
 class MatchingEngine:
     """
     Core matching engine that handles ride-driver matching with offer system
+    
+    All database access goes through AsyncSession, so a slow query suspends only
+    the coroutine waiting on it instead of stalling every WebSocket on the loop.
     """
     
     OFFER_TIMEOUT_SECONDS = 20  # Changed from 15 to 20 seconds
@@ -32,6 +42,10 @@ class MatchingEngine:
     def __init__(self):
         self.running = False
         self.websocket_manager = None  # Will be set from main.py
+        self.stats = Counter()  # offers_created / offers_accepted / offers_declined / offers_timed_out / rides_dequeued
+        self._recent_timeouts = deque()  # Monotonic timestamps of offer timeouts (last hour)
+        self._pending_offers = {}  # driver_id -> ride_id of the offer they are currently viewing
+        self._wakeup: Optional[asyncio.Event] = None  # Set to run the matching worker immediately
         
     def set_websocket_manager(self, manager):
         """Set the WebSocket manager for push notifications"""
@@ -40,6 +54,7 @@ class MatchingEngine:
     async def start(self):
         """Start the background matching worker"""
         self.running = True
+        self._wakeup = asyncio.Event()
         logger.info("🚀 Matching Engine started")
         
         # Start multiple concurrent workers
@@ -66,20 +81,30 @@ class MatchingEngine:
         logger.info("🔄 Matching worker started")
         
         while self.running:
-            db = SessionLocal()
-            try:
-                # Process one ride at a time (FIFO)
-                await self._process_next_ride(db)
-                
-            except Exception as e:
-                logger.error(f"❌ Error in matching worker: {e}", exc_info=True)
-            finally:
-                db.close()
+            with query_profiler.unit("matching_engine.matching"):
+                db = AsyncSessionLocal()
+                try:
+                    # Process one ride at a time (FIFO)
+                    await self._process_next_ride(db)
+                    
+                except Exception as e:
+                    logger.error(f"❌ Error in matching worker: {e}", exc_info=True)
+                finally:
+                    await db.close()
             
-            # Wait before next iteration
-            await asyncio.sleep(self.MATCHING_INTERVAL_SECONDS)
+            # Wait before next iteration (cut short when an offer is released early)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.MATCHING_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+    
+    def _poke(self):
+        """Run the matching worker now instead of after the interval"""
+        if self._wakeup:
+            self._wakeup.set()
     
-    async def _process_next_ride(self, db: Session):
+    async def _process_next_ride(self, db: AsyncSession):
         """
         Process the oldest requested ride WITHOUT active offer (FIFO)
         
@@ -92,10 +117,12 @@ class MatchingEngine:
         - One offer per driver at a time (queue system)
         """
         # Get oldest requested ride WITHOUT current active offer (FIFO + Queue)
-        ride = db.query(Ride).filter(
-            Ride.status == "requested",
-            Ride.current_offer_driver_id == None  # NEW: No active offer
-        ).order_by(Ride.created_at.asc()).with_for_update(skip_locked=True).first()
+        ride = (await db.execute(
+            select(Ride).filter(
+                Ride.status == "requested",
+                Ride.current_offer_driver_id == None  # NEW: No active offer
+            ).order_by(Ride.created_at.asc()).limit(1).with_for_update(skip_locked=True)
+        )).scalars().first()
         
         if not ride:
             return  # No rides to process
@@ -111,7 +138,7 @@ class MatchingEngine:
         excluded_driver_ids = self._get_excluded_drivers(ride)
         
         # Find nearest available driver
-        driver = self._find_nearest_driver(
+        driver = await self._find_nearest_driver(
             db,
             ride.start_lat,
             ride.start_lng,
@@ -126,9 +153,9 @@ class MatchingEngine:
         # Create offer
         await self._create_offer(db, ride, driver)
     
-    def _find_nearest_driver(
+    async def _find_nearest_driver(
         self,
-        db: Session,
+        db: AsyncSession,
         pickup_lat: float,
         pickup_lng: float,
         excluded_driver_ids: List[int],
@@ -141,9 +168,10 @@ class MatchingEngine:
         - No drivers in database
         - All drivers offline
         - All drivers excluded (declined)
-        - Drivers with no location data
+        - Drivers with no location data (buffered positions take precedence over the DB)
         - Invalid coordinates
         - Drivers with pending offers (one-offer-per-driver rule)
+        - Drivers whose app crashed or disconnected (no recent heartbeat)
         """
         if pickup_lat is None or pickup_lng is None:
             logger.error("❌ Invalid pickup coordinates")
@@ -151,22 +179,23 @@ class MatchingEngine:
         
         # NEW: Get drivers who currently have pending offers (to exclude them)
         now = datetime.utcnow()
-        drivers_with_offers = db.query(Ride.current_offer_driver_id).filter(
-            and_(
-                Ride.current_offer_driver_id.isnot(None),
-                Ride.offer_expires_at > now,
-                Ride.status == "requested"
+        drivers_with_offers = (await db.execute(
+            select(Ride.current_offer_driver_id).filter(
+                and_(
+                    Ride.current_offer_driver_id.isnot(None),
+                    Ride.offer_expires_at > now,
+                    Ride.status == "requested"
+                )
             )
-        ).all()
+        )).all()
         busy_driver_ids = [d[0] for d in drivers_with_offers if d[0]]
         
         # Get available drivers (not currently on a ride, no pending offers)
-        query = db.query(User).filter(
+        # Location is checked below: the freshest position may only be in the location buffer
+        query = select(User).filter(
             and_(
                 User.is_driver == True,
-                User.availability == True,
-                User.latitude.isnot(None),
-                User.longitude.isnot(None)
+                User.availability == True
             )
         )
         
@@ -179,7 +208,11 @@ class MatchingEngine:
             query = query.filter(~User.id.in_(busy_driver_ids))
             logger.info(f"🚫 Excluding {len(busy_driver_ids)} drivers with pending offers: {busy_driver_ids}")
         
-        available_drivers = query.all()
+        # Drivers whose app stopped heartbeating (or disconnected) are not offered rides
+        available_drivers = [
+            driver for driver in (await db.execute(query)).scalars()
+            if driver_liveness.is_live(driver.id) and self._is_reachable(driver.id)
+        ]
         
         if not available_drivers:
             return None
@@ -200,10 +233,14 @@ class MatchingEngine:
         min_distance = float('inf')
         
         for driver in available_drivers:
+            driver_lat, driver_lng = location_buffer.get(driver.id) or (driver.latitude, driver.longitude)
+            if driver_lat is None or driver_lng is None:
+                continue
+            
             try:
                 distance = haversine(
                     pickup_lat, pickup_lng,
-                    driver.latitude, driver.longitude
+                    driver_lat, driver_lng
                 )
                 
                 # Only consider drivers within search radius
@@ -220,7 +257,7 @@ class MatchingEngine:
         
         return closest_driver
     
-    async def _create_offer(self, db: Session, ride: Ride, driver: User):
+    async def _create_offer(self, db: AsyncSession, ride: Ride, driver: User):
         """
         Create an offer to a driver with timeout
         
@@ -231,32 +268,47 @@ class MatchingEngine:
         """
         try:
             # Double-check driver is still available
-            db.refresh(driver)
+            await db.refresh(driver)
             if not driver.availability:
                 logger.warning(f"⚠️ Driver #{driver.id} went offline, skipping")
                 return
             
             # Update ride status to offering
-            ride.status = "offering"
-            ride.offered_to_driver_id = driver.id
-            ride.offered_at = datetime.utcnow()
-            ride.expires_at = datetime.utcnow() + timedelta(seconds=self.OFFER_TIMEOUT_SECONDS)
-            ride.offer_attempts += 1
-            
-            # NEW: Track current offer for queue management
-            ride.current_offer_driver_id = driver.id
-            ride.offer_expires_at = datetime.utcnow() + timedelta(seconds=self.OFFER_TIMEOUT_SECONDS)
+            now = datetime.utcnow()
+            expires_at = now + timedelta(seconds=self.OFFER_TIMEOUT_SECONDS)
+            ride = await transition_async(
+                db, ride.id, "offering",
+                Ride.current_offer_driver_id == None,
+                offered_to_driver_id=driver.id,
+                offered_at=now,
+                expires_at=expires_at,
+                offer_attempts=func.coalesce(Ride.offer_attempts, 0) + 1,
+                # NEW: Track current offer for queue management
+                current_offer_driver_id=driver.id,
+                offer_expires_at=expires_at
+            )
+            if not ride:
+                await db.rollback()
+                return  # Cancelled or offered elsewhere meanwhile
             
-            db.commit()
-            db.refresh(ride)
+            await db.commit()
             
+            self.stats["offers_created"] += 1
+            self._pending_offers[driver.id] = ride.id
             logger.info(f"📤 Offer created: Ride #{ride.id} → Driver #{driver.id} (expires in {self.OFFER_TIMEOUT_SECONDS}s)")
             
             # Send WebSocket notification to driver
-            await self._notify_driver_offer(driver.id, ride)
+            delivered = await self._notify_driver_offer(driver.id, ride)
+            
+            # Nobody will see this offer - release it now instead of waiting for the timeout
+            if not delivered:
+                logger.warning(f"📵 Offer for ride #{ride.id} could not be delivered to driver #{driver.id} - expiring now")
+                self.stats["offers_undelivered"] += 1
+                await self._release_offer(db, ride.id, driver.id)
+                self._poke()
             
         except Exception as e:
-            db.rollback()
+            await db.rollback()
             logger.error(f"❌ Failed to create offer: {e}", exc_info=True)
     
     def _get_excluded_drivers(self, ride: Ride) -> List[int]:
@@ -270,29 +322,43 @@ class MatchingEngine:
             logger.error(f"❌ Error parsing declined drivers: {e}")
             return []
     
-    def _count_available_drivers(self, db: Session, excluded_driver_ids: List[int]) -> int:
+    async def _count_available_drivers(self, db: AsyncSession, excluded_driver_ids: List[int]) -> int:
         """
         Count available drivers (continuously updated pool)
-        Excludes offline drivers, drivers with active rides, and declined drivers
+        Excludes offline drivers, drivers with active rides, declined drivers and
+        drivers without a live, connected notification socket
         """
         # Get drivers with pending offers (to exclude)
         now = datetime.utcnow()
-        drivers_with_offers = db.query(Ride.current_offer_driver_id).filter(
-            and_(
-                Ride.current_offer_driver_id.isnot(None),
-                Ride.offer_expires_at > now,
-                Ride.status.in_(["requested", "offering"])
+        drivers_with_offers = (await db.execute(
+            select(Ride.current_offer_driver_id).filter(
+                and_(
+                    Ride.current_offer_driver_id.isnot(None),
+                    Ride.offer_expires_at > now,
+                    Ride.status.in_(["requested", "offering"])
+                )
             )
-        ).all()
+        )).all()
         busy_driver_ids = [d[0] for d in drivers_with_offers if d[0]]
         
+        # Only live, connected drivers can take an offer - narrow down in memory first
+        candidate_ids = self._reachable_live_ids()
+        if candidate_ids is not None:
+            candidate_ids -= set(excluded_driver_ids)
+            candidate_ids -= set(busy_driver_ids)
+            if not candidate_ids:
+                logger.info(f"📊 Available drivers: 0 (no live drivers outside {len(excluded_driver_ids)} declined, {len(busy_driver_ids)} with pending offers)")
+                return 0
+        
         # Count available drivers
-        query = db.query(User).filter(
+        query = select(func.count()).select_from(User).filter(
             and_(
                 User.is_driver == True,
                 User.availability == True
             )
         )
+        if candidate_ids is not None:
+            query = query.filter(User.id.in_(candidate_ids))
         
         # Exclude declined drivers
         if excluded_driver_ids:
@@ -302,7 +368,7 @@ class MatchingEngine:
         if busy_driver_ids:
             query = query.filter(~User.id.in_(busy_driver_ids))
         
-        count = query.count()
+        count = (await db.execute(query)).scalar()
         logger.info(f"📊 Available drivers: {count} (excluded: {len(excluded_driver_ids)} declined, {len(busy_driver_ids)} with pending offers)")
         return count
     
@@ -318,67 +384,162 @@ class MatchingEngine:
         logger.info("⏰ Expiry worker started")
         
         while self.running:
-            db = SessionLocal()
-            try:
-                now = datetime.utcnow()
-                
-                # Find expired offers
-                expired_rides = db.query(Ride).filter(
-                    and_(
-                        Ride.status == "offering",
-                        Ride.expires_at <= now
-                    )
-                ).all()
-                
-                for ride in expired_rides:
-                    expired_driver_id = ride.offered_to_driver_id
-                    logger.warning(f"⏳ Offer expired for ride #{ride.id} (driver #{expired_driver_id}) - TIMEOUT = AUTO-DECLINE")
-                    
-                    # NEW BEHAVIOR: Timeout is treated as decline (move to next driver)
-                    # Add driver to declined list
-                    if ride.declined_driver_ids:
-                        ride.declined_driver_ids += f",{expired_driver_id}"
-                    else:
-                        ride.declined_driver_ids = str(expired_driver_id)
-                    
-                    # Revert to requested for next driver
-                    ride.status = "requested"
-                    ride.offered_to_driver_id = None
-                    ride.offered_at = None
-                    ride.expires_at = None
+            with query_profiler.unit("matching_engine.expiry"):
+                db = AsyncSessionLocal()
+                try:
+                    now = datetime.utcnow()
                     
-                    # NEW: Clear current offer tracking
-                    ride.current_offer_driver_id = None
-                    ride.offer_expires_at = None
+                    # Find expired offers
+                    expired_rides = (await db.execute(
+                        select(Ride.id, Ride.offered_to_driver_id).filter(
+                            and_(
+                                Ride.status == "offering",
+                                Ride.expires_at <= now
+                            )
+                        )
+                    )).all()
                     
-                    # NEW: Check if all drivers exhausted (continuously updated pool)
-                    excluded_drivers = self._get_excluded_drivers(ride)
-                    remaining_drivers = self._count_available_drivers(db, excluded_drivers)
-                    
-                    if remaining_drivers == 0:
-                        logger.error(f"❌ All drivers exhausted for ride #{ride.id} - CANCELLING")
-                        ride.status = "cancelled"
-                        ride.cancelled_at = datetime.utcnow()
-                        ride.cancellation_reason = "no_drivers_available"
-                        db.commit()
+                    for ride_id, expired_driver_id in expired_rides:
+                        # NEW BEHAVIOR: Timeout is treated as decline (move to next driver)
+                        if await self._release_offer(db, ride_id, expired_driver_id) is None:
+                            continue  # Answered in the meantime
                         
-                        # Notify rider about cancellation
-                        await self._notify_rider_cancelled(ride.rider_id, ride.id)
-                    else:
-                        logger.info(f"🔄 {remaining_drivers} drivers still available for ride #{ride.id}")
-                        db.commit()
-                    
-                    # Notify driver that offer expired
-                    await self._notify_driver_offer_expired(expired_driver_id, ride.id)
-                    
-            except Exception as e:
-                logger.error(f"❌ Error in expiry worker: {e}", exc_info=True)
-                db.rollback()
-            finally:
-                db.close()
+                        logger.warning(f"⏳ Offer expired for ride #{ride_id} (driver #{expired_driver_id}) - TIMEOUT = AUTO-DECLINE")
+                        self._record_timeout()
+                        
+                        # Notify driver that offer expired
+                        await self._notify_driver_offer_expired(expired_driver_id, ride_id)
+                        
+                except Exception as e:
+                    logger.error(f"❌ Error in expiry worker: {e}", exc_info=True)
+                    await db.rollback()
+                finally:
+                    await db.close()
             
             await asyncio.sleep(2)
     
+    async def _release_offer(self, db: AsyncSession, ride_id: int, driver_id: int) -> Optional[bool]:
+        """
+        Take an offer back from a driver (decline, timeout, undeliverable or disconnect)
+        
+        The driver is added to the ride's declined list and the ride goes back to
+        'requested' for the next driver - or is cancelled if no drivers remain.
+        Commits the session. Returns True if the ride was cancelled, None if the
+        offer was no longer this driver's (accepted, cancelled or released already).
+        """
+        if self._pending_offers.get(driver_id) == ride_id:
+            self._pending_offers.pop(driver_id)
+        
+        # Revert to requested for next driver, adding the driver to the declined list
+        ride = await transition_async(
+            db, ride_id, "requested",
+            Ride.offered_to_driver_id == driver_id,
+            declined_driver_ids=func.coalesce(Ride.declined_driver_ids + ",", "") + str(driver_id),
+            offered_to_driver_id=None,
+            offered_at=None,
+            expires_at=None,
+            # NEW: Clear current offer tracking
+            current_offer_driver_id=None,
+            offer_expires_at=None
+        )
+        if not ride:
+            await db.rollback()
+            return None
+        await db.commit()
+        
+        # NEW: Check if all drivers exhausted (continuously updated pool)
+        excluded_drivers = self._get_excluded_drivers(ride)
+        remaining_drivers = await self._count_available_drivers(db, excluded_drivers)
+        
+        if remaining_drivers == 0:
+            # Unless the matcher has offered it again in the meantime
+            cancelled = await transition_async(
+                db, ride_id, "cancelled",
+                Ride.status == "requested",
+                cancelled_at=datetime.utcnow(),
+                cancellation_reason="no_drivers_available"
+            )
+            await db.commit()
+            
+            if cancelled:
+                self.stats["rides_dequeued"] += 1
+                logger.error(f"❌ All drivers exhausted for ride #{ride_id} - CANCELLED")
+                
+                # Notify rider about cancellation
+                await self._notify_rider_cancelled(cancelled.rider_id, ride_id)
+                return True
+        
+        logger.info(f"🔄 {remaining_drivers} drivers still available for ride #{ride_id}")
+        return False
+    
+    def _reachable_live_ids(self) -> Optional[Set[int]]:
+        """Ids that are live and have a notification socket; None if neither check applies"""
+        live_ids = driver_liveness.live_ids()
+        if self.websocket_manager is None:
+            return live_ids
+        if live_ids is None:
+            return set(self.websocket_manager.user_connections)
+        return {user_id for user_id in live_ids if self.websocket_manager.is_connected(user_id)}
+    
+    def _is_reachable(self, driver_id: int) -> bool:
+        """True if the driver has a notification socket to receive an offer on"""
+        return self.websocket_manager is None or self.websocket_manager.is_connected(driver_id)
+    
+    async def handle_driver_disconnected(self, driver_id: int):
+        """
+        Expire the offer a driver is viewing once their last socket closes,
+        so the ride moves to the next driver right away
+        """
+        ride_id = self._pending_offers.get(driver_id)
+        if ride_id is None:
+            return  # Not viewing an offer (or not a driver) - no DB access needed
+        
+        with query_profiler.unit("matching_engine.disconnect"):
+            db = AsyncSessionLocal()
+            try:
+                if await self._release_offer(db, ride_id, driver_id) is None:
+                    self._pending_offers.pop(driver_id, None)
+                    return
+                
+                logger.warning(f"📵 Driver #{driver_id} disconnected while viewing offer for ride #{ride_id} - expired it")
+                self.stats["offers_abandoned"] += 1
+                self._poke()
+                
+            except Exception as e:
+                await db.rollback()
+                logger.error(f"❌ Error expiring offer for disconnected driver #{driver_id}: {e}", exc_info=True)
+            finally:
+                await db.close()
+    
+    def _record_timeout(self):
+        """Count an offer that expired without an answer"""
+        self.stats["offers_timed_out"] += 1
+        now = time.monotonic()
+        self._recent_timeouts.append(now)
+        self._trim_recent_timeouts(now)
+    
+    def _trim_recent_timeouts(self, now: float):
+        """Forget timeouts older than an hour (on every record, so the deque stays bounded without metrics reads)"""
+        cutoff = now - 3600
+        while self._recent_timeouts and self._recent_timeouts[0] < cutoff:
+            self._recent_timeouts.popleft()
+    
+    def get_stats(self) -> dict:
+        """Offer counters for the metrics endpoint"""
+        self._trim_recent_timeouts(time.monotonic())
+        
+        return {
+            "offers_created": self.stats["offers_created"],
+            "offers_accepted": self.stats["offers_accepted"],
+            "offers_declined": self.stats["offers_declined"],
+            "offers_timed_out": self.stats["offers_timed_out"],
+            "offers_undelivered": self.stats["offers_undelivered"],
+            "offers_abandoned": self.stats["offers_abandoned"],
+            "rides_dequeued": self.stats["rides_dequeued"],
+            "offer_timeouts_last_hour": len(self._recent_timeouts),
+            "live_connections": driver_liveness.live_count
+        }
+    
     # ============================================
     # CLEANUP WORKER
     # ============================================
@@ -391,32 +552,34 @@ class MatchingEngine:
         logger.info("🧹 Cleanup worker started")
         
         while self.running:
-            db = SessionLocal()
-            try:
-                # Cancel rides that have been requested for more than 10 minutes
-                stale_threshold = datetime.utcnow() - timedelta(minutes=10)
-                
-                stale_rides = db.query(Ride).filter(
-                    and_(
-                        Ride.status == "requested",
-                        Ride.created_at < stale_threshold
-                    )
-                ).all()
-                
-                for ride in stale_rides:
-                    logger.warning(f"🗑️ Cancelling stale ride #{ride.id} (created {ride.created_at})")
-                    ride.status = "cancelled"
-                    ride.cancelled_at = datetime.utcnow()
-                    db.commit()
+            with query_profiler.unit("matching_engine.cleanup"):
+                db = AsyncSessionLocal()
+                try:
+                    # Cancel rides that have been requested for more than 10 minutes
+                    stale_threshold = datetime.utcnow() - timedelta(minutes=10)
                     
-                    # Notify rider
-                    await self._notify_rider_timeout(ride.rider_id, ride.id)
+                    stale_rides = (await db.execute(
+                        transition_statement(
+                            "cancelled",
+                            Ride.status == "requested",
+                            Ride.created_at < stale_threshold,
+                            cancelled_at=datetime.utcnow()
+                        )
+                    )).scalars().all()
+                    await db.commit()
+                    self.stats["rides_dequeued"] += len(stale_rides)
                     
-            except Exception as e:
-                logger.error(f"❌ Error in cleanup worker: {e}", exc_info=True)
-                db.rollback()
-            finally:
-                db.close()
+                    for ride in stale_rides:
+                        logger.warning(f"🗑️ Cancelled stale ride #{ride.id} (created {ride.created_at})")
+                        
+                        # Notify rider
+                        await self._notify_rider_timeout(ride.rider_id, ride.id)
+                        
+                except Exception as e:
+                    logger.error(f"❌ Error in cleanup worker: {e}", exc_info=True)
+                    await db.rollback()
+                finally:
+                    await db.close()
             
             await asyncio.sleep(60)
     
@@ -424,7 +587,7 @@ class MatchingEngine:
     # ACCEPT/DECLINE HANDLERS
     # ============================================
     
-    async def handle_driver_accept(self, db: Session, ride_id: int, driver_id: int) -> Tuple[bool, str]:
+    async def handle_driver_accept(self, db: AsyncSession, ride_id: int, driver_id: int) -> Tuple[bool, str]:
         """
         Handle driver accepting a ride offer
         
@@ -437,42 +600,34 @@ class MatchingEngine:
         Returns: (success: bool, message: str)
         """
         try:
-            # Lock the ride row
-            ride = db.query(Ride).filter(Ride.id == ride_id).with_for_update().first()
+            # Accept the ride if it is still offered to this driver and not expired
+            ride = await transition_async(
+                db, ride_id, "accepted",
+                Ride.offered_to_driver_id == driver_id,
+                or_(Ride.expires_at == None, Ride.expires_at >= datetime.utcnow()),
+                driver_id=driver_id,
+                offered_to_driver_id=None,
+                offered_at=None,
+                expires_at=None,
+                # NEW: Clear current offer tracking
+                current_offer_driver_id=None,
+                offer_expires_at=None
+            )
             
             if not ride:
-                return False, "Ride not found"
-            
-            # Validate state
-            if ride.status != "offering":
-                return False, f"Ride is not in offering state (current: {ride.status})"
+                await db.rollback()
+                return False, await self._offer_rejection(db, ride_id, driver_id)
             
-            # Validate it's the correct driver
-            if ride.offered_to_driver_id != driver_id:
-                return False, "This ride was not offered to you"
+            self._pending_offers.pop(driver_id, None)
             
-            # Check if expired
-            if ride.expires_at and datetime.utcnow() > ride.expires_at:
-                return False, "Offer has expired"
-            
-            # Accept the ride
-            ride.status = "accepted"
-            ride.driver_id = driver_id
-            ride.offered_to_driver_id = None
-            ride.offered_at = None
-            ride.expires_at = None
-            
-            # NEW: Clear current offer tracking
-            ride.current_offer_driver_id = None
-            ride.offer_expires_at = None
+            # Mark driver as busy (profile for the rider's notification comes from the cache)
+            await db.execute(update(User).filter(User.id == driver_id).values(availability=False))
+            driver = await profile_cache.get_async(db, driver_id)
             
-            # Mark driver as busy
-            driver = db.query(User).filter(User.id == driver_id).first()
-            if driver:
-                driver.availability = False
-            
-            db.commit()
+            await db.commit()
             
+            self.stats["offers_accepted"] += 1
+            self.stats["rides_dequeued"] += 1
             logger.info(f"✅ Ride #{ride_id} accepted by driver #{driver_id}")
             
             # Notify rider
@@ -481,11 +636,11 @@ class MatchingEngine:
             return True, "Ride accepted successfully"
             
         except Exception as e:
-            db.rollback()
+            await db.rollback()
             logger.error(f"❌ Error accepting ride: {e}", exc_info=True)
             return False, f"Server error: {str(e)}"
     
-    async def handle_driver_decline(self, db: Session, ride_id: int, driver_id: int) -> Tuple[bool, str]:
+    async def handle_driver_decline(self, db: AsyncSession, ride_id: int, driver_id: int) -> Tuple[bool, str]:
         """
         Handle driver declining a ride offer
         
@@ -497,71 +652,47 @@ class MatchingEngine:
         Returns: (success: bool, message: str)
         """
         try:
-            # Lock the ride row
-            ride = db.query(Ride).filter(Ride.id == ride_id).with_for_update().first()
-            
-            if not ride:
-                return False, "Ride not found"
+            cancelled = await self._release_offer(db, ride_id, driver_id)
             
-            # Validate state
-            if ride.status != "offering":
-                return False, f"Ride is not in offering state (current: {ride.status})"
-            
-            # Validate it's the correct driver
-            if ride.offered_to_driver_id != driver_id:
-                return False, "This ride was not offered to you"
+            if cancelled is None:
+                return False, await self._offer_rejection(db, ride_id, driver_id)
             
+            self.stats["offers_declined"] += 1
             logger.info(f"❌ Ride #{ride_id} declined by driver #{driver_id}")
+            self._poke()
             
-            # Add to declined list
-            if ride.declined_driver_ids:
-                ride.declined_driver_ids += f",{driver_id}"
-            else:
-                ride.declined_driver_ids = str(driver_id)
-            
-            # Revert to requested for next driver
-            ride.status = "requested"
-            ride.offered_to_driver_id = None
-            ride.offered_at = None
-            ride.expires_at = None
-            
-            # NEW: Clear current offer tracking
-            ride.current_offer_driver_id = None
-            ride.offer_expires_at = None
-            
-            # NEW: Check if all drivers exhausted (immediately after decline)
-            excluded_drivers = self._get_excluded_drivers(ride)
-            remaining_drivers = self._count_available_drivers(db, excluded_drivers)
-            
-            if remaining_drivers == 0:
-                logger.error(f"❌ All drivers exhausted for ride #{ride_id} - CANCELLING")
-                ride.status = "cancelled"
-                ride.cancelled_at = datetime.utcnow()
-                ride.cancellation_reason = "no_drivers_available"
-                db.commit()
-                
-                # Notify rider about cancellation
-                await self._notify_rider_cancelled(ride.rider_id, ride.id)
+            if cancelled:
                 return True, "Ride cancelled - no drivers available"
-            else:
-                logger.info(f"🔄 {remaining_drivers} drivers still available for ride #{ride_id}")
-                db.commit()
-                return True, "Ride declined, will try another driver"
+            return True, "Ride declined, will try another driver"
             
         except Exception as e:
-            db.rollback()
+            await db.rollback()
             logger.error(f"❌ Error declining ride: {e}", exc_info=True)
             return False, f"Server error: {str(e)}"
     
+    async def _offer_rejection(self, db: AsyncSession, ride_id: int, driver_id: int) -> str:
+        """Why an accept/decline updated no row"""
+        ride = (await db.execute(
+            select(Ride.status, Ride.offered_to_driver_id).filter(Ride.id == ride_id)
+        )).first()
+        
+        if not ride:
+            return "Ride not found"
+        if ride.status != "offering":
+            return f"Ride is not in offering state (current: {ride.status})"
+        if ride.offered_to_driver_id != driver_id:
+            return "This ride was not offered to you"
+        return "Offer has expired"
+    
     # ============================================
     # WEBSOCKET NOTIFICATIONS
     # ============================================
     
-    async def _notify_driver_offer(self, driver_id: int, ride: Ride):
-        """Send ride offer to driver via WebSocket"""
+    async def _notify_driver_offer(self, driver_id: int, ride: Ride) -> bool:
+        """Send ride offer to driver via WebSocket; False if no device received it"""
         if not self.websocket_manager:
             logger.warning(f"⚠️ WebSocket manager not set, cannot send offer to driver #{driver_id}")
-            return
+            return True  # Delivery cannot be observed - leave the offer to the timeout
         
         try:
             message = {
@@ -580,9 +711,10 @@ class MatchingEngine:
                 }
             }
             logger.info(f"📡 Sending WebSocket notification to driver #{driver_id}: {message['type']}")
-            await self.websocket_manager.send_to_user(driver_id, message)
+            return await self.websocket_manager.send_to_user(driver_id, message, replay_ttl=self.OFFER_TIMEOUT_SECONDS) > 0
         except Exception as e:
             logger.error(f"❌ Failed to send offer notification to driver #{driver_id}: {e}", exc_info=True)
+            return False
     
     async def _notify_driver_offer_expired(self, driver_id: int, ride_id: int):
         """Notify driver that offer expired"""
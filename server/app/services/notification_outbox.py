@@ -0,0 +1,213 @@
+"""
+Notification Outbox
+Sequence-numbered per-user history so reconnecting clients get only what they missed
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import insert
+
+from ..core.serialization import dumps
+from ..db.database import SessionLocal
+from ..db.models import NotificationLog
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class NotificationOutbox:
+    """
+    Bounded in-memory ring of recent notifications per user, with an optional
+    persisted log (notification_log table) written in batches
+
+    Sequence numbers are millisecond-based and strictly increasing across the
+    process, so they also stay increasing across restarts. A client reconnects
+    with the last seq it saw; if the ring (or the persisted log) cannot prove
+    nothing was lost since then, the client gets a single 'resync' message and
+    should refetch its state over REST once.
+    """
+
+    RING_SIZE = int(os.getenv("NOTIFICATION_RING_SIZE", "100"))  # Messages kept per user
+    RETENTION_SECONDS = int(os.getenv("NOTIFICATION_RETENTION_SECONDS", "600"))
+    PERSIST = os.getenv("NOTIFICATION_OUTBOX_PERSIST", "false").lower() == "true"
+    FLUSH_INTERVAL_SECONDS = 1
+
+    def __init__(self):
+        self.running = False
+        self._rings: Dict[int, deque] = {}  # user_id -> (seq, created, replay deadline, payload)
+        self._floors: Dict[int, int] = {}  # user_id -> newest seq the ring cannot replay
+        self._pruned_floor = 0  # Newest seq of any ring dropped for being idle (floor for users without a ring)
+        self._last_seq = 0
+        self._started_seq = self._next_seq()  # Anything older may have been lost in a restart
+        self._unflushed: List[dict] = []
+        self._lock = threading.Lock()  # Flush runs in an executor thread
+        self._last_prune = time.monotonic()
+
+    def _next_seq(self) -> int:
+        self._last_seq = max(self._last_seq + 1, int(time.time() * 1000))
+        return self._last_seq
+
+    def record(self, user_id: int, data: dict, replay_ttl: Optional[float] = None) -> str:
+        """
+        Stamp a message with its sequence number and keep it for replay
+
+        replay_ttl limits how long the message is worth replaying (e.g. ride offers).
+        Returns the serialized message ready for sending.
+        """
+        seq = self._next_seq()
+        payload = dumps({**data, "seq": seq})
+        now = time.monotonic()
+
+        ring = self._rings.get(user_id)
+        if ring is None:
+            ring = self._rings[user_id] = deque()
+            # Fixed at creation: later prunes of other users' rings cannot affect this one
+            self._floors[user_id] = self._default_floor()
+        ring.append((seq, now, now + replay_ttl if replay_ttl else None, payload))
+        if len(ring) > self.RING_SIZE:
+            self._floors[user_id] = ring.popleft()[0]
+
+        if self.PERSIST:
+            with self._lock:
+                self._unflushed.append({
+                    "user_id": user_id,
+                    "seq": seq,
+                    "payload": payload,
+                    "expires_at": datetime.utcnow() + timedelta(seconds=replay_ttl) if replay_ttl else None
+                })
+        return payload
+
+    def needs_persisted(self, user_id: int, last_seq: int) -> bool:
+        """True if the ring alone cannot cover everything after last_seq"""
+        self._evict_expired(user_id)
+        floor = self._floors.get(user_id)
+        if floor is None:
+            floor = self._default_floor()
+        return last_seq < floor
+
+    def _default_floor(self) -> int:
+        """Floor for a user without a ring: a pruned ring of theirs may have held anything up to here"""
+        return max(self._started_seq, self._pruned_floor)
+
+    async def load_persisted(self, user_id: int, last_seq: int) -> Optional[List[Tuple[int, str]]]:
+        """
+        Fetch missed messages from the persisted log
+
+        None if persistence is off or more messages were missed than a replay carries
+        """
+        if not self.PERSIST:
+            return None
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self._query_persisted, user_id, last_seq)
+
+    def replay(self, user_id: int, last_seq: int, persisted: Optional[List[Tuple[int, str]]] = None) -> List[str]:
+        """
+        Messages after last_seq, oldest first
+
+        Must be called in the same event-loop step that registers the connection,
+        so no live message can slip in between the replay and the live stream.
+        """
+        if persisted is None and self.needs_persisted(user_id, last_seq):
+            logger.info(f"🔁 Replay gap for user #{user_id} after seq {last_seq} - requesting resync")
+            return [dumps({"type": "resync", "seq": self._last_seq})]
+
+        now = time.monotonic()
+        missed = {seq: payload for seq, payload in (persisted or [])}
+        for seq, _, deadline, payload in self._rings.get(user_id, ()):
+            if seq > last_seq and (deadline is None or deadline > now):
+                missed[seq] = payload
+
+        return [missed[seq] for seq in sorted(missed)]
+
+    def _evict_expired(self, user_id: int):
+        ring = self._rings.get(user_id)
+        if not ring:
+            return
+        cutoff = time.monotonic() - self.RETENTION_SECONDS
+        while ring and ring[0][1] < cutoff:
+            self._floors[user_id] = ring.popleft()[0]
+
+    # ============================================
+    # PERSISTED LOG
+    # ============================================
+
+    async def start(self):
+        """Flush the persisted log and prune idle rings until stopped"""
+        self.running = True
+        logger.info(f"📬 Notification outbox started (persisted log: {'on' if self.PERSIST else 'off'})")
+        loop = asyncio.get_event_loop()
+
+        while self.running:
+            await asyncio.sleep(self.FLUSH_INTERVAL_SECONDS)
+            self._prune_idle()
+            if not self.PERSIST:
+                continue
+            try:
+                await loop.run_in_executor(None, self.flush)
+            except Exception as e:
+                logger.error(f"❌ Error flushing notification log: {e}", exc_info=True)
+
+    async def stop(self):
+        self.running = False
+        if self.PERSIST:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self.flush)
+
+    def flush(self) -> int:
+        """Insert buffered messages in one batch; drop rows past retention once a minute"""
+        with self._lock:
+            rows, self._unflushed = self._unflushed, []
+
+        db = SessionLocal()
+        try:
+            if rows:
+                db.execute(insert(NotificationLog), rows)
+            if time.monotonic() - self._last_prune > 60:
+                db.query(NotificationLog).filter(
+                    NotificationLog.created_at < datetime.utcnow() - timedelta(seconds=self.RETENTION_SECONDS)
+                ).delete(synchronize_session=False)
+                self._last_prune = time.monotonic()
+            db.commit()
+        except Exception:
+            db.rollback()
+            with self._lock:
+                self._unflushed = rows + self._unflushed
+            raise
+        finally:
+            db.close()
+        return len(rows)
+
+    def _query_persisted(self, user_id: int, last_seq: int) -> Optional[List[Tuple[int, str]]]:
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            rows = db.query(NotificationLog.seq, NotificationLog.payload, NotificationLog.expires_at).filter(
+                NotificationLog.user_id == user_id,
+                NotificationLog.seq > last_seq
+            ).order_by(NotificationLog.seq).limit(self.RING_SIZE + 1).all()
+            if len(rows) > self.RING_SIZE:
+                return None  # Too far behind for a replay
+            return [(seq, payload) for seq, payload, expires_at in rows if expires_at is None or expires_at > now]
+        finally:
+            db.close()
+
+    def _prune_idle(self):
+        """Forget rings whose messages all passed retention"""
+        cutoff = time.monotonic() - self.RETENTION_SECONDS
+        for user_id in [user_id for user_id, ring in self._rings.items() if not ring or ring[-1][1] < cutoff]:
+            ring = self._rings.pop(user_id)
+            floor = ring[-1][0] if ring else self._floors.get(user_id, 0)
+            self._pruned_floor = max(self._pruned_floor, floor)
+            self._floors.pop(user_id, None)
+
+
+# Global notification outbox instance
+notification_outbox = NotificationOutbox()
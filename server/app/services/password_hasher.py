@@ -0,0 +1,162 @@
+"""
+Password Hasher
+bcrypt hashing and verification in a bounded process pool, off the request threads and the event loop
+"""
+
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import statistics
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple
+
+import bcrypt
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class PasswordHasherOverloaded(Exception):
+    """More password operations in flight than PasswordHasher.MAX_PENDING (served as 503)"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Password hashing overloaded, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+# Run in the worker processes: return the start time so the caller can split queue wait from work
+def _hash(password: bytes, rounds: int) -> Tuple[bytes, float]:
+    started = time.time()
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)), started
+
+
+def _verify(password: bytes, hashed: bytes) -> Tuple[bool, float]:
+    started = time.time()
+    return bcrypt.checkpw(password, hashed), started
+
+
+def _warm_up() -> None:
+    return None
+
+
+class PasswordHasher:
+    """
+    bcrypt for the auth endpoints, awaited from async handlers
+
+    A bcrypt call is ~250 ms of CPU. Run inline in sync handlers it held one of
+    the shared threadpool slots for that long, so a burst of logins queued
+    every other sync endpoint behind it. Here the work goes to WORKERS
+    processes (default: one per core); the handler awaits the result without
+    holding a thread.
+
+    At most MAX_PENDING operations may be queued or running; beyond that calls
+    raise PasswordHasherOverloaded right away (503 with Retry-After), so a
+    login storm cannot build an unbounded backlog. Time spent waiting for a
+    worker (queue) and hashing (run) is kept for the metrics endpoint.
+    """
+
+    WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "0")) or os.cpu_count() or 1
+    MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "0")) or WORKERS * 4  # Bounds queue wait to ~4 hash times
+    BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+    TIMINGS_KEPT = 1000  # Recent operations behind the queue / run percentiles
+
+    def __init__(self):
+        self.pending = 0  # Queued or running; only touched on the event loop
+        self.stats = Counter()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._queue_ms = deque(maxlen=self.TIMINGS_KEPT)
+        self._run_ms = deque(maxlen=self.TIMINGS_KEPT)
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: workers must not inherit the server's threads, sockets and event loop
+            self._pool = ProcessPoolExecutor(max_workers=self.WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    async def start(self):
+        """Start the workers now instead of on the first login"""
+        loop = asyncio.get_running_loop()
+        pool = self._executor()
+        await asyncio.gather(*(loop.run_in_executor(pool, _warm_up) for _ in range(self.WORKERS)))
+        logger.info(f"🔐 Password hasher started ({self.WORKERS} workers, max {self.MAX_PENDING} pending)")
+
+    async def stop(self):
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await asyncio.get_running_loop().run_in_executor(None, lambda: pool.shutdown(cancel_futures=True))
+
+    # ============================================
+    # OPERATIONS
+    # ============================================
+
+    async def hash(self, password: str) -> str:
+        """bcrypt hash of password (BCRYPT_ROUNDS), as stored in users.hashed_password"""
+        hashed = await self._run("hashes", _hash, password.encode("utf-8"), self.BCRYPT_ROUNDS)
+        return hashed.decode("utf-8")
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run("verifications", _verify, password.encode("utf-8"), hashed_password.encode("utf-8"))
+
+    async def _run(self, operation: str, function, *args):
+        if self.pending >= self.MAX_PENDING:
+            self.stats["rejected"] += 1
+            raise PasswordHasherOverloaded(self._retry_after())
+
+        self.pending += 1
+        submitted = time.time()
+        try:
+            result, started = await asyncio.get_running_loop().run_in_executor(self._executor(), function, *args)
+        except BrokenProcessPool:
+            logger.error("❌ Password hasher worker died - restarting the pool")
+            self._pool = None
+            raise
+        finally:
+            self.pending -= 1
+
+        self._queue_ms.append(max(0.0, started - submitted) * 1000)
+        self._run_ms.append(max(0.0, time.time() - started) * 1000)
+        self.stats[operation] += 1
+        return result
+
+    def _retry_after(self) -> int:
+        """Seconds until the current backlog should have drained"""
+        run_ms = statistics.median(self._run_ms) if self._run_ms else 250
+        return max(1, math.ceil(self.pending * run_ms / self.WORKERS / 1000))
+
+    # ============================================
+    # METRICS
+    # ============================================
+
+    @staticmethod
+    def _percentiles(samples) -> dict:
+        ordered = sorted(samples)
+        if not ordered:
+            return {"p50": None, "p99": None}
+        return {
+            "p50": round(ordered[len(ordered) // 2], 2),
+            "p99": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))], 2)
+        }
+
+    def get_stats(self) -> dict:
+        """Pool size, admission counters and queue / run time of recent operations"""
+        return {
+            "workers": self.WORKERS,
+            "bcrypt_rounds": self.BCRYPT_ROUNDS,
+            "max_pending": self.MAX_PENDING,
+            "pending": self.pending,
+            "hashes": self.stats["hashes"],
+            "verifications": self.stats["verifications"],
+            "rejected": self.stats["rejected"],
+            "queue_ms": self._percentiles(self._queue_ms),
+            "run_ms": self._percentiles(self._run_ms)
+        }
+
+
+# Global password hasher instance
+password_hasher = PasswordHasher()
@@ -0,0 +1,236 @@
+"""
+User Profile Cache
+Bounded in-process LRU of UserResponse profiles with a TTL, invalidated on writes
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from ..core.schemas import UserResponse
+from ..db.database import ASYNC_DATABASE_URL, REPLICA_MAX_LAG_SECONDS
+from ..db.models import User
+from ..db.queries import USER_RESPONSE_COLUMNS
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class ProfileCache:
+    """
+    User profiles (the UserResponse fields) for hot read paths
+
+    Profiles are keyed by user id and kept for TTL_SECONDS; once MAX_ENTRIES is
+    reached the least recently used one is dropped. Unknown ids are not cached,
+    so a user is found as soon as they register.
+
+    Write paths call invalidate() with their session before committing. On
+    PostgreSQL that also queues a NOTIFY on CHANNEL, delivered at commit to
+    every worker's listener (this one included), so all processes drop the
+    profile. Elsewhere only the local copy is dropped and the TTL bounds how
+    stale other workers can be.
+
+    The invalidation can arrive before a read replica has replayed the write
+    (and is sent before the writer commits), so for REPLICA_MAX_LAG_SECONDS
+    after a user is invalidated their profile is returned but not cached.
+
+    Cached profiles are shared: callers must copy before changing them.
+    Availability is not part of the profile; latitude/longitude are as of the
+    load - live positions come from the location buffer.
+    """
+
+    ENABLED = os.getenv("PROFILE_CACHE_ENABLED", "true").lower() == "true"
+    MAX_ENTRIES = int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "10000"))
+    TTL_SECONDS = float(os.getenv("PROFILE_CACHE_TTL_SECONDS", "60"))
+    CHANNEL = "user_profile_invalidation"
+    RECONNECT_SECONDS = 5
+    INVALIDATION_GRACE_SECONDS = REPLICA_MAX_LAG_SECONDS
+
+    def __init__(self):
+        self.running = False
+        self.listening = False
+        self.stats = Counter()
+        self._entries: "OrderedDict[int, Tuple[float, UserResponse]]" = OrderedDict()  # user_id -> (expires at, profile)
+        self._invalidated: "OrderedDict[int, float]" = OrderedDict()  # user_id -> monotonic time, oldest first
+        self._lock = threading.Lock()  # Sync handlers run in a thread pool
+        self._listener_task: Optional[asyncio.Task] = None
+
+    # ============================================
+    # LOOKUPS
+    # ============================================
+
+    def _lookup(self, user_id: int):
+        """Cached profile, or _MISSING"""
+        if not self.ENABLED:
+            return _MISSING
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                self.stats["misses"] += 1
+                return _MISSING
+            expires_at, profile = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                self.stats["expired"] += 1
+                return _MISSING
+            self._entries.move_to_end(user_id)
+            self.stats["hits"] += 1
+            return profile
+
+    def _store(self, user_id: int, row) -> Optional[UserResponse]:
+        if row is None:
+            return None
+        profile = UserResponse.model_validate(dict(row._mapping))
+        if not self.ENABLED:
+            return profile
+        with self._lock:
+            self._forget_old_invalidations()
+            if user_id in self._invalidated:
+                self.stats["not_cached_recent_write"] += 1  # The read may predate the write
+                return profile
+            self._entries[user_id] = (time.monotonic() + self.TTL_SECONDS, profile)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.MAX_ENTRIES:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+        return profile
+
+    @staticmethod
+    def _query(user_id: int):
+        return select(*USER_RESPONSE_COLUMNS).filter(User.id == user_id)
+
+    def get(self, db: Session, user_id: int) -> Optional[UserResponse]:
+        """User's profile, or None if there is no such user"""
+        profile = self._lookup(user_id)
+        if profile is _MISSING:
+            profile = self._store(user_id, db.execute(self._query(user_id)).first())
+        return profile
+
+    async def get_async(self, db: AsyncSession, user_id: int) -> Optional[UserResponse]:
+        """get() for code on the event loop"""
+        profile = self._lookup(user_id)
+        if profile is _MISSING:
+            profile = self._store(user_id, (await db.execute(self._query(user_id))).first())
+        return profile
+
+    # ============================================
+    # INVALIDATION
+    # ============================================
+
+    def invalidate(self, user_ids: Iterable[int], db: Optional[Session] = None):
+        """
+        Drop these profiles here and, given the writing session, in every worker
+
+        Call before db.commit(): the NOTIFY is part of the transaction, so other
+        workers never drop a profile for a write that was rolled back.
+        """
+        user_ids = list(user_ids)
+        self._drop(user_ids)
+        self.stats["invalidations"] += len(user_ids)
+        if db is not None and user_ids and db.bind.dialect.name == "postgresql":
+            db.execute(*self._notify_statement(user_ids))
+
+    async def invalidate_async(self, user_ids: Iterable[int], db: AsyncSession):
+        """invalidate() for code on the event loop"""
+        user_ids = list(user_ids)
+        self._drop(user_ids)
+        self.stats["invalidations"] += len(user_ids)
+        if user_ids and db.bind.dialect.name == "postgresql":
+            await db.execute(*self._notify_statement(user_ids))
+
+    def _notify_statement(self, user_ids: List[int]) -> tuple:
+        return (
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": self.CHANNEL, "payload": ",".join(str(user_id) for user_id in user_ids)}
+        )
+
+    def _drop(self, user_ids: Iterable[int]):
+        now = time.monotonic()
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+                self._invalidated[user_id] = now
+                self._invalidated.move_to_end(user_id)
+            self._forget_old_invalidations()
+
+    def _forget_old_invalidations(self):
+        cutoff = time.monotonic() - self.INVALIDATION_GRACE_SECONDS
+        while self._invalidated and next(iter(self._invalidated.values())) < cutoff:
+            self._invalidated.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _on_notify(self, connection, pid, channel, payload):
+        user_ids = [int(user_id) for user_id in payload.split(",") if user_id]
+        self._drop(user_ids)
+        self.stats["remote_invalidations"] += len(user_ids)
+
+    async def start(self):
+        """LISTEN for invalidations from other workers until stopped (PostgreSQL only)"""
+        url = make_url(ASYNC_DATABASE_URL)
+        if not self.ENABLED or not url.drivername.startswith("postgresql"):
+            return
+
+        import asyncpg
+
+        self.running = True
+        dsn = url.set(drivername="postgresql").render_as_string(hide_password=False)
+        logger.info(f"👤 Profile cache listening on {self.CHANNEL}")
+
+        while self.running:
+            connection = None
+            try:
+                connection = await asyncpg.connect(dsn)
+                await connection.add_listener(self.CHANNEL, self._on_notify)
+                self.clear()  # Invalidations sent while not listening were missed
+                self.listening = True
+                while self.running and not connection.is_closed():
+                    await asyncio.sleep(1)
+            except Exception as e:
+                logger.error(f"❌ Profile invalidation listener failed: {e}")
+            finally:
+                self.listening = False
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+            if self.running:
+                await asyncio.sleep(self.RECONNECT_SECONDS)
+
+    async def stop(self):
+        self.running = False
+
+    def get_stats(self) -> dict:
+        """Hit rate and invalidation counters for the metrics endpoint"""
+        lookups = self.stats["hits"] + self.stats["misses"] + self.stats["expired"]
+        return {
+            "enabled": self.ENABLED,
+            "size": len(self._entries),
+            "max_entries": self.MAX_ENTRIES,
+            "ttl_seconds": self.TTL_SECONDS,
+            "hits": self.stats["hits"],
+            "misses": self.stats["misses"],
+            "expired": self.stats["expired"],
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else None,
+            "evictions": self.stats["evictions"],
+            "invalidations": self.stats["invalidations"],
+            "remote_invalidations": self.stats["remote_invalidations"],
+            "not_cached_recent_write": self.stats["not_cached_recent_write"],
+            "listening": self.listening
+        }
+
+
+# Global profile cache instance
+profile_cache = ProfileCache()
@@ -0,0 +1,276 @@
+"""
+Query Profiler
+Opt-in SQL statistics per FastAPI route / MatchingEngine worker, from SQLAlchemy cursor events
+"""
+
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BACKGROUND_SOURCE = "background"  # Statements outside any request or worker iteration
+OTHER_STATEMENTS = "<other statements>"
+
+_NORMALIZE_PATTERNS = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),                                # String literals
+    (re.compile(r"%\(\w+\)s|\$\d+|:\w+\b|\?"), "?"),                     # Bind parameters (any DBAPI style)
+    (re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b"), "?"),                   # Numeric literals (not users_1)
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))+"), "(...), ..."),  # Multi-row VALUES
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)"), "(...)"),                # IN lists
+    (re.compile(r"\s+"), " "),
+]
+
+
+class _Unit:
+    """One request or worker iteration: statements are buffered and merged once at the end"""
+    __slots__ = ("source", "sampled", "statements")
+
+    def __init__(self, source: Union[str, Callable[[], str]], sampled: bool):
+        self.source = source
+        self.sampled = sampled
+        self.statements: List[Tuple[str, float]] = []  # (raw statement, ms)
+
+    @property
+    def name(self) -> str:
+        return self.source() if callable(self.source) else self.source
+
+
+class _SourceStats:
+    __slots__ = ("units", "queries", "db_ms", "max_ms", "statements")
+
+    def __init__(self):
+        self.units = 0
+        self.queries = 0
+        self.db_ms = 0.0
+        self.max_ms = 0.0
+        self.statements: Dict[str, List[float]] = {}  # normalized -> [count, total ms, max ms]
+
+
+_current_unit: ContextVar[Optional[_Unit]] = ContextVar("query_profiler_unit", default=None)
+
+
+class QueryProfiler:
+    """
+    Query count, DB time and heaviest statements per route or worker
+
+    Disabled unless QUERY_PROFILER_ENABLED=true. HTTP requests are attributed
+    to their route template ("GET /api/rides/{ride_id}") by
+    QueryProfilerMiddleware; MatchingEngine workers wrap each iteration in
+    unit("matching_engine.<worker>"). Everything else counts as "background".
+
+    Whether a unit is aggregated is decided once per unit with SAMPLE_RATE, so
+    per-request query counts stay exact for the sampled ones; its statements
+    are buffered without locking and merged into the current one-minute bucket
+    at the end. The report covers the last WINDOW_MINUTES buckets. Every
+    statement is timed regardless of sampling, and those slower than
+    SLOW_QUERY_MS are logged (normalized) and kept for the report.
+    """
+
+    ENABLED = os.getenv("QUERY_PROFILER_ENABLED", "false").lower() == "true"
+    SAMPLE_RATE = float(os.getenv("QUERY_PROFILER_SAMPLE_RATE", "1.0"))
+    SLOW_QUERY_MS = float(os.getenv("QUERY_PROFILER_SLOW_QUERY_MS", "100"))
+    WINDOW_MINUTES = int(os.getenv("QUERY_PROFILER_WINDOW_MINUTES", "15"))
+    MAX_STATEMENTS_PER_SOURCE = 100  # Distinct normalized statements kept per source and bucket
+    MAX_SLOW_QUERIES = 50
+
+    def __init__(self):
+        self.installed = False
+        self._buckets = deque(maxlen=self.WINDOW_MINUTES)  # (minute, {source: _SourceStats})
+        self._slow_queries = deque(maxlen=self.MAX_SLOW_QUERIES)
+        self._normalized: Dict[str, str] = {}  # Raw statement -> normalized (statements repeat)
+        self._lock = threading.Lock()  # Sync handlers run in a thread pool
+
+    def install(self):
+        """Listen to cursor events of every engine (sync, async and replicas)"""
+        if self.installed:
+            return
+        event.listen(Engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", self._after_cursor_execute)
+        self.installed = True
+        logger.info(f"🔬 Query profiler enabled (sample rate {self.SAMPLE_RATE:g}, slow query {self.SLOW_QUERY_MS:g} ms)")
+
+    # ============================================
+    # ATTRIBUTION
+    # ============================================
+
+    @contextmanager
+    def unit(self, source: Union[str, Callable[[], str]]):
+        """Attribute the statements run inside the block to source (a name or a callable returning one)"""
+        if not self.installed:
+            yield
+            return
+
+        unit = _Unit(source, random.random() < self.SAMPLE_RATE)
+        token = _current_unit.set(unit)
+        try:
+            yield
+        finally:
+            _current_unit.reset(token)
+            if unit.sampled:
+                self._record(unit.name, unit.statements, units=1)
+
+    # ============================================
+    # CURSOR EVENTS
+    # ============================================
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context._query_profiler_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_query_profiler_start", None)
+        if started is None:
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        unit = _current_unit.get()
+
+        if elapsed_ms >= self.SLOW_QUERY_MS:
+            self._log_slow(unit.name if unit else BACKGROUND_SOURCE, statement, elapsed_ms)
+
+        if unit is not None:
+            if unit.sampled:
+                unit.statements.append((statement, elapsed_ms))
+        elif random.random() < self.SAMPLE_RATE:
+            self._record(BACKGROUND_SOURCE, [(statement, elapsed_ms)], units=0)
+
+    # ============================================
+    # AGGREGATION
+    # ============================================
+
+    def normalize(self, statement: str) -> str:
+        """Statement with literals and bind parameters replaced by ?, IN lists and VALUES rows collapsed"""
+        normalized = self._normalized.get(statement)
+        if normalized is None:
+            normalized = statement
+            for pattern, replacement in _NORMALIZE_PATTERNS:
+                normalized = pattern.sub(replacement, normalized)
+            normalized = normalized.strip()
+            if len(self._normalized) >= 1000:
+                self._normalized.clear()
+            self._normalized[statement] = normalized
+        return normalized
+
+    def _log_slow(self, source: str, statement: str, elapsed_ms: float):
+        normalized = self.normalize(statement)
+        logger.warning(f"🐢 Slow query ({elapsed_ms:.0f} ms) in {source}: {normalized}")
+        self._slow_queries.append({
+            "at": time.time(),
+            "source": source,
+            "ms": round(elapsed_ms, 2),
+            "statement": normalized
+        })
+
+    def _record(self, source: str, statements: List[Tuple[str, float]], units: int):
+        # Aggregate outside the lock, merge inside
+        aggregated: Dict[str, List[float]] = {}
+        for statement, elapsed_ms in statements:
+            normalized = self.normalize(statement)
+            entry = aggregated.get(normalized)
+            if entry is None:
+                aggregated[normalized] = [1, elapsed_ms, elapsed_ms]
+            else:
+                entry[0] += 1
+                entry[1] += elapsed_ms
+                entry[2] = max(entry[2], elapsed_ms)
+
+        minute = int(time.time() // 60)
+        with self._lock:
+            if not self._buckets or self._buckets[-1][0] != minute:
+                self._buckets.append((minute, {}))
+            stats = self._buckets[-1][1].get(source)
+            if stats is None:
+                stats = self._buckets[-1][1][source] = _SourceStats()
+
+            stats.units += units
+            for normalized, (count, total_ms, max_ms) in aggregated.items():
+                stats.queries += count
+                stats.db_ms += total_ms
+                stats.max_ms = max(stats.max_ms, max_ms)
+                if normalized not in stats.statements and len(stats.statements) >= self.MAX_STATEMENTS_PER_SOURCE:
+                    normalized = OTHER_STATEMENTS
+                entry = stats.statements.setdefault(normalized, [0, 0.0, 0.0])
+                entry[0] += count
+                entry[1] += total_ms
+                entry[2] = max(entry[2], max_ms)
+
+    def report(self, top: int = 5) -> dict:
+        """Per-source totals over the rolling window, heaviest sources first"""
+        oldest = int(time.time() // 60) - self.WINDOW_MINUTES + 1
+        merged: Dict[str, _SourceStats] = {}
+        with self._lock:
+            for minute, sources in self._buckets:
+                if minute < oldest:
+                    continue
+                for source, stats in sources.items():
+                    total = merged.setdefault(source, _SourceStats())
+                    total.units += stats.units
+                    total.queries += stats.queries
+                    total.db_ms += stats.db_ms
+                    total.max_ms = max(total.max_ms, stats.max_ms)
+                    for normalized, (count, total_ms, max_ms) in stats.statements.items():
+                        entry = total.statements.setdefault(normalized, [0, 0.0, 0.0])
+                        entry[0] += count
+                        entry[1] += total_ms
+                        entry[2] = max(entry[2], max_ms)
+            slow_queries = list(self._slow_queries)
+
+        sources = []
+        for source, stats in sorted(merged.items(), key=lambda item: item[1].db_ms, reverse=True):
+            statements = sorted(stats.statements.items(), key=lambda item: item[1][1], reverse=True)[:top]
+            sources.append({
+                "source": source,
+                "units": stats.units,
+                "queries": stats.queries,
+                "queries_per_unit": round(stats.queries / stats.units, 2) if stats.units else None,
+                "db_ms": round(stats.db_ms, 2),
+                "db_ms_per_unit": round(stats.db_ms / stats.units, 3) if stats.units else None,
+                "max_ms": round(stats.max_ms, 2),
+                "top_statements": [
+                    {"statement": normalized, "count": count, "total_ms": round(total_ms, 2), "max_ms": round(max_ms, 2)}
+                    for normalized, (count, total_ms, max_ms) in statements
+                ]
+            })
+
+        return {
+            "enabled": self.installed,
+            "sample_rate": self.SAMPLE_RATE,
+            "window_minutes": self.WINDOW_MINUTES,
+            "slow_query_ms": self.SLOW_QUERY_MS,
+            "sources": sources,
+            "slow_queries": slow_queries
+        }
+
+
+def _route_name(scope: dict) -> str:
+    route = scope.get("route")  # Set by the router once the request is matched
+    return f"{scope.get('method', 'WS')} {route.path if route else scope.get('path')}"
+
+
+class QueryProfilerMiddleware:
+    """Makes every HTTP request a profiler unit named after its route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with query_profiler.unit(lambda: _route_name(scope)):
+            await self.app(scope, receive, send)
+
+
+# Global query profiler instance
+query_profiler = QueryProfiler()
@@ -0,0 +1,70 @@
+"""
+Ride Relay Shaping
+Server-side throttling and deduplication of location frames on the ride channel
+"""
+
+import math
+import os
+import time
+from collections import Counter
+from typing import Optional, Tuple
+
+EARTH_RADIUS_M = 6371000
+
+
+def _distance_m(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    """Equirectangular approximation - accurate to well under 1% at relay distances"""
+    x = math.radians(b[1] - a[1]) * math.cos(math.radians((a[0] + b[0]) / 2))
+    y = math.radians(b[0] - a[0])
+    return EARTH_RADIUS_M * math.hypot(x, y)
+
+
+class LocationShaper:
+    """
+    Decides which location updates from one sender on a ride channel are relayed
+
+    Only location updates reach the shaper: ConnectionManager.send_location
+    decodes each message once and relays anything else unshaped and undroppable.
+
+    - Frames arriving less than MIN_INTERVAL_MS after the last relayed one are dropped.
+      The default sits below the ~1 s client reporting period, so jitter in arrival
+      times does not drop every other frame
+    - Frames that moved less than MIN_DISPLACEMENT_M from the last relayed position are dropped
+      (set to 0 to skip the check), unless nothing was relayed for MAX_SILENCE_MS so a
+      reconnecting receiver still gets a position
+    - Latest-wins coalescing of frames the receiver has not consumed yet happens in the
+      receiver's OutboundQueue (see ConnectionManager.send_location)
+    """
+
+    MIN_INTERVAL_MS = int(os.getenv("RIDE_RELAY_MIN_INTERVAL_MS", "800"))
+    MIN_DISPLACEMENT_M = float(os.getenv("RIDE_RELAY_MIN_DISPLACEMENT_M", "3"))
+    MAX_SILENCE_MS = int(os.getenv("RIDE_RELAY_MAX_SILENCE_MS", "10000"))
+    COALESCE = os.getenv("RIDE_RELAY_COALESCE", "true").lower() == "true"
+
+    def __init__(self, stats: Counter):
+        self.stats = stats  # Shared relay counters
+        self._last_sent_ms = 0.0
+        self._last_position: Optional[Tuple[float, float]] = None
+
+    def admit(self, latitude: float, longitude: float) -> bool:
+        """True if the location update should be relayed"""
+        self.stats["received"] += 1
+        position = (latitude, longitude)
+        now = time.monotonic() * 1000
+        if now - self._last_sent_ms < self.MIN_INTERVAL_MS:
+            self.stats["dropped_interval"] += 1
+            return False
+
+        if (
+            self.MIN_DISPLACEMENT_M > 0
+            and self._last_position
+            and now - self._last_sent_ms < self.MAX_SILENCE_MS
+            and _distance_m(self._last_position, position) < self.MIN_DISPLACEMENT_M
+        ):
+            self.stats["dropped_stationary"] += 1
+            return False
+
+        self._last_position = position
+        self._last_sent_ms = now
+        self.stats["forwarded"] += 1
+        return True
@@ -0,0 +1,145 @@
+"""
+Ride Archiver
+Moves finished rides out of the hot rides table into rides_archive in batches
+"""
+
+import asyncio
+import logging
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import DateTime, delete, func, insert, literal, select, text
+from sqlalchemy.orm import Session
+
+from ..db.database import SessionLocal
+from ..db.models import FINISHED_RIDE_STATUSES, Ride, RideArchive
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class RideArchiver:
+    """
+    Keeps rides holding only active states, so the matcher's and expiry worker's
+    indexes stay the same size however much history accumulates
+
+    Rides completed or cancelled more than ARCHIVE_AFTER_MINUTES ago are copied to
+    rides_archive and deleted from rides in one transaction per batch of
+    BATCH_SIZE (rows locked with SKIP LOCKED, so the archiver never waits on the
+    matcher). Each run drains all eligible rides batch by batch, off the event loop.
+    """
+
+    ENABLED = os.getenv("RIDE_ARCHIVE_ENABLED", "true").lower() == "true"
+    ARCHIVE_AFTER_MINUTES = float(os.getenv("RIDE_ARCHIVE_AFTER_MINUTES", "60"))
+    INTERVAL_SECONDS = float(os.getenv("RIDE_ARCHIVE_INTERVAL_SECONDS", "60"))
+    BATCH_SIZE = int(os.getenv("RIDE_ARCHIVE_BATCH_SIZE", "1000"))
+
+    ARCHIVED_COLUMNS = [column.name for column in Ride.__table__.columns]
+
+    def __init__(self):
+        self.running = False
+        self.stats = Counter()
+        self._partitions = set()  # Monthly archive partitions known to exist
+
+    async def start(self):
+        """Archive finished rides every INTERVAL_SECONDS until stopped"""
+        if not self.ENABLED:
+            logger.info("📦 Ride archiver disabled")
+            return
+
+        self.running = True
+        logger.info(f"📦 Ride archiver started (rides finished > {self.ARCHIVE_AFTER_MINUTES:g} min ago)")
+        loop = asyncio.get_event_loop()
+
+        while self.running:
+            try:
+                archived = await loop.run_in_executor(None, self.archive)
+                if archived:
+                    logger.info(f"📦 Archived {archived} finished rides")
+            except Exception as e:
+                logger.error(f"❌ Error archiving rides: {e}", exc_info=True)
+            await asyncio.sleep(self.INTERVAL_SECONDS)
+
+    async def stop(self):
+        self.running = False
+
+    def archive(self, older_than_minutes: Optional[float] = None) -> int:
+        """Archive every eligible ride, one batch per transaction; returns the number moved"""
+        cutoff = datetime.utcnow() - timedelta(
+            minutes=self.ARCHIVE_AFTER_MINUTES if older_than_minutes is None else older_than_minutes
+        )
+        total = 0
+        while True:
+            moved = self.archive_batch(cutoff)
+            total += moved
+            if moved < self.BATCH_SIZE:
+                return total
+
+    def archive_batch(self, cutoff: datetime) -> int:
+        """Move up to BATCH_SIZE rides finished before cutoff"""
+        db = SessionLocal()
+        try:
+            finished_at = func.coalesce(Ride.completed_at, Ride.cancelled_at, Ride.created_at)
+            rows = db.execute(
+                select(Ride.id, Ride.created_at).filter(
+                    Ride.status.in_(FINISHED_RIDE_STATUSES),
+                    finished_at < cutoff
+                ).order_by(Ride.id).limit(self.BATCH_SIZE).with_for_update(skip_locked=True)
+            ).all()
+            if not rows:
+                return 0
+
+            ids = [ride_id for ride_id, _ in rows]
+            now = datetime.utcnow()
+            months = self._ensure_partitions(db, [created_at or now for _, created_at in rows])
+
+            columns = [getattr(Ride, name) for name in self.ARCHIVED_COLUMNS if name != "created_at"]
+            db.execute(
+                insert(RideArchive).from_select(
+                    [name for name in self.ARCHIVED_COLUMNS if name != "created_at"] + ["created_at", "archived_at"],
+                    select(*columns, func.coalesce(Ride.created_at, literal(now, DateTime)), literal(now, DateTime)).filter(Ride.id.in_(ids))
+                )
+            )
+            db.execute(delete(Ride).filter(Ride.id.in_(ids)))
+            db.commit()
+
+            self._partitions.update(months)
+            self.stats["archived"] += len(ids)
+            self.stats["batches"] += 1
+            return len(ids)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _ensure_partitions(self, db: Session, created: list) -> set:
+        """Create the monthly partitions (PostgreSQL) for these created_at values; returns the months"""
+        if db.bind.dialect.name != "postgresql":
+            return set()
+
+        months = {(value.year, value.month) for value in created} - self._partitions
+        for year, month in sorted(months):
+            start = datetime(year, month, 1)
+            end = datetime(year + month // 12, month % 12 + 1, 1)
+            db.execute(text(
+                f"CREATE TABLE IF NOT EXISTS rides_archive_{year}_{month:02d} PARTITION OF rides_archive "
+                f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+            ))
+        return months
+
+    def get_stats(self) -> dict:
+        """Archiver counters for the metrics endpoint"""
+        return {
+            "enabled": self.ENABLED,
+            "archived": self.stats["archived"],
+            "batches": self.stats["batches"],
+            "archive_after_minutes": self.ARCHIVE_AFTER_MINUTES
+        }
+
+
+# Global ride archiver instance
+ride_archiver = RideArchiver()
@@ -0,0 +1,63 @@
+"""
+Ride State Machine
+Central transition table and single-statement conditional status changes
+"""
+
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from ..db.models import RIDE_STATUSES, Ride
+
+# Status -> statuses it may move to (anything not listed is rejected)
+RIDE_TRANSITIONS: Dict[str, Tuple[str, ...]] = {
+    "requested": ("offering", "cancelled"),
+    "offering": ("accepted", "requested", "cancelled"),  # Back to requested on decline / timeout
+    "accepted": ("in_progress", "completed", "cancelled"),
+    "in_progress": ("completed",),
+    "completed": (),
+    "cancelled": (),
+    "declined": (),
+    "expired": (),
+}
+
+# Target status -> statuses it may be reached from
+_SOURCES: Dict[str, Tuple[str, ...]] = {
+    target: tuple(source for source, targets in RIDE_TRANSITIONS.items() if target in targets)
+    for target in RIDE_STATUSES
+}
+
+
+def transition_statement(to_status: str, *conditions, **values):
+    """
+    UPDATE rides SET status = to_status, **values
+    WHERE status IN (allowed sources) AND conditions RETURNING rides.*
+
+    The status check happens in the same statement as the write, so two
+    concurrent transitions cannot both succeed and no row lock is held while
+    Python code runs: the loser simply updates no row.
+    """
+    return (
+        update(Ride)
+        .filter(Ride.status.in_(_SOURCES[to_status]), *conditions)
+        .values(status=to_status, **values)
+        .returning(Ride)
+        .execution_options(synchronize_session=False, populate_existing=True)
+    )
+
+
+def transition(db: Session, ride_id: int, to_status: str, *conditions, **values) -> Optional[Ride]:
+    """Move one ride to to_status; returns the updated ride, or None if it was not allowed"""
+    return db.execute(transition_statement(to_status, Ride.id == ride_id, *conditions, **values)).scalars().first()
+
+
+async def transition_async(db: AsyncSession, ride_id: int, to_status: str, *conditions, **values) -> Optional[Ride]:
+    """transition() for code on the event loop"""
+    return (await db.execute(transition_statement(to_status, Ride.id == ride_id, *conditions, **values))).scalars().first()
+
+
+def current_status(db: Session, ride_id: int) -> Optional[str]:
+    """Status of a ride (None if it does not exist) - for explaining a rejected transition"""
+    return db.execute(select(Ride.status).filter(Ride.id == ride_id)).scalar()
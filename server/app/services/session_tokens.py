@@ -0,0 +1,238 @@
+"""
+Session Tokens
+Compact HMAC-signed tokens issued at login, verified without touching the database
+"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import struct
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+from ..db.database import ASYNC_DATABASE_URL, SessionLocal
+from ..db.models import RevokedSession
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TOKEN_VERSION = 1
+_PAYLOAD = struct.Struct(">BIBII8s")  # version, user id, is driver, issued at, expires at, token id
+_SIGNATURE_BYTES = 16  # Truncated HMAC-SHA256 (128 bits)
+_TOKEN_BYTES = _PAYLOAD.size + _SIGNATURE_BYTES
+
+
+class SessionClaims:
+    """What a valid token says about its bearer"""
+    __slots__ = ("user_id", "is_driver", "token_id", "expires_at")
+
+    def __init__(self, user_id: int, is_driver: bool, token_id: str, expires_at: int):
+        self.user_id = user_id
+        self.is_driver = is_driver
+        self.token_id = token_id
+        self.expires_at = expires_at  # Unix seconds
+
+
+class SessionTokens:
+    """
+    Bearer tokens carrying user id and role, signed with SESSION_TOKEN_SECRETS
+
+    A token is 38 bytes - version, user id, driver flag, issue and expiry time,
+    random token id and a truncated HMAC-SHA256 - as 51 URL-safe base64
+    characters. verify() is a decode and one HMAC per configured secret: the
+    first secret signs, the others only verify, so secrets can be rotated
+    without logging everyone out. Without SESSION_TOKEN_SECRETS a random
+    secret is generated and tokens only work in this process.
+
+    Logout revokes a token: it is added to the in-memory revocation set and
+    to revoked_sessions (kept until the token would have expired anyway). On
+    PostgreSQL the revocation is also sent with NOTIFY on CHANNEL so every
+    worker learns it at commit; all workers load the unexpired revocations
+    at startup and again whenever their listener reconnects.
+    """
+
+    SECRETS = [secret.strip() for secret in os.getenv("SESSION_TOKEN_SECRETS", "").split(",") if secret.strip()]
+    TTL_SECONDS = int(os.getenv("SESSION_TOKEN_TTL_SECONDS", str(24 * 3600)))
+    CHANNEL = "session_revocation"
+    RECONNECT_SECONDS = 5
+
+    def __init__(self):
+        self.running = False
+        self.listening = False
+        self.stats = Counter()
+        if not self.SECRETS:
+            logger.warning("⚠️ SESSION_TOKEN_SECRETS not set - session tokens are only valid in this process")
+        self._keys = [secret.encode("utf-8") for secret in self.SECRETS] or [secrets.token_bytes(32)]
+        self._revoked: Dict[str, int] = {}  # token id -> token expiry (unix seconds)
+        self._lock = threading.Lock()
+
+    # ============================================
+    # ISSUE / VERIFY
+    # ============================================
+
+    def _sign(self, key: bytes, payload: bytes) -> bytes:
+        return hmac.new(key, payload, hashlib.sha256).digest()[:_SIGNATURE_BYTES]
+
+    def issue(self, user_id: int, is_driver: bool) -> Tuple[str, int]:
+        """New token for the user; returns (token, expiry in unix seconds)"""
+        issued_at = int(time.time())
+        expires_at = issued_at + self.TTL_SECONDS
+        payload = _PAYLOAD.pack(TOKEN_VERSION, user_id, bool(is_driver), issued_at, expires_at, secrets.token_bytes(8))
+        token = base64.urlsafe_b64encode(payload + self._sign(self._keys[0], payload)).rstrip(b"=").decode("ascii")
+        self.stats["issued"] += 1
+        return token, expires_at
+
+    def verify(self, token: str) -> Optional[SessionClaims]:
+        """Claims of a genuine, unexpired, unrevoked token; None otherwise"""
+        try:
+            raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        except (ValueError, TypeError):
+            raw = b""
+        if len(raw) != _TOKEN_BYTES:
+            self.stats["malformed"] += 1
+            return None
+
+        payload, signature = raw[:_PAYLOAD.size], raw[_PAYLOAD.size:]
+        if not any(hmac.compare_digest(self._sign(key, payload), signature) for key in self._keys):
+            self.stats["bad_signature"] += 1
+            return None
+
+        version, user_id, is_driver, _, expires_at, token_id = _PAYLOAD.unpack(payload)
+        if version != TOKEN_VERSION:
+            self.stats["malformed"] += 1
+            return None
+        if expires_at <= time.time():
+            self.stats["expired"] += 1
+            return None
+        token_id = token_id.hex()
+        if token_id in self._revoked:
+            self.stats["revoked"] += 1
+            return None
+
+        self.stats["verified"] += 1
+        return SessionClaims(user_id, bool(is_driver), token_id, expires_at)
+
+    # ============================================
+    # REVOCATION
+    # ============================================
+
+    def revoke(self, claims: SessionClaims, db: Session):
+        """
+        Revoke the token everywhere; call before db.commit()
+
+        The row and the NOTIFY are part of the caller's transaction.
+        """
+        self._add_revoked(claims.token_id, claims.expires_at)
+        db.add(RevokedSession(
+            token_id=claims.token_id,
+            user_id=claims.user_id,
+            expires_at=datetime.utcfromtimestamp(claims.expires_at)
+        ))
+        db.execute(delete(RevokedSession).filter(RevokedSession.expires_at < datetime.utcnow()))
+        if db.bind.dialect.name == "postgresql":
+            db.execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                {"channel": self.CHANNEL, "payload": f"{claims.token_id}:{claims.expires_at}"}
+            )
+        self.stats["revocations"] += 1
+
+    def _add_revoked(self, token_id: str, expires_at: int):
+        now = time.time()
+        with self._lock:
+            if expires_at > now:
+                self._revoked[token_id] = expires_at
+            # Revocations are rare: drop the ones whose tokens expired on the way
+            for expired in [token_id for token_id, expiry in self._revoked.items() if expiry <= now]:
+                del self._revoked[expired]
+
+    def load_revocations(self):
+        """Replace the revocation set with the unexpired rows of revoked_sessions"""
+        db = SessionLocal()
+        try:
+            rows = db.execute(
+                select(RevokedSession.token_id, RevokedSession.expires_at)
+                .filter(RevokedSession.expires_at > datetime.utcnow())
+            ).all()
+        finally:
+            db.close()
+
+        epoch = datetime(1970, 1, 1)
+        revoked = {token_id: int((expires_at - epoch).total_seconds()) for token_id, expires_at in rows}
+        with self._lock:
+            self._revoked = revoked
+
+    def _on_notify(self, connection, pid, channel, payload):
+        token_id, _, expires_at = payload.partition(":")
+        self._add_revoked(token_id, int(expires_at))
+        self.stats["remote_revocations"] += 1
+
+    async def start(self):
+        """Load revocations, then LISTEN for new ones from other workers until stopped (PostgreSQL)"""
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(None, self.load_revocations)
+        except Exception as e:
+            logger.error(f"❌ Failed to load session revocations: {e}")
+
+        url = make_url(ASYNC_DATABASE_URL)
+        if not url.drivername.startswith("postgresql"):
+            return
+
+        import asyncpg
+
+        self.running = True
+        dsn = url.set(drivername="postgresql").render_as_string(hide_password=False)
+        logger.info(f"🔑 Session tokens listening on {self.CHANNEL}")
+
+        while self.running:
+            connection = None
+            try:
+                connection = await asyncpg.connect(dsn)
+                await connection.add_listener(self.CHANNEL, self._on_notify)
+                await loop.run_in_executor(None, self.load_revocations)  # Revocations sent while not listening
+                self.listening = True
+                while self.running and not connection.is_closed():
+                    await asyncio.sleep(1)
+            except Exception as e:
+                logger.error(f"❌ Session revocation listener failed: {e}")
+            finally:
+                self.listening = False
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+            if self.running:
+                await asyncio.sleep(self.RECONNECT_SECONDS)
+
+    async def stop(self):
+        self.running = False
+
+    def get_stats(self) -> dict:
+        """Issue / verification outcomes and revocation set size for the metrics endpoint"""
+        return {
+            "ttl_seconds": self.TTL_SECONDS,
+            "secrets": len(self.SECRETS),
+            "issued": self.stats["issued"],
+            "verified": self.stats["verified"],
+            "rejected": {
+                reason: self.stats[reason] for reason in ("malformed", "bad_signature", "expired", "revoked")
+            },
+            "revocations": self.stats["revocations"],
+            "remote_revocations": self.stats["remote_revocations"],
+            "revoked_cached": len(self._revoked),
+            "listening": self.listening
+        }
+
+
+# Global session token instance
+session_tokens = SessionTokens()
@@ -0,0 +1,289 @@
+"""
+GPS Trail Store
+Append-only, time-partitioned storage for per-ride location trails
+
+Points are buffered in memory by append() (no I/O on the relay path) and a
+background worker writes them once per flush interval to hourly segment files,
+one pair per writing process so concurrent workers never share an offset:
+
+    <GPS_TRAIL_DIR>/<YYYYMMDDHH>.<host>-<pid>.trail   blocks of packed points
+    <GPS_TRAIL_DIR>/<YYYYMMDDHH>.<host>-<pid>.idx     (ride_id, offset) per block
+
+Readers merge every file of an hour (including <YYYYMMDDHH>.trail/.idx written
+by earlier versions) by point timestamp.
+
+Block layout (little-endian):
+    uint32 ride_id, uint32 count, int64 base_ts_ms, int32 base_lat_e7, int32 base_lng_e7
+    then count - 1 x (int32 dts_ms, int32 dlat_e7, int32 dlng_e7) deltas from the previous point
+"""
+
+import asyncio
+import heapq
+import logging
+import os
+import re
+import socket
+import struct
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from . import location_codec
+from .location_codec import COORD_SCALE, MAX_CLOCK_SKEW_MS
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BLOCK_HEADER = struct.Struct("<IIqii")
+INDEX_ENTRY = struct.Struct("<IQ")
+DELTA_SIZE = 12
+INT32_MIN, INT32_MAX = -2 ** 31, 2 ** 31 - 1
+HOUR_MS = 3_600_000
+INDEX_READ_ENTRIES = 4096  # Index entries read per chunk (48 KiB)
+
+Point = Tuple[int, int, int]  # (ts_ms, lat_e7, lng_e7)
+
+_HOST = re.sub(r"[^A-Za-z0-9_-]", "_", socket.gethostname())  # No dots: they separate the file name parts
+
+
+def _segment_name(ts_ms: int) -> str:
+    return datetime.utcfromtimestamp(ts_ms / 1000).strftime("%Y%m%d%H")
+
+
+def _writer_id() -> str:
+    """Host and process of this writer (read per flush: workers may be forked after import)"""
+    return f"{_HOST}-{os.getpid()}"
+
+
+def _split_blocks(points: List[Point]) -> Iterator[List[Point]]:
+    """
+    Cut a ride's sorted points into blocks that stay within one hourly segment
+    and whose deltas fit in int32 (e.g. a longitude jump across the antimeridian)
+    """
+    start = 0
+    for i in range(1, len(points)):
+        prev, point = points[i - 1], points[i]
+        if (
+            point[0] // HOUR_MS != prev[0] // HOUR_MS
+            or not INT32_MIN <= point[1] - prev[1] <= INT32_MAX
+            or not INT32_MIN <= point[2] - prev[2] <= INT32_MAX
+        ):
+            yield points[start:i]
+            start = i
+    yield points[start:]
+
+
+def _pack_block(ride_id: int, points: List[Point]) -> bytes:
+    base_ts, base_lat, base_lng = points[0]
+    deltas = []
+    prev_ts, prev_lat, prev_lng = base_ts, base_lat, base_lng
+    for ts, lat, lng in points[1:]:
+        deltas.extend((ts - prev_ts, lat - prev_lat, lng - prev_lng))
+        prev_ts, prev_lat, prev_lng = ts, lat, lng
+    header = BLOCK_HEADER.pack(ride_id, len(points), base_ts, base_lat, base_lng)
+    return header + struct.pack(f"<{len(deltas)}i", *deltas)
+
+
+class TrailStore:
+    """
+    Per-ride GPS trails packed as int32 deltas in hourly segment files
+
+    append() only touches memory; flush() runs in an executor thread. Reads
+    stream points block by block and scan the segment index in fixed-size
+    chunks, so neither a long trail nor a busy hour's index sits in memory whole.
+
+    Points outside ±90 / ±180 degrees are refused at append time. Timestamps
+    older than MAX_POINT_AGE_MS or further ahead than the allowed clock skew
+    (e.g. a frame sent before the ride epoch was known) are replaced by the
+    time of receipt.
+    """
+
+    DIRECTORY = os.getenv("GPS_TRAIL_DIR", "gps_trails")
+    FLUSH_INTERVAL_SECONDS = float(os.getenv("GPS_TRAIL_FLUSH_INTERVAL_SECONDS", "1"))
+    MAX_POINT_AGE_MS = int(os.getenv("GPS_TRAIL_MAX_POINT_AGE_MS", str(HOUR_MS)))
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or self.DIRECTORY
+        self.running = False
+        self.points_written = 0
+        self._pending: Dict[int, List[Point]] = {}
+        self._lock = threading.Lock()  # Swapped by the flush thread
+        self._write_lock = threading.Lock()  # One flush thread per process at a time (files are per process)
+
+    def append(self, ride_id: int, latitude: float, longitude: float, ts_ms: int) -> bool:
+        """Buffer one point (no I/O); False if the position is not finite or out of range"""
+        if not location_codec.is_valid_position(latitude, longitude):
+            return False
+        self._buffer(ride_id, (self._plausible_ts(ts_ms), round(latitude * COORD_SCALE), round(longitude * COORD_SCALE)))
+        return True
+
+    def _plausible_ts(self, ts_ms: int) -> int:
+        now = location_codec.now_ms()
+        if now - self.MAX_POINT_AGE_MS <= ts_ms <= now + MAX_CLOCK_SKEW_MS:
+            return ts_ms
+        return now
+
+    def _buffer(self, ride_id: int, point: Point):
+        with self._lock:
+            points = self._pending.get(ride_id)
+            if points is None:
+                self._pending[ride_id] = [point]
+            else:
+                points.append(point)
+
+    # ============================================
+    # FLUSH WORKER
+    # ============================================
+
+    async def start(self):
+        """Periodically write buffered points until stopped"""
+        self.running = True
+        logger.info(f"🛰️ Trail store started ({os.path.abspath(self.directory)})")
+        loop = asyncio.get_event_loop()
+
+        while self.running:
+            await asyncio.sleep(self.FLUSH_INTERVAL_SECONDS)
+            try:
+                await loop.run_in_executor(None, self.flush)
+            except Exception as e:
+                logger.error(f"❌ Error flushing GPS trails: {e}", exc_info=True)
+
+    async def stop(self):
+        self.running = False
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.flush)
+
+    def flush(self) -> int:
+        """Write all buffered points; returns the number of points written"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        # Group blocks by hourly segment (a ride's batch may straddle an hour boundary)
+        segments: Dict[str, List[Tuple[int, List[Point]]]] = {}
+        for ride_id, points in pending.items():
+            points.sort()
+            for block in _split_blocks(points):
+                segments.setdefault(_segment_name(block[0][0]), []).append((ride_id, block))
+
+        written = 0
+        os.makedirs(self.directory, exist_ok=True)
+        writer = _writer_id()
+        with self._write_lock:
+            for segment, blocks in segments.items():
+                base = os.path.join(self.directory, f"{segment}.{writer}")
+                with open(base + ".trail", "ab") as data_file, open(base + ".idx", "ab") as index_file:
+                    offset = data_file.tell()
+                    data = []
+                    index = []
+                    for ride_id, points in blocks:
+                        try:
+                            block = _pack_block(ride_id, points)
+                        except (struct.error, OverflowError) as e:
+                            # Only this ride's block is lost, not the whole batch
+                            logger.error(f"❌ Dropping {len(points)} GPS points of ride #{ride_id}: {e}")
+                            continue
+                        index.append(INDEX_ENTRY.pack(ride_id, offset))
+                        data.append(block)
+                        offset += len(block)
+                        written += len(points)
+                    data_file.write(b"".join(data))
+                    index_file.write(b"".join(index))
+
+        self.points_written += written
+        return written
+
+    # ============================================
+    # READ API
+    # ============================================
+
+    def iter_points(
+        self,
+        ride_id: int,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None
+    ) -> Iterator[Tuple[float, float, int]]:
+        """
+        Stream a ride's trail as (latitude, longitude, ts_ms), oldest first
+
+        Only segments between since and until (UTC, default: last 24 hours) are read.
+        Points still waiting for a flush are included at the end.
+        """
+        until = until or datetime.utcnow()
+        since = since or until - timedelta(hours=24)
+
+        files = self._segment_files()
+        hour = since.replace(minute=0, second=0, microsecond=0)
+        while hour <= until:
+            yield from self._read_segment(files.get(hour.strftime("%Y%m%d%H"), ()), ride_id)
+            hour += timedelta(hours=1)
+
+        with self._lock:
+            pending = sorted(self._pending.get(ride_id, ()))
+        for ts, lat, lng in pending:
+            yield lat / COORD_SCALE, lng / COORD_SCALE, ts
+
+    def _segment_files(self) -> Dict[str, List[str]]:
+        """Hourly segment -> base paths of its files (one per writing process)"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return {}
+        files: Dict[str, List[str]] = {}
+        for name in names:
+            if name.endswith(".idx"):
+                stem = name[:-len(".idx")]
+                files.setdefault(stem.split(".", 1)[0], []).append(os.path.join(self.directory, stem))
+        return files
+
+    @staticmethod
+    def _ride_offsets(index_path: str, ride_id: int) -> List[int]:
+        """Block offsets of the ride, scanning the index in fixed-size chunks"""
+        offsets = []
+        with open(index_path, "rb") as index_file:
+            while True:
+                chunk = index_file.read(INDEX_ENTRY.size * INDEX_READ_ENTRIES)
+                usable = len(chunk) - len(chunk) % INDEX_ENTRY.size  # Only the last chunk can be ragged
+                offsets.extend(
+                    offset for block_ride_id, offset in INDEX_ENTRY.iter_unpack(chunk[:usable])
+                    if block_ride_id == ride_id
+                )
+                if len(chunk) < INDEX_ENTRY.size * INDEX_READ_ENTRIES:
+                    return offsets
+
+    def _read_segment(self, bases: List[str], ride_id: int) -> Iterator[Tuple[float, float, int]]:
+        """Points of the ride in one hour, merged by timestamp across the hour's per-process files"""
+        streams = [self._read_file(base, ride_id) for base in bases]
+        if len(streams) == 1:
+            return streams[0]
+        # A ride relayed by two workers in the same hour has blocks in both files
+        return heapq.merge(*streams, key=lambda point: point[2])
+
+    def _read_file(self, base: str, ride_id: int) -> Iterator[Tuple[float, float, int]]:
+        offsets = self._ride_offsets(base + ".idx", ride_id)
+        if not offsets:
+            return
+
+        with open(base + ".trail", "rb") as data_file:
+            for offset in offsets:
+                data_file.seek(offset)
+                header = data_file.read(BLOCK_HEADER.size)
+                if len(header) < BLOCK_HEADER.size:
+                    return  # Truncated tail (crash during write)
+                _, count, ts, lat, lng = BLOCK_HEADER.unpack(header)
+                deltas = data_file.read((count - 1) * DELTA_SIZE)
+                if len(deltas) < (count - 1) * DELTA_SIZE:
+                    return
+
+                yield lat / COORD_SCALE, lng / COORD_SCALE, ts
+                for dts, dlat, dlng in struct.iter_unpack("<iii", deltas):
+                    ts += dts
+                    lat += dlat
+                    lng += dlng
+                    yield lat / COORD_SCALE, lng / COORD_SCALE, ts
+
+
+# Global trail store instance
+trail_store = TrailStore()
@@ -4,14 +4,14 @@ Check Rides - View all rides in the system
 import sys
 sys.path.insert(0, '../server')
 
-from app.db.database import SessionLocal
+from app.db.database import replica_router
 from app.db.models import Ride
 
 def main():
     print("\n📋 CURRENT RIDES")
     print("="*60)
     
-    db = SessionLocal()
+    db = replica_router.read_session()  # Replica when DATABASE_REPLICA_URLS is set
     try:
         rides = db.query(Ride).order_by(Ride.created_at.desc()).all()
         
@@ -5,14 +5,14 @@ Run this if anything isn't working
 import sys
 sys.path.insert(0, '../server')
 
-from app.db.database import SessionLocal
+from app.db.database import replica_router
 from app.db.models import User, Ride
 
 def main():
     print("\n🔍 SYSTEM STATUS CHECK")
     print("="*60)
     
-    db = SessionLocal()
+    db = replica_router.read_session()  # Replica when DATABASE_REPLICA_URLS is set
     try:
         # Check drivers
         drivers = db.query(User).filter(User.is_driver == True).all()
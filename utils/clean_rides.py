@@ -1,13 +1,33 @@
 """
 Clean Database - Remove all rides (use for testing)
+
+Usage:
+    python clean_rides.py                              Delete ALL rides (live and archived)
+    python clean_rides.py --archive [--older-than M]   Move finished rides to rides_archive now
+                                                       (finished more than M minutes ago, default 0)
 """
+import argparse
 import sys
 sys.path.insert(0, '../server')
 
 from app.db.database import SessionLocal
-from app.db.models import Ride
+from app.db.models import Ride, RideArchive
+from app.services.ride_archiver import ride_archiver
+
+def archive(older_than_minutes: float):
+    count = ride_archiver.archive(older_than_minutes=older_than_minutes)
+    print(f"📦 Archived {count} finished rides")
 
 def main():
+    parser = argparse.ArgumentParser(description="Delete or archive rides")
+    parser.add_argument("--archive", action="store_true", help="archive finished rides instead of deleting everything")
+    parser.add_argument("--older-than", type=float, default=0, metavar="MINUTES", help="only rides finished at least this long ago")
+    args = parser.parse_args()
+    
+    if args.archive:
+        archive(args.older_than)
+        return
+    
     confirm = input("⚠️  Delete ALL rides? (yes/no): ")
     if confirm.lower() != 'yes':
         print("Cancelled")
@@ -16,9 +36,11 @@ def main():
     db = SessionLocal()
     try:
         count = db.query(Ride).count()
+        archived = db.query(RideArchive).count()
         db.query(Ride).delete()
+        db.query(RideArchive).delete()
         db.commit()
-        print(f"✅ Deleted {count} rides")
+        print(f"✅ Deleted {count} rides ({archived} archived rides)")
     finally:
         db.close()
 